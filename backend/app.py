@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 import os
@@ -6,13 +6,19 @@ from datetime import datetime, timedelta
 import json
 from dotenv import load_dotenv
 import pandas as pd
+import numpy as np
+import base64
 import io
 from werkzeug.utils import secure_filename
 
 # Cargar variables de entorno
 load_dotenv()
 
-from models import Database, AuthManager, ReservationManager, MenuManager
+from models import Database, AuthManager, ReservationManager, MenuManager, HORA_NO_ALINEADA, slot_aligned
+from stock_ledger import setup_stock_ledger
+from scaling import CacheManager, task_queue
+from import_jobs import ImportJobManager
+from upload_reader import ALLOWED_EXTENSIONS, UploadError, open_upload
 
 # Path to the frontend assets (index.html and static files)
 FRONTEND_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend'))
@@ -27,9 +33,94 @@ app.config['JWT_ALGORITHM'] = 'HS256'
 jwt = JWTManager(app)
 
 db = Database()
+# Libro de stock en memoria para platos con alta demanda (opcional)
+stock_ledger = setup_stock_ledger(db.config) if os.getenv('STOCK_LEDGER', '0') == '1' else None
 auth_manager = AuthManager(db)
-reservation_manager = ReservationManager(db)
-menu_manager = MenuManager(db)
+menu_manager = MenuManager(db, stock_ledger=stock_ledger)
+reservation_manager = ReservationManager(db, menu_manager=menu_manager)
+# Importaciones en segundo plano (?asincrono=1); cada trabajo devuelve su conexión al terminar
+import_jobs = ImportJobManager(task_queue, ttl=int(os.getenv('IMPORT_JOB_TTL', 3600)),
+                               on_finish=db.release_connection)
+# Archivos de pre-pedidos validados, por SHA-256 del contenido, a la espera de procesarse
+PREORDER_STAGING_TTL = int(os.getenv('PREORDER_STAGING_TTL', 900))
+staged_preorders = CacheManager(max_size=int(os.getenv('PREORDER_STAGING_SIZE', 50)),
+                                default_ttl=PREORDER_STAGING_TTL)
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    # Devolver al pool la conexión usada por este request
+    db.release_connection()
+
+# Consultas máximas por llamada a /api/disponibilidad/batch
+MAX_AVAILABILITY_BATCH = 100
+
+def stream_json_rows(rows, key=None, chunk_size=200):
+    """
+    Respuesta JSON generada a medida que llegan las filas, sin armar la lista
+    completa en memoria. Devuelve un arreglo JSON (o {key: [...]}) y NDJSON si
+    el cliente lo pide con ?formato=ndjson o Accept: application/x-ndjson
+    """
+    ndjson = (request.args.get('formato') == 'ndjson' or
+              request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson')
+    
+    def generate_ndjson():
+        chunk = []
+        for row in rows:
+            chunk.append(app.json.dumps(row))
+            if len(chunk) >= chunk_size:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+    
+    def generate_array():
+        yield '{%s: [' % app.json.dumps(key) if key else '['
+        separator = ''
+        chunk = []
+        for row in rows:
+            chunk.append(app.json.dumps(row))
+            if len(chunk) >= chunk_size:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+        if chunk:
+            yield separator + ','.join(chunk)
+        yield ']}' if key else ']'
+    
+    if ndjson:
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    else:
+        response = Response(stream_with_context(generate_array()), mimetype='application/json')
+    # Un HEAD o un cliente que se desconecta antes del primer bloque no
+    # recorren el cuerpo: la conexión del RowStream se libera al cerrar la respuesta
+    if hasattr(rows, 'close'):
+        response.call_on_close(rows.close)
+    return response
+
+def reservation_filters_from_request():
+    """Filtros opcionales de listados de reservas/notas tomados del query string"""
+    return {
+        key: request.args.get(key)
+        for key in ('fecha_desde', 'fecha_hasta', 'estado', 'id_zona', 'id_mesa')
+        if request.args.get(key)
+    }
+
+def wants_page():
+    """El cliente pidió paginación keyset (limit/after) en lugar del listado completo"""
+    return 'limit' in request.args or 'after' in request.args
+
+def wants_async():
+    """El cliente pidió ejecutar la importación como trabajo en segundo plano"""
+    return request.args.get('asincrono', '0') == '1'
+
+def job_accepted(job):
+    """Respuesta 202 con el id del trabajo encolado"""
+    return jsonify({
+        'message': 'Importación encolada',
+        'job_id': job.id,
+        'estado': job.estado,
+        'url': f'/api/jobs/{job.id}'
+    }), 202
 
 @app.route('/')
 def index():
@@ -110,7 +201,7 @@ def create_zone():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -164,7 +255,7 @@ def update_zone(zone_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -201,6 +292,7 @@ def update_zone(zone_id):
         ), fetch_all=False)
         
         if success:
+            reservation_manager.tables_changed()
             # Obtener la zona actualizada
             zona_actualizada = db.execute_query("SELECT * FROM zonas WHERE id = %s", (zone_id,), fetch_one=True)
             
@@ -224,7 +316,7 @@ def delete_zone(zone_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -250,6 +342,7 @@ def delete_zone(zone_id):
     success = db.execute_query(delete_query, (zone_id,), fetch_all=False)
     
     if success:
+        reservation_manager.tables_changed()
         return jsonify({'message': 'Zona eliminada correctamente'})
     else:
         return jsonify({'error': 'Error al eliminar zona'}), 500
@@ -264,7 +357,7 @@ def get_zone_statistics(zone_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -290,14 +383,15 @@ def get_zone_statistics(zone_id):
     """
     tables_stats = db.execute_query(tables_stats_query, (zone_id,), fetch_one=True)
     
-    # Estadísticas de reservas (últimos 30 días)
+    # Estadísticas de reservas (últimos 30 días); una reserva combinada
+    # cuenta una vez (COALESCE(id_reserva_principal, id) identifica la reserva)
     reservations_stats_query = """
         SELECT 
-            COUNT(*) as total_reservas,
-            SUM(CASE WHEN estado = 'confirmada' THEN 1 ELSE 0 END) as confirmadas,
-            SUM(CASE WHEN estado = 'cancelada' THEN 1 ELSE 0 END) as canceladas,
+            COUNT(DISTINCT COALESCE(r.id_reserva_principal, r.id)) as total_reservas,
+            COUNT(DISTINCT CASE WHEN estado = 'confirmada' THEN COALESCE(r.id_reserva_principal, r.id) END) as confirmadas,
+            COUNT(DISTINCT CASE WHEN estado = 'cancelada' THEN COALESCE(r.id_reserva_principal, r.id) END) as canceladas,
             SUM(numero_comensales) as total_comensales,
-            COUNT(DISTINCT CASE WHEN fecha >= CURDATE() THEN id END) as reservas_hoy
+            COUNT(DISTINCT CASE WHEN fecha >= CURDATE() THEN COALESCE(r.id_reserva_principal, r.id) END) as reservas_hoy
         FROM reservas r
         JOIN mesas m ON r.id_mesa = m.id
         WHERE m.id_zona = %s 
@@ -340,6 +434,10 @@ def check_availability():
         if not all([fecha, hora]):
             return jsonify({'error': 'Fecha y hora requeridas'}), 400
         
+        # Misma regla que al reservar: no se ofrece una hora que el POST rechazaría
+        if not slot_aligned(hora):
+            return jsonify({'error': HORA_NO_ALINEADA}), 400
+        
         available_tables = reservation_manager.check_availability(fecha, hora, comensales, id_zona)
         return jsonify({'mesas_disponibles': available_tables})
     except Exception as e:
@@ -348,56 +446,229 @@ def check_availability():
         print(f"Traceback: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/disponibilidad/dia', methods=['GET'])
+def day_availability():
+    """
+    Disponibilidad de todas las mesas en todos los horarios de una fecha:
+    una sola llamada alimenta el selector de hora completo.
+    Con ?formato=bitset cada horario es un bitset en base64 (bit j = mesa j,
+    orden little-endian dentro de cada byte)
+    """
+    fecha = request.args.get('fecha')
+    if not fecha:
+        return jsonify({'error': 'Fecha requerida'}), 400
+    
+    try:
+        comensales = int(request.args.get('comensales', 1))
+        intervalo = int(request.args.get('intervalo', 30))
+        datetime.strptime(fecha, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    if not 5 <= intervalo <= 240:
+        return jsonify({'error': 'El intervalo debe estar entre 5 y 240 minutos'}), 400
+    
+    result = reservation_manager.get_day_availability(
+        fecha, comensales, request.args.get('id_zona'), intervalo
+    )
+    if result is None:
+        return jsonify({'error': 'Error al calcular la disponibilidad'}), 500
+    
+    matrix = result['disponible']
+    response = {
+        'fecha': fecha,
+        'horas': result['horas'],
+        'mesas': [
+            {
+                'id': table['id'],
+                'numero': table['numero'],
+                'capacidad': table['capacidad'],
+                'id_zona': table['id_zona'],
+                'zona_nombre': table['zona_nombre']
+            }
+            for table in result['mesas']
+        ],
+        'libres': matrix.sum(axis=1).tolist()
+    }
+    if request.args.get('formato') == 'bitset':
+        packed = np.packbits(matrix, axis=1, bitorder='little')
+        response['formato'] = 'bitset'
+        response['disponibilidad'] = [base64.b64encode(row.tobytes()).decode('ascii') for row in packed]
+    else:
+        response['disponibilidad'] = matrix.astype(np.uint8).tolist()
+    
+    return jsonify(response)
+
+@app.route('/api/disponibilidad/batch', methods=['POST'])
+def check_availability_batch():
+    """
+    Varias consultas de disponibilidad en una llamada:
+    {"consultas": [{"fecha", "hora", "comensales", "id_zona"}, ...]}.
+    Los resultados vuelven en el mismo orden
+    """
+    data = request.get_json(silent=True) or {}
+    consultas = data.get('consultas')
+    if not isinstance(consultas, list) or not consultas:
+        return jsonify({'error': 'Se requiere una lista de consultas'}), 400
+    if len(consultas) > MAX_AVAILABILITY_BATCH:
+        return jsonify({'error': f'Máximo {MAX_AVAILABILITY_BATCH} consultas por llamada'}), 400
+    
+    queries = []
+    for index, consulta in enumerate(consultas):
+        try:
+            fecha, hora = consulta['fecha'], consulta['hora']
+            datetime.strptime(f"{fecha} {hora[:5]}", '%Y-%m-%d %H:%M')
+            queries.append({
+                'fecha': fecha,
+                'hora': hora,
+                'comensales': int(consulta.get('comensales', 1)),
+                'id_zona': consulta.get('id_zona')
+            })
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': f'Consulta {index} inválida: requiere fecha (YYYY-MM-DD) y hora (HH:MM)'}), 400
+        if not slot_aligned(hora):
+            return jsonify({'error': f'Consulta {index} inválida: {HORA_NO_ALINEADA}'}), 400
+    
+    results = reservation_manager.check_availability_batch(queries)
+    if results is None:
+        return jsonify({'error': 'Error al consultar disponibilidad'}), 500
+    
+    return jsonify({
+        'resultados': [
+            dict(query, mesas_disponibles=tables)
+            for query, tables in zip(queries, results)
+        ]
+    })
+
+@app.route('/api/disponibilidad/siguiente', methods=['GET'])
+def next_available_slots():
+    """
+    Opciones libres más cercanas a la fecha y hora preferidas, para no
+    probar /api/disponibilidad hora por hora y día por día
+    """
+    fecha = request.args.get('fecha')
+    hora = request.args.get('hora')
+    if not all([fecha, hora]):
+        return jsonify({'error': 'Fecha y hora requeridas'}), 400
+    
+    try:
+        comensales = int(request.args.get('comensales', 1))
+        limite = min(int(request.args.get('limite', 5)), 20)
+        intervalo = int(request.args.get('intervalo', 30))
+        datetime.strptime(f"{fecha} {hora[:5]}", '%Y-%m-%d %H:%M')
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    if limite < 1 or not 5 <= intervalo <= 240:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    
+    options = reservation_manager.find_next_slots(
+        fecha, hora, comensales, request.args.get('id_zona'), limite, intervalo
+    )
+    if options is None:
+        return jsonify({'error': 'Error al buscar horarios disponibles'}), 500
+    
+    return jsonify({
+        'opciones': [
+            {
+                'fecha': option['fecha'],
+                'hora': option['hora'],
+                'mesa': {
+                    'id': option['mesa']['id'],
+                    'numero': option['mesa']['numero'],
+                    'capacidad': option['mesa']['capacidad'],
+                    'id_zona': option['mesa']['id_zona'],
+                    'zona_nombre': option['mesa']['zona_nombre']
+                }
+            }
+            for option in options
+        ]
+    })
+
 @app.route('/api/reservas', methods=['POST'])
 @jwt_required()
 def create_reservation():
     data = request.get_json()
     user_id = int(get_jwt_identity())
     
-    required_fields = ['id_mesa', 'fecha', 'hora', 'numero_comensales']
+    # Con asignar_mesa (o id_mesa = 'auto') el servidor elige la mesa o
+    # una combinación de mesas contiguas
+    auto_assign = bool(data.get('asignar_mesa')) or data.get('id_mesa') == 'auto'
+    required_fields = ['fecha', 'hora', 'numero_comensales'] + ([] if auto_assign else ['id_mesa'])
     if not all(k in data for k in required_fields):
         return jsonify({'error': 'Faltan campos requeridos'}), 400
     
-    reservation_id = reservation_manager.create_reservation(
-        user_id,
-        data['id_mesa'],
-        data['fecha'],
-        data['hora'],
-        data['numero_comensales'],
-        data.get('observaciones')
-    )
+    preorders = data.get('preorders') or []
+    for preorder in preorders:
+        try:
+            if int(preorder['cantidad']) <= 0:
+                raise ValueError()
+            int(preorder['id_plato'])
+        except (KeyError, ValueError, TypeError):
+            return jsonify({'error': 'Cada pre-pedido requiere id_plato y una cantidad mayor a 0'}), 400
+    
+    # Las reservas ocupan slots de 15 minutos (reservas_slots)
+    if not slot_aligned(data['hora']):
+        return jsonify({'error': HORA_NO_ALINEADA}), 400
+    
+    # Reserva, pre-pedidos y stock en una sola transacción
+    if auto_assign:
+        result, conflict = reservation_manager.create_auto_reservation(
+            user_id,
+            data['fecha'],
+            data['hora'],
+            data['numero_comensales'],
+            data.get('observaciones'),
+            preorders,
+            data.get('id_zona')
+        )
+    else:
+        result, conflict = reservation_manager.create_reservation_with_preorders(
+            user_id,
+            data['id_mesa'],
+            data['fecha'],
+            data['hora'],
+            data['numero_comensales'],
+            data.get('observaciones'),
+            preorders
+        )
     
-    if reservation_id:
-        # Procesar pre-pedidos si existen
-        preorders = data.get('preorders', [])
-        if preorders:
-            for preorder in preorders:
-                menu_manager.create_preorder(
-                    reservation_id,
-                    preorder['id_plato'],
-                    preorder['cantidad']
-                )
-        
+    if result:
         return jsonify({
             'message': 'Reserva creada exitosamente',
-            'reservation_id': reservation_id
+            'reservation_id': result['reservation_id'],
+            'mesas': result['mesas'],
+            'preorders_creados': result['preorders']
         }), 201
+    elif conflict:
+        return jsonify({'error': conflict}), 409
     else:
         return jsonify({'error': 'No se pudo crear la reserva'}), 500
 
 @app.route('/api/mis-reservas', methods=['GET'])
 @jwt_required()
 def get_user_reservations():
+    """
+    Reservas del usuario con sus pre-pedidos. Con limit/after responde una
+    página keyset; con ?prepedidos=0 omite el detalle de pre-pedidos y solo
+    incluye el resumen (vistas de listado)
+    """
     user_id = int(get_jwt_identity())
-    reservations = reservation_manager.get_user_reservations(user_id)
-    
-    # Agregar pre-pedidos a cada reserva
-    for reservation in reservations:
-        preorders = menu_manager.get_reservation_preorders(reservation['id'])
-        summary = menu_manager.get_preorder_summary(reservation['id'])
-        reservation['preorders'] = preorders
-        reservation['preorder_summary'] = summary
+    include_items = request.args.get('prepedidos', '1') != '0'
     
+    if wants_page():
+        try:
+            page = reservation_manager.get_user_reservations_page(
+                user_id, request.args.get('limit'), request.args.get('after')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if page is None:
+            return jsonify({'error': 'Error al obtener reservas'}), 500
+        menu_manager.attach_preorders(page['reservas'], include_items)
+        return jsonify(page)
+    
+    reservations = reservation_manager.get_user_reservations(user_id) or []
+    # Pre-pedidos y resúmenes de todas las reservas en dos consultas
+    menu_manager.attach_preorders(reservations, include_items)
     return jsonify(reservations)
 
 @app.route('/api/reservas/<int:reservation_id>/preorders', methods=['GET'])
@@ -413,7 +684,7 @@ def get_reservation_preorders(reservation_id):
         return jsonify({'error': 'Reserva no encontrada'}), 404
     
     user_query = "SELECT rol FROM usuarios WHERE id = %s"
-    user_info = db.execute_query(user_query, (user_id,), fetch_one=True)
+    user_info = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
     is_admin = user_info and user_info['rol'] == 'administrador'
     
     if not is_admin and reservation['id_usuario'] != user_id:
@@ -441,7 +712,7 @@ def add_reservation_preorder(reservation_id):
         return jsonify({'error': 'Reserva no encontrada'}), 404
     
     user_query = "SELECT rol FROM usuarios WHERE id = %s"
-    user_info = db.execute_query(user_query, (user_id,), fetch_one=True)
+    user_info = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
     is_admin = user_info and user_info['rol'] == 'administrador'
     
     if not is_admin and reservation['id_usuario'] != user_id:
@@ -484,7 +755,7 @@ def generate_consumption_note():
         return jsonify({'error': 'Reserva no encontrada'}), 404
     
     user_query = "SELECT rol FROM usuarios WHERE id = %s"
-    user_info = db.execute_query(user_query, (user_id,), fetch_one=True)
+    user_info = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
     is_admin = user_info and user_info['rol'] == 'administrador'
     
     if not is_admin and reservation['id_usuario'] != user_id:
@@ -504,6 +775,41 @@ def generate_consumption_note():
     else:
         return jsonify({'error': 'No se pudo generar la nota de consumo'}), 500
 
+@app.route('/api/notas-consumo/servicio', methods=['POST'])
+@jwt_required()
+def generate_service_consumption_notes():
+    """
+    Genera en una sola pasada las notas de consumo de todas las reservas de
+    un servicio (fecha y, opcionalmente, hora_desde/hora_hasta) que aún no
+    tienen nota. Solo administradores
+    """
+    user_id = int(get_jwt_identity())
+    user_query = "SELECT rol FROM usuarios WHERE id = %s"
+    user = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
+    
+    if not user or user['rol'] != 'administrador':
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    data = request.get_json() or {}
+    if not data.get('fecha'):
+        return jsonify({'error': 'Fecha requerida'}), 400
+    
+    notes = menu_manager.generate_service_consumption_notes(
+        data['fecha'],
+        data.get('hora_desde'),
+        data.get('hora_hasta')
+    )
+    
+    if notes is None:
+        return jsonify({'error': 'No se pudieron generar las notas de consumo'}), 500
+    
+    return jsonify({
+        'message': f'{len(notes)} notas de consumo generadas',
+        'generadas': len(notes),
+        'total_general': sum(note['resumen']['total_general'] for note in notes),
+        'notas': notes
+    }), 201
+
 @app.route('/api/notas-consumo', methods=['GET'])
 @jwt_required()
 def get_consumption_notes():
@@ -515,7 +821,7 @@ def get_consumption_notes():
     
     # Verificar si es admin
     user_query = "SELECT rol FROM usuarios WHERE id = %s"
-    user_info = db.execute_query(user_query, (user_id,), fetch_one=True)
+    user_info = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
     is_admin = user_info and user_info['rol'] == 'administrador'
     
     if id_reserva:
@@ -535,7 +841,19 @@ def get_consumption_notes():
         if not is_admin:
             return jsonify({'error': 'No autorizado'}), 403
         
-        notes = menu_manager.get_consumption_notes()
+        filters = reservation_filters_from_request()
+        if wants_page():
+            try:
+                page = menu_manager.get_consumption_notes_page(
+                    request.args.get('limit'), request.args.get('after'), **filters
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if page is None:
+                return jsonify({'error': 'Error al obtener notas de consumo'}), 500
+            return jsonify(page)
+        
+        return stream_json_rows(menu_manager.get_consumption_notes(stream=True, **filters), key='notas')
     
     return jsonify({'notas': notes})
 
@@ -555,7 +873,7 @@ def get_consumption_note_details(note_id):
     
     # Verificar si es admin o dueño de la reserva
     user_query = "SELECT rol FROM usuarios WHERE id = %s"
-    user_info = db.execute_query(user_query, (user_id,), fetch_one=True)
+    user_info = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
     is_admin = user_info and user_info['rol'] == 'administrador'
     
     # Verificar acceso a la reserva asociada
@@ -577,7 +895,7 @@ def upload_excel_preorders():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -592,102 +910,77 @@ def upload_excel_preorders():
         return jsonify({'error': 'Nombre de archivo vacío'}), 400
     
     # Verificar extensión del archivo
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        return jsonify({'error': 'El archivo debe ser un Excel (.xlsx o .xls)'}), 400
+    if not file.filename.lower().endswith(ALLOWED_EXTENSIONS):
+        return jsonify({'error': 'El archivo debe ser un Excel (.xlsx o .xls) o un CSV'}), 400
     
     try:
-        # Leer el archivo Excel
-        df = pd.read_excel(file)
-        
-        # Validar estructura del Excel
-        required_columns = ['nombre_plato', 'cantidad', 'id_reserva']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return jsonify({
-                'error': 'El archivo no tiene las columnas requeridas',
-                'columnas_requeridas': required_columns,
-                'columnas_faltantes': missing_columns,
-                'columnas_encontradas': list(df.columns)
-            }), 400
-        
-        # Validar datos
-        validation_errors = []
-        valid_preorders = []
-        
-        for index, row in df.iterrows():
-            row_errors = []
-            
-            # Validar nombre_plato
-            if pd.isna(row['nombre_plato']) or not str(row['nombre_plato']).strip():
-                row_errors.append(f"Fila {index+1}: El nombre del plato es requerido")
-            else:
-                # Verificar que el plato exista
-                plato_query = "SELECT id, nombre, stock_disponible, precio FROM platos WHERE nombre = %s"
-                plato = db.execute_query(plato_query, (str(row['nombre_plato']).strip(),), fetch_one=True)
-                
-                if not plato:
-                    row_errors.append(f"Fila {index+1}: El plato '{row['nombre_plato']}' no existe")
-                elif plato['stock_disponible'] <= 0:
-                    row_errors.append(f"Fila {index+1}: El plato '{row['nombre_plato']}' no tiene stock disponible")
-            
-            # Validar cantidad
-            try:
-                cantidad = int(row['cantidad'])
-                if cantidad <= 0:
-                    row_errors.append(f"Fila {index+1}: La cantidad debe ser mayor a 0")
-            except (ValueError, TypeError):
-                row_errors.append(f"Fila {index+1}: La cantidad debe ser un número válido")
-            
-            # Validar id_reserva
-            try:
-                id_reserva = int(row['id_reserva'])
-                if id_reserva <= 0:
-                    row_errors.append(f"Fila {index+1}: El ID de reserva debe ser mayor a 0")
-                else:
-                    # Verificar que la reserva exista
-                    reservation_query = "SELECT id, estado FROM reservas WHERE id = %s"
-                    reservation = db.execute_query(reservation_query, (id_reserva,), fetch_one=True)
-                    
-                    if not reservation:
-                        row_errors.append(f"Fila {index+1}: La reserva {id_reserva} no existe")
-                    elif reservation['estado'] != 'confirmada':
-                        row_errors.append(f"Fila {index+1}: La reserva {id_reserva} no está confirmada")
-            except (ValueError, TypeError):
-                row_errors.append(f"Fila {index+1}: El ID de reserva debe ser un número válido")
-            
-            if row_errors:
-                validation_errors.extend(row_errors)
-            else:
-                valid_preorders.append({
-                    'fila': index + 1,
-                    'id_reserva': int(row['id_reserva']),
-                    'nombre_plato': str(row['nombre_plato']).strip(),
-                    'cantidad': int(row['cantidad']),
-                    'plato_info': plato
-                })
-        
-        if validation_errors:
+        # El archivo se guarda en un temporal en disco calculando su SHA-256:
+        # si ya se validó un archivo idéntico se reutiliza ese resultado
+        with open_upload(file) as upload:
+            token = upload.sha256
+            staged = staged_preorders.get(token)
+            if staged is None:
+                staged = stage_preorder_file(upload)
+                staged_preorders.set(token, staged)
+        
+        if staged['errores']:
             return jsonify({
                 'error': 'Errores de validación en el archivo',
-                'errores': validation_errors,
-                'total_filas': len(df),
-                'filas_validas': len(valid_preorders),
-                'previsualizacion': valid_preorders[:10]  # Solo primeras 10 filas válidas
+                'errores': staged['errores'],
+                'total_filas': staged['total_filas'],
+                'filas_validas': len(staged['prepedidos']),
+                'previsualizacion': staged['previsualizacion']  # Solo primeras 10 filas válidas
             }), 400
         
+        # El lote validado queda en el servidor; para procesarlo basta el token
         return jsonify({
             'message': 'Archivo validado correctamente',
-            'total_prepedidos': len(valid_preorders),
-            'prepedidos': valid_preorders,
+            'token': token,
+            'expira_en': PREORDER_STAGING_TTL,
+            'total_prepedidos': len(staged['prepedidos']),
+            'previsualizacion': staged['previsualizacion'],
             'listo_para_procesar': True
         })
         
+    except UploadError as e:
+        return jsonify({'error': str(e), **e.details}), 400
     except Exception as e:
         return jsonify({
             'error': f'Error al procesar el archivo Excel: {str(e)}'
         }), 500
 
+def stage_preorder_file(upload):
+    """
+    Validar el archivo por lotes (el encabezado antes de recorrer los datos)
+    y armar el lote que se guarda en el servidor con solo lo necesario para
+    registrarlo
+    """
+    valid_preorders, validation_errors = [], []
+    total_filas = 0
+    solicitado = {}
+    for df in upload.batches(['nombre_plato', 'cantidad', 'id_reserva']):
+        # Validar datos (una consulta por conjunto de platos y de reservas)
+        batch_valid, batch_errors = menu_manager.validate_excel_preorders(df, solicitado)
+        valid_preorders.extend(batch_valid)
+        validation_errors.extend(batch_errors)
+        total_filas += len(df)
+    
+    return {
+        'prepedidos': [
+            {
+                'fila': preorder['fila'],
+                'id_reserva': preorder['id_reserva'],
+                'id_plato': preorder['plato_info']['id'],
+                'nombre_plato': preorder['nombre_plato'],
+                'cantidad': preorder['cantidad']
+            }
+            for preorder in valid_preorders
+        ],
+        'errores': validation_errors,
+        'total_filas': total_filas,
+        'previsualizacion': valid_preorders[:10]
+    }
+
 @app.route('/api/prepedidos/excel/procesar', methods=['POST'])
 @jwt_required()
 def process_excel_preorders():
@@ -698,64 +991,72 @@ def process_excel_preorders():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
     
-    data = request.get_json()
-    prepedidos = data.get('prepedidos', [])
+    data = request.get_json() or {}
+    token = data.get('token')
+    
+    if not token:
+        return jsonify({'error': 'Token del archivo validado requerido'}), 400
     
-    if not prepedidos:
+    staged = staged_preorders.get(token)
+    if staged is None:
+        return jsonify({'error': 'El archivo validado no existe o expiró; vuelva a subirlo'}), 404
+    
+    if staged['errores']:
+        return jsonify({'error': 'El archivo tiene errores de validación', 'errores': staged['errores']}), 400
+    
+    if not staged['prepedidos']:
         return jsonify({'error': 'No hay pre-pedidos para procesar'}), 400
     
-    resultados = {
-        'procesados': [],
-        'errores': [],
-        'total_procesados': 0,
-        'total_errores': 0
-    }
+    # Se retira del área de espera para que el mismo lote no se procese dos veces
+    staged = staged_preorders.pop(token)
+    if staged is None:
+        return jsonify({'error': 'El archivo ya se está procesando'}), 409
     
-    for preorder in prepedidos:
+    if wants_async():
         try:
-            # Crear pre-pedido
-            preorder_id = menu_manager.create_preorder(
-                preorder['id_reserva'],
-                preorder['plato_info']['id'],
-                preorder['cantidad']
-            )
-            
-            if preorder_id:
-                resultados['procesados'].append({
-                    'fila': preorder['fila'],
-                    'id_reserva': preorder['id_reserva'],
-                    'plato': preorder['nombre_plato'],
-                    'cantidad': preorder['cantidad'],
-                    'preorder_id': preorder_id
-                })
-                resultados['total_procesados'] += 1
-            else:
-                resultados['errores'].append({
-                    'fila': preorder['fila'],
-                    'error': 'No se pudo crear el pre-pedido (posiblemente sin stock)',
-                    'plato': preorder['nombre_plato']
-                })
-                resultados['total_errores'] += 1
-                
-        except Exception as e:
-            resultados['errores'].append({
-                'fila': preorder['fila'],
-                'error': str(e),
-                'plato': preorder['nombre_plato']
-            })
-            resultados['total_errores'] += 1
+            job = import_jobs.submit('prepedidos', int(user_id), process_staged_preorders, token, staged)
+        except Exception:
+            # No se pudo encolar: el lote vuelve al área de espera
+            staged_preorders.set(token, staged)
+            raise
+        return job_accepted(job)
+    
+    report = process_staged_preorders(None, token, staged)
+    if report is None:
+        return jsonify({'error': 'No se pudieron registrar los pre-pedidos'}), 500
+    return jsonify(report)
+
+def process_staged_preorders(job, token, staged):
+    """
+    Registrar un lote validado en una sola transacción (un descuento de
+    stock por plato). Si la transacción falla el lote vuelve al área de
+    espera para poder reintentar con el mismo token
+    """
+    resultados = menu_manager.create_preorders_bulk(staged['prepedidos'])
+    if resultados is None:
+        staged_preorders.set(token, staged)
+        if job:
+            raise RuntimeError('No se pudieron registrar los pre-pedidos')
+        return None
+    
+    if job:
+        job.update(
+            filas_procesadas=resultados['total_procesados'] + resultados['total_errores'],
+            creados=resultados['total_procesados'],
+            errores=resultados['total_errores']
+        )
     
-    return jsonify({
+    return {
         'message': 'Proceso completado',
         'resultados': resultados,
         'prepedidos_exitosos': resultados['total_procesados'],
         'prepedidos_con_errores': resultados['total_errores']
-    })
+    }
 
 @app.route('/api/prepedidos/exportar/plantilla', methods=['GET'])
 @jwt_required()
@@ -767,16 +1068,16 @@ def export_preorder_template():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
     
     # Obtener lista de platos disponibles
-    platos_query = "SELECT id, nombre, precio, stock_disponible FROM platos WHERE disponible = TRUE AND stock_disponible > 0"
-    platos = db.execute_query(platos_query)
+    # Platos disponibles con stock (incluye las unidades del libro de stock)
+    platos = menu_manager.get_menu_items()
     
-    # Obtener lista de reservas confirmadas futuras
+    # Reservas confirmadas futuras (una fila por reserva: los pre-pedidos van a la principal)
     reservations_query = """
         SELECT r.id, r.fecha, r.hora, u.nombre as cliente_nombre, m.numero as mesa_numero
         FROM reservas r
@@ -784,6 +1085,7 @@ def export_preorder_template():
         JOIN mesas m ON r.id_mesa = m.id
         WHERE r.estado = 'confirmada' 
         AND r.fecha >= CURDATE()
+        AND r.id_reserva_principal IS NULL
         ORDER BY r.fecha, r.hora
     """
     reservas = db.execute_query(reservations_query)
@@ -858,13 +1160,12 @@ def get_all_platos_admin():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
     
-    platos = menu_manager.get_all_platos()
-    return jsonify(platos)
+    return stream_json_rows(menu_manager.get_all_platos(stream=True))
 
 @app.route('/api/platos/<int:plato_id>/stock', methods=['GET'])
 def check_plato_stock(plato_id):
@@ -879,7 +1180,7 @@ def create_plato():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -912,7 +1213,7 @@ def update_plato(plato_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -933,6 +1234,9 @@ def update_plato(plato_id):
         ), fetch_all=False)
         
         if success:
+            if stock_ledger:
+                # El stock fijado por el administrador reemplaza los lotes en memoria
+                stock_ledger.invalidate(plato_id)
             return jsonify({'message': 'Plato actualizado correctamente'})
         else:
             return jsonify({'error': 'Error al actualizar plato'}), 500
@@ -946,7 +1250,7 @@ def delete_plato(plato_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -956,10 +1260,32 @@ def delete_plato(plato_id):
     success = db.execute_query(delete_query, (plato_id,), fetch_all=False)
     
     if success:
+        if stock_ledger:
+            stock_ledger.invalidate(plato_id)
         return jsonify({'message': 'Plato eliminado correctamente'})
     else:
         return jsonify({'error': 'Error al eliminar plato'}), 500
 
+# Mapeo de nombres de columnas alternativos a nombres estándar (en minúsculas)
+PLATOS_COLUMN_MAPPING = {
+    'id': 'id',
+    'identificador': 'id',
+    'codigo': 'id',
+    'nombre del plato': 'nombre',
+    'nombre': 'nombre',
+    'plato': 'nombre',
+    'precio': 'precio',
+    'valor': 'precio',
+    'categoria': 'categoria',
+    'categoría': 'categoria',
+    'categoria del plato': 'categoria',
+    'tipo': 'categoria',
+    'stock disponible': 'stock_disponible',
+    'stock': 'stock_disponible',
+    'stock_disponible': 'stock_disponible',
+    'cantidad': 'stock_disponible'
+}
+
 @app.route('/api/platos/importar', methods=['POST'])
 @jwt_required()
 def import_platos_excel():
@@ -970,7 +1296,7 @@ def import_platos_excel():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -985,54 +1311,30 @@ def import_platos_excel():
         return jsonify({'error': 'Nombre de archivo vacío'}), 400
     
     # Verificar extensión del archivo
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        return jsonify({'error': 'El archivo debe ser un Excel (.xlsx o .xls)'}), 400
+    if not file.filename.lower().endswith(ALLOWED_EXTENSIONS):
+        return jsonify({'error': 'El archivo debe ser un Excel (.xlsx o .xls) o un CSV'}), 400
     
     try:
-        # Leer el archivo Excel
-        df = pd.read_excel(file)
-        
-        # Normalizar nombres de columnas (convertir a minúsculas y quitar espacios)
-        df.columns = df.columns.str.lower().str.strip()
-        
-        # Mapeo de nombres de columnas alternativos a nombres estándar
-        column_mapping = {
-            'id': 'id',
-            'identificador': 'id',
-            'codigo': 'id',
-            'nombre del plato': 'nombre',
-            'nombre': 'nombre',
-            'plato': 'nombre',
-            'precio': 'precio',
-            'valor': 'precio',
-            'categoria': 'categoria',
-            'categoría': 'categoria',
-            'categoria del plato': 'categoria',
-            'tipo': 'categoria',
-            'stock disponible': 'stock_disponible',
-            'stock': 'stock_disponible',
-            'stock_disponible': 'stock_disponible',
-            'cantidad': 'stock_disponible'
-        }
-        
-        # Renombrar columnas usando el mapeo
-        df = df.rename(columns=column_mapping)
-        
-        # Validar estructura del Excel
-        required_columns = ['id', 'nombre', 'stock_disponible']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return jsonify({
-                'error': 'El archivo no tiene las columnas requeridas',
-                'columnas_requeridas': required_columns,
-                'columnas_faltantes': missing_columns,
-                'columnas_encontradas': list(df.columns),
-                'sugerencia': 'Las columnas deben ser: id, nombre, precio, categoria, stock_disponible (o equivalentes)'
-            }), 400
-        
-        # Importar platos
-        results = menu_manager.import_platos_from_excel(df)
+        if wants_async():
+            # El archivo queda en disco para el trabajo; el encabezado se
+            # valida ahora para rechazarlo sin encolar
+            upload = open_upload(file)
+            try:
+                upload.spool()
+                upload.check_header(['id', 'nombre', 'stock_disponible'], PLATOS_COLUMN_MAPPING)
+                job = import_jobs.submit('platos', int(user_id), import_platos_job, upload)
+            except Exception:
+                # Sin trabajo encolado nadie más borra el temporal
+                upload.close()
+                raise
+            return job_accepted(job)
+        
+        # Importar platos: el archivo se lee por lotes desde un temporal en
+        # disco y los encabezados se normalizan y validan antes de los datos
+        with open_upload(file) as upload:
+            results = menu_manager.import_platos_from_excel(
+                upload.batches(['id', 'nombre', 'stock_disponible'], PLATOS_COLUMN_MAPPING)
+            )
         
         if results is None:
             return jsonify({'error': 'Error al procesar el archivo Excel'}), 500
@@ -1042,9 +1344,53 @@ def import_platos_excel():
             'resultados': results
         }), 200
         
+    except UploadError as e:
+        body = {'error': str(e), **e.details}
+        if 'columnas_faltantes' in e.details:
+            body['sugerencia'] = 'Las columnas deben ser: id, nombre, precio, categoria, stock_disponible (o equivalentes)'
+        return jsonify(body), 400
     except Exception as e:
         return jsonify({'error': f'Error al procesar el archivo Excel: {str(e)}'}), 500
 
+def import_platos_job(job, upload):
+    """Importación de platos en segundo plano con progreso por lote"""
+    def progress(results):
+        job.update(
+            filas_procesadas=results['procesados'] + len(results['errores']),
+            creados=results['creados'],
+            actualizados=results['actualizados'],
+            errores=len(results['errores'])
+        )
+    
+    with upload:
+        results = menu_manager.import_platos_from_excel(
+            upload.batches(['id', 'nombre', 'stock_disponible'], PLATOS_COLUMN_MAPPING),
+            progress=progress
+        )
+    if results is None:
+        raise RuntimeError('Error al procesar el archivo Excel')
+    return results
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_import_job(job_id):
+    """
+    Estado, progreso y resultado de un trabajo de importación
+    """
+    user_id = int(get_jwt_identity())
+    job = import_jobs.get(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    
+    if job.id_usuario != user_id:
+        user_query = "SELECT rol FROM usuarios WHERE id = %s"
+        user = db.execute_query(user_query, (user_id,), fetch_one=True, prepared=True)
+        if not user or user['rol'] != 'administrador':
+            return jsonify({'error': 'No autorizado'}), 403
+    
+    return jsonify(job.to_dict())
+
 @app.route('/api/platos/exportar/plantilla', methods=['GET'])
 @jwt_required()
 def export_platos_template():
@@ -1055,7 +1401,7 @@ def export_platos_template():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -1132,13 +1478,25 @@ def get_all_reservations():
     user_id = int(get_jwt_identity())
     
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
     
-    reservations = reservation_manager.get_all_reservations()
-    return jsonify(reservations)
+    filters = reservation_filters_from_request()
+    if wants_page():
+        try:
+            page = reservation_manager.get_reservations_page(
+                request.args.get('limit'), request.args.get('after'), **filters
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if page is None:
+            return jsonify({'error': 'Error al obtener reservas'}), 500
+        return jsonify(page)
+    
+    # Sin limit/after se mantiene el listado completo (filtrado) en streaming
+    return stream_json_rows(reservation_manager.get_all_reservations(stream=True, **filters))
 
 @app.route('/api/dashboard', methods=['GET'])
 @jwt_required()
@@ -1146,18 +1504,19 @@ def get_dashboard():
     user_id = get_jwt_identity()
     
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
     
+    # Una reserva combinada cuenta una vez; los comensales suman todas sus mesas
     stats_query = """
         SELECT 
-            COUNT(*) as total_reservas,
-            SUM(CASE WHEN estado = 'confirmada' THEN 1 ELSE 0 END) as confirmadas,
-            SUM(CASE WHEN estado = 'cancelada' THEN 1 ELSE 0 END) as canceladas,
+            COUNT(DISTINCT COALESCE(id_reserva_principal, id)) as total_reservas,
+            COUNT(DISTINCT CASE WHEN estado = 'confirmada' THEN COALESCE(id_reserva_principal, id) END) as confirmadas,
+            COUNT(DISTINCT CASE WHEN estado = 'cancelada' THEN COALESCE(id_reserva_principal, id) END) as canceladas,
             SUM(numero_comensales) as total_comensales,
-            COUNT(DISTINCT CASE WHEN fecha = CURDATE() THEN id END) as reservas_hoy
+            COUNT(DISTINCT CASE WHEN fecha = CURDATE() THEN COALESCE(id_reserva_principal, id) END) as reservas_hoy
         FROM reservas
         WHERE fecha >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
     """
@@ -1186,7 +1545,7 @@ def create_table():
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -1228,6 +1587,7 @@ def create_table():
         print(f"DEBUG: ID de nueva mesa: {new_table_id}")
         
         if new_table_id:
+            reservation_manager.tables_changed()
             # Obtener la mesa creada para devolverla
             select_query = "SELECT * FROM mesas WHERE id = %s"
             new_table = db.execute_query(select_query, (new_table_id,), fetch_one=True)
@@ -1249,7 +1609,7 @@ def update_table(table_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -1296,6 +1656,7 @@ def update_table(table_id):
         print(f"DEBUG: Resultado de actualización: {success}")
         
         if success:
+            reservation_manager.tables_changed()
             # Verificar que se actualizó correctamente
             verify_query = "SELECT * FROM mesas WHERE id = %s"
             mesa_actualizada = db.execute_query(verify_query, (table_id,), fetch_one=True)
@@ -1333,7 +1694,7 @@ def delete_table(table_id):
     try:
         # Verificar que es administrador
         query = "SELECT rol FROM usuarios WHERE id = %s"
-        user = db.execute_query(query, (user_id,), fetch_one=True)
+        user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
         
         if not user or user['rol'] != 'administrador':
             return jsonify({'error': 'No autorizado'}), 403
@@ -1361,6 +1722,7 @@ def delete_table(table_id):
         success = db.execute_query(delete_query, (table_id,), fetch_all=False)
         
         if success:
+            reservation_manager.tables_changed()
             return jsonify({'message': 'Mesa eliminada correctamente', 'mesa_eliminada': mesa['numero']})
         else:
             return jsonify({'error': 'Error al eliminar mesa'}), 500
@@ -1378,7 +1740,7 @@ def update_reservation(reservation_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
@@ -1393,25 +1755,15 @@ def update_reservation(reservation_id):
         return jsonify({'error': 'La hora es requerida'}), 400
     
     try:
-        update_query = """
-            UPDATE reservas 
-            SET fecha = %s, hora = %s, numero_comensales = %s, 
-                observaciones = %s, estado = %s 
-            WHERE id = %s
-        """
-        if not db.connection or not db.connection.is_connected():
-            db.connect()
-        
-        cursor = db.connection.cursor()
-        cursor.execute(update_query, (
-            data.get('fecha'), data.get('hora'), 
-            data.get('numero_comensales'), data.get('observaciones'),
-            data.get('estado'), reservation_id
-        ))
-        db.connection.commit()
-        rows_affected = cursor.rowcount
-        cursor.close()
+        rows_affected, conflict = reservation_manager.update_reservation(
+            reservation_id, data.get('fecha'), data.get('hora'),
+            data.get('numero_comensales'), data.get('observaciones'), data.get('estado')
+        )
         
+        if conflict == HORA_NO_ALINEADA:
+            return jsonify({'error': conflict}), 400
+        if conflict:
+            return jsonify({'error': conflict}), 409
         if rows_affected > 0:
             return jsonify({'message': 'Reserva actualizada correctamente'})
         else:
@@ -1426,23 +1778,24 @@ def delete_reservation(reservation_id):
     
     # Verificar que es administrador
     query = "SELECT rol FROM usuarios WHERE id = %s"
-    user = db.execute_query(query, (user_id,), fetch_one=True)
+    user = db.execute_query(query, (user_id,), fetch_one=True, prepared=True)
     
     if not user or user['rol'] != 'administrador':
         return jsonify({'error': 'No autorizado'}), 403
     
     try:
-        # Primero obtener el id_mesa de la reserva para actualizar la mesa después
-        reservation_query = "SELECT id_mesa FROM reservas WHERE id = %s"
-        reservation = db.execute_query(reservation_query, (reservation_id,), fetch_one=True)
+        # Primero obtener las mesas de la reserva (y de su combinación) para
+        # actualizarlas después
+        reservation_query = "SELECT id, id_mesa, fecha FROM reservas WHERE id = %s OR id_reserva_principal = %s"
+        group = db.execute_query(reservation_query, (reservation_id, reservation_id))
+        reservation = next((row for row in group or [] if row['id'] == reservation_id), None)
         
         if not reservation:
             return jsonify({'error': 'Reserva no encontrada'}), 404
         
         # Eliminar reserva
         delete_query = "DELETE FROM reservas WHERE id = %s"
-        if not db.connection or not db.connection.is_connected():
-            db.connect()
+        db.ensure_connection()
         
         cursor = db.connection.cursor()
         cursor.execute(delete_query, (reservation_id,))
@@ -1451,16 +1804,18 @@ def delete_reservation(reservation_id):
         cursor.close()
         
         if rows_affected > 0:
-            # Actualizar estado de la mesa a disponible
-            update_query = "UPDATE mesas SET estado = 'disponible' WHERE id = %s"
-            if not db.connection or not db.connection.is_connected():
-                db.connect()
+            # Actualizar estado de las mesas a disponible
+            table_ids = [row['id_mesa'] for row in group]
+            placeholders = ', '.join(['%s'] * len(table_ids))
+            update_query = f"UPDATE mesas SET estado = 'disponible' WHERE id IN ({placeholders})"
+            db.ensure_connection()
             
             cursor = db.connection.cursor()
-            cursor.execute(update_query, (reservation['id_mesa'],))
+            cursor.execute(update_query, tuple(table_ids))
             db.connection.commit()
             cursor.close()
             
+            reservation_manager.reservation_changed(reservation_id, reservation['fecha'], tables_changed=True)
             return jsonify({'message': 'Reserva eliminada correctamente'})
         else:
             return jsonify({'error': 'No se pudo eliminar la reserva'}), 500
@@ -1477,6 +1832,7 @@ def internal_error(error):
 
 if __name__ == '__main__':
     if db.connect():
+        db.release_connection()
         print("Conexion a la base de datos establecida")
         app.run(debug=True, host='0.0.0.0', port=5000, threaded=True, use_reloader=False)
     else:
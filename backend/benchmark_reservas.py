@@ -0,0 +1,145 @@
+"""
+Benchmark de contención al crear reservas
+Compara la verificación anterior (SELECT ... FOR UPDATE sobre reservas) con
+la ocupación por slots (clave única de reservas_slots) usando varios hilos
+que reservan mesas y horarios al azar de una misma noche.
+
+Uso:
+    python benchmark_reservas.py --hilos 16 --intentos 50 --fecha 2099-12-31
+
+Requiere la base configurada en .env con reservas_hora_fin.sql y
+reservas_slots.sql aplicados. Las reservas de la fecha del benchmark se
+eliminan al terminar cada estrategia.
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from mysql.connector import Error, errorcode
+
+from models import ConflictError, Database, ReservationManager, RESERVATION_SLOT_SECONDS
+
+# Errores de bloqueo que la verificación con FOR UPDATE produce bajo carga
+LOCK_ERRNOS = {errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT}
+
+
+def book_for_update(manager, cursor, id_usuario, id_mesa, fecha, hora):
+    """Estrategia anterior: contar solapamientos con FOR UPDATE e insertar"""
+    inicio, fin = manager.reservation_interval(hora)
+    cursor.execute("""
+        SELECT COUNT(*) as conflicting_reservations
+        FROM reservas
+        WHERE id_mesa = %s
+        AND fecha = %s
+        AND ABS(TIME_TO_SEC(hora) - TIME_TO_SEC(%s)) < %s
+        AND estado = 'confirmada'
+        FOR UPDATE
+    """, (id_mesa, fecha, inicio, manager.reservation_duration()))
+    if cursor.fetchone()['conflicting_reservations'] > 0:
+        raise ConflictError('ocupada')
+    cursor.execute("""
+        INSERT INTO reservas (id_usuario, id_mesa, fecha, hora, hora_fin, numero_comensales, estado)
+        VALUES (%s, %s, %s, %s, %s, 2, 'confirmada')
+    """, (id_usuario, id_mesa, fecha, inicio, fin))
+
+
+def book_slots(manager, cursor, id_usuario, id_mesa, fecha, hora):
+    """Estrategia nueva: insertar y ocupar los slots (falla por clave duplicada)"""
+    inicio, fin = manager.reservation_interval(hora)
+    cursor.execute("""
+        INSERT INTO reservas (id_usuario, id_mesa, fecha, hora, hora_fin, numero_comensales, estado)
+        VALUES (%s, %s, %s, %s, %s, 2, 'confirmada')
+    """, (id_usuario, id_mesa, fecha, inicio, fin))
+    manager._occupy_slots(cursor, cursor.lastrowid, id_mesa, fecha, inicio, fin)
+
+
+STRATEGIES = {
+    'for_update': book_for_update,
+    'slots': book_slots,
+}
+
+
+def cleanup(db, fecha):
+    with db.connection_scope():
+        db.execute_update("DELETE FROM reservas WHERE fecha = %s", (fecha,))
+
+
+def run(strategy, db, manager, args, id_usuario, mesas, horas):
+    counters = {'reservas': 0, 'conflictos': 0, 'bloqueos': 0, 'errores': 0}
+    counters_lock = threading.Lock()
+    book = STRATEGIES[strategy]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(args.intentos):
+            id_mesa, hora = rng.choice(mesas), rng.choice(horas)
+            outcome = 'reservas'
+            try:
+                with db.transaction() as cursor:
+                    book(manager, cursor, id_usuario, id_mesa, args.fecha, hora)
+            except ConflictError:
+                outcome = 'conflictos'
+            except Error as e:
+                if e.errno == errorcode.ER_DUP_ENTRY:
+                    outcome = 'conflictos'
+                elif e.errno in LOCK_ERRNOS:
+                    outcome = 'bloqueos'
+                else:
+                    outcome = 'errores'
+            with counters_lock:
+                counters[outcome] += 1
+        db.release_connection()
+
+    cleanup(db, args.fecha)
+    threads = [threading.Thread(target=worker, args=(args.semilla + i,)) for i in range(args.hilos)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    cleanup(db, args.fecha)
+
+    counters['segundos'] = elapsed
+    counters['intentos_por_seg'] = args.hilos * args.intentos / elapsed
+    counters['reservas_por_seg'] = counters['reservas'] / elapsed
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de contención al crear reservas')
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--intentos', type=int, default=50, help='intentos de reserva por hilo')
+    parser.add_argument('--fecha', default='2099-12-31', help='fecha sin reservas reales')
+    parser.add_argument('--desde', default='18:00')
+    parser.add_argument('--hasta', default='23:00')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--estrategias', default='for_update,slots')
+    args = parser.parse_args()
+
+    db = Database(min_connections=2, max_connections=args.hilos + 2)
+    manager = ReservationManager(db)
+    with db.connection_scope():
+        id_usuario = db.execute_query("SELECT MIN(id) AS id FROM usuarios", fetch_one=True)['id']
+        mesas = [row['id'] for row in db.execute_query("SELECT id FROM mesas")]
+        manager.reservation_duration()
+
+    desde = sum(int(p) * f for p, f in zip(args.desde.split(':'), (3600, 60)))
+    hasta = sum(int(p) * f for p, f in zip(args.hasta.split(':'), (3600, 60)))
+    horas = [f"{s // 3600:02d}:{s % 3600 // 60:02d}" for s in range(desde, hasta, RESERVATION_SLOT_SECONDS)]
+
+    print(f"{args.hilos} hilos x {args.intentos} intentos, {len(mesas)} mesas, {len(horas)} horarios, fecha {args.fecha}")
+    print(f"{'estrategia':<12} {'reservas':>9} {'conflictos':>11} {'bloqueos':>9} {'errores':>8} "
+          f"{'seg':>7} {'intentos/s':>11} {'reservas/s':>11}")
+    for strategy in args.estrategias.split(','):
+        r = run(strategy, db, manager, args, id_usuario, mesas, horas)
+        print(f"{strategy:<12} {r['reservas']:>9} {r['conflictos']:>11} {r['bloqueos']:>9} {r['errores']:>8} "
+              f"{r['segundos']:>7.2f} {r['intentos_por_seg']:>11.1f} {r['reservas_por_seg']:>11.1f}")
+
+    db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
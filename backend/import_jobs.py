@@ -0,0 +1,129 @@
+"""
+Trabajos de importación en segundo plano con progreso consultable
+Cumple RNF-001: Rendimiento - las importaciones grandes no ocupan un hilo
+de Flask ni chocan con los timeouts del cliente o del proxy
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from scaling import AsyncTaskQueue
+
+
+class ImportJob:
+    """Estado y contadores de un trabajo; `update` se llama desde el hilo del trabajo"""
+
+    def __init__(self, tipo: str, id_usuario: int):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.id_usuario = id_usuario
+        self.estado = 'en_cola'
+        self.progreso = {'filas_procesadas': 0, 'creados': 0, 'actualizados': 0, 'errores': 0}
+        self.resultado = None
+        self.error = None
+        self.creado_en = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.iniciado_en = None
+        self.finalizado_en = None
+        self.task_id = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, **counters) -> None:
+        """Actualizar contadores de progreso"""
+        with self._lock:
+            self.progreso.update(counters)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'id': self.id,
+                'tipo': self.tipo,
+                'estado': self.estado,
+                'progreso': dict(self.progreso),
+                'resultado': self.resultado,
+                'error': self.error,
+                'creado_en': self.creado_en,
+                'iniciado_en': self.iniciado_en,
+                'finalizado_en': self.finalizado_en
+            }
+
+
+class ImportJobManager:
+    """
+    Trabajos de importación ejecutados en una AsyncTaskQueue.
+
+    - `submit` devuelve el trabajo de inmediato; la función recibe el
+      trabajo como primer argumento para reportar progreso y su valor de
+      retorno queda como resultado final
+    - Una excepción deja el trabajo en estado 'error' con el mensaje
+    - `on_finish` se ejecuta al terminar en el hilo del trabajo (p. ej. para
+      devolver la conexión a la base al pool)
+    - Los trabajos terminados se descartan a los `ttl` segundos
+    """
+
+    def __init__(self, queue: AsyncTaskQueue, ttl: int = 3600, on_finish: Optional[Callable] = None):
+        self.queue = queue
+        self.ttl = ttl
+        self.on_finish = on_finish
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, tipo: str, id_usuario: int, func: Callable, *args, **kwargs) -> ImportJob:
+        """Encolar `func(job, *args, **kwargs)`"""
+        self._purge()
+        job = ImportJob(tipo, id_usuario)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.task_id = self.queue.submit_task(self._run, job, func, *args, **kwargs)
+        return job
+
+    def _run(self, job: ImportJob, func: Callable, *args, **kwargs):
+        with job._lock:
+            job.estado = 'en_proceso'
+            job.iniciado_en = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            resultado = func(job, *args, **kwargs)
+            estado, error = 'completado', None
+        except Exception as e:
+            print(f"Error en trabajo de importación {job.id}: {e}")
+            resultado, estado, error = None, 'error', str(e)
+        finally:
+            if self.on_finish:
+                self.on_finish()
+        with job._lock:
+            job.resultado = resultado
+            job.estado = estado
+            job.error = error
+            job.finalizado_en = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            job.finished_at = time.monotonic()
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        """Trabajo por id (None si no existe o ya expiró)"""
+        self._purge()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.finished_at is not None and now - job.finished_at > self.ttl
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            # Liberar el future que la cola guarda hasta que se consulta
+            try:
+                self.queue.get_task_result(job.task_id)
+            except Exception:
+                pass
+
+    def get_stats(self) -> Dict:
+        """Obtener estadísticas de los trabajos"""
+        with self._lock:
+            estados = [job.estado for job in self._jobs.values()]
+        return {estado: estados.count(estado) for estado in ('en_cola', 'en_proceso', 'completado', 'error')}
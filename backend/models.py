@@ -1,18 +1,390 @@
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, FieldType, IntegrityError, InterfaceError, OperationalError, errorcode
 import bcrypt
+import threading
+import weakref
+import base64
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import json
 import os
+import unicodedata
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
+from scaling import CacheManager, DatabaseConnectionPool
+from occupancy_index import DayOccupancy, OccupancyIndex, date_key, seconds_to_time, time_to_seconds
+from table_allocator import TableAllocator
+from upload_reader import UploadError
+
 # Cargar variables de entorno
 load_dotenv()
 
+# Errores de cliente que indican una conexión perdida con el servidor
+CONNECTION_LOST_ERRNOS = {
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+}
+
+# Valores del ENUM horarios.dia_semana, en el orden de date.weekday()
+DIAS_SEMANA = ('lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo')
+
+# Sentencias que se pueden reintentar sin efectos secundarios
+IDEMPOTENT_STATEMENTS = ('SELECT', 'SHOW', 'DESCRIBE', 'EXPLAIN')
+
+def _format_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def _format_time(value):
+    # MySQL devuelve las columnas TIME como timedelta
+    total_seconds = int(value.total_seconds())
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+# Conversión a valores listos para JSON según el tipo de columna
+COLUMN_CONVERTERS = {
+    FieldType.DATE: _format_datetime,
+    FieldType.NEWDATE: _format_datetime,
+    FieldType.DATETIME: _format_datetime,
+    FieldType.TIMESTAMP: _format_datetime,
+    FieldType.TIME: _format_time,
+    FieldType.DECIMAL: float,
+    FieldType.NEWDECIMAL: float,
+}
+
+def build_row_converters(description):
+    """
+    Arma, una vez por resultado, la lista (columna, conversor) a partir de
+    cursor.description. Solo incluye las columnas que necesitan conversión
+    """
+    if not description:
+        return []
+    converters = {}
+    for column in description:
+        name, type_code = column[0], column[1]
+        converter = COLUMN_CONVERTERS.get(type_code)
+        if converter is not None:
+            converters[name] = converter
+        else:
+            # Con columnas repetidas el diccionario conserva la última
+            converters.pop(name, None)
+    return list(converters.items())
+
+def convert_rows(rows, converters):
+    """Aplica los conversores de columna a todas las filas en una pasada"""
+    if not converters:
+        return rows
+    for row in rows:
+        for name, converter in converters:
+            value = row[name]
+            if value is not None:
+                row[name] = converter(value)
+    return rows
+
+MAX_PAGE_SIZE = 500
+
+def encode_page_cursor(values):
+    """Cursor opaco de paginación (keyset) a partir de la última fila devuelta"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_page_cursor(token, size):
+    """Decodifica un cursor de paginación; ValueError si no es válido"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor de paginación inválido')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Cursor de paginación inválido')
+    return values
+
+def normalize_page_limit(limit, default=50):
+    try:
+        limit = int(limit) if limit is not None else default
+    except (ValueError, TypeError):
+        raise ValueError('El parámetro limit debe ser un número entero')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def build_reservation_filters(fecha_desde=None, fecha_hasta=None, estado=None,
+                              id_zona=None, id_mesa=None, date_column='r.fecha'):
+    """
+    Condiciones WHERE (y sus parámetros) para los filtros de reservas.
+    Se aplican en SQL para que el índice haga el trabajo
+    """
+    clauses = []
+    params = []
+    if fecha_desde:
+        clauses.append(f"{date_column} >= %s")
+        params.append(fecha_desde)
+    if fecha_hasta:
+        if date_column == 'r.fecha':
+            clauses.append(f"{date_column} <= %s")
+        else:
+            # Columna DATETIME: rango semiabierto para seguir siendo sargable
+            clauses.append(f"{date_column} < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(fecha_hasta)
+    if estado:
+        clauses.append("r.estado = %s")
+        params.append(estado)
+    if id_zona:
+        clauses.append("m.id_zona = %s")
+        params.append(id_zona)
+    if id_mesa:
+        # También las reservas combinadas donde la mesa es una adicional
+        clauses.append(
+            "(r.id_mesa = %s OR EXISTS ("
+            "SELECT 1 FROM reservas rc WHERE rc.id_reserva_principal = r.id AND rc.id_mesa = %s))"
+        )
+        params.extend([id_mesa, id_mesa])
+    return clauses, params
+
+# Mesas adicionales de una reserva combinada como arreglo JSON, para que el
+# listado tenga una fila por reserva (las filas adicionales se excluyen con
+# r.id_reserva_principal IS NULL)
+COMBINED_TABLES_COLUMN = """
+    (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                'id_reserva', rc.id, 'id_mesa', rc.id_mesa,
+                'mesa_numero', mc.numero, 'numero_comensales', rc.numero_comensales))
+     FROM reservas rc
+     JOIN mesas mc ON rc.id_mesa = mc.id
+     WHERE rc.id_reserva_principal = r.id) AS mesas_adicionales
+"""
+
+def with_combined_tables(reservation):
+    """
+    Reemplaza mesas_adicionales (COMBINED_TABLES_COLUMN) por `mesas`, todas
+    las mesas de la reserva empezando por la principal, y agrega
+    `comensales_total`, la suma de los comensales de todas ellas
+    """
+    extra = reservation.pop('mesas_adicionales', None)
+    if isinstance(extra, (bytes, bytearray)):
+        extra = extra.decode()
+    extra = sorted(json.loads(extra), key=lambda mesa: mesa['id_reserva']) if extra else []
+    reservation['mesas'] = [{
+        'id_reserva': reservation['id'],
+        'id_mesa': reservation['id_mesa'],
+        'mesa_numero': reservation['mesa_numero'],
+        'numero_comensales': reservation['numero_comensales']
+    }] + extra
+    reservation['comensales_total'] = sum(mesa['numero_comensales'] for mesa in reservation['mesas'])
+    return reservation
+
+def reservation_keyset_clause(after):
+    """
+    Condición "después del cursor" para listados de reservas ordenados por
+    (fecha, hora, id) DESC. Forma expandida (en lugar de una comparación de
+    tuplas) para que MySQL resuelva el rango sobre el índice (fecha, hora, id)
+    """
+    fecha, hora, last_id = decode_page_cursor(after, 3)
+    clause = """
+        r.fecha <= %s AND (
+            r.fecha < %s OR (r.fecha = %s AND (
+                r.hora < %s OR (r.hora = %s AND r.id < %s)
+            ))
+        )
+    """
+    return clause, [fecha, fecha, fecha, hora, hora, last_id]
+
+# Valores por consulta IN al validar archivos Excel
+EXCEL_LOOKUP_CHUNK = 1000
+
+def collation_key(text):
+    """
+    Clave de comparación equivalente a utf8mb4_unicode_ci: sin espacios a
+    los lados, sin acentos y sin distinguir mayúsculas
+    """
+    decomposed = unicodedata.normalize('NFKD', str(text).strip())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+# Filas por executemany al importar platos
+IMPORT_CHUNK = 1000
+
+# Límites de las columnas INT y DECIMAL(10,2) de platos
+MYSQL_INT_MAX = 2 ** 31 - 1
+PRECIO_MAX = 99999999.99
+
+# Duración de cada slot de reservas_slots (debe coincidir con reservas_slots.sql).
+# La hora de una reserva debe caer en un múltiplo de 15 minutos y su duración
+# se redondea hacia arriba a slots enteros: así [inicio, fin) cubre slots
+# completos y dos reservas que solo se tocan nunca comparten un slot
+RESERVATION_SLOT_SECONDS = 900
+
+# Motivo de conflicto cuando otra reserva ya ocupa la mesa en ese horario
+MESA_NO_DISPONIBLE = 'La mesa no está disponible en ese horario'
+
+# Motivo de rechazo de una hora que no cae al inicio de un slot
+HORA_NO_ALINEADA = 'La hora debe ser múltiplo de 15 minutos (:00, :15, :30 o :45)'
+
+
+def slot_aligned(hora) -> bool:
+    """True si `hora` ('HH:MM[:SS]', time o timedelta) empieza un slot de reservas_slots"""
+    try:
+        return time_to_seconds(hora) % RESERVATION_SLOT_SECONDS == 0
+    except (TypeError, ValueError):
+        return False
+
+class ConflictError(Exception):
+    """
+    Conflicto de negocio dentro de una unidad de trabajo (mesa ocupada, stock
+    insuficiente). Al salir de Database.transaction() provoca el rollback
+    """
+
+class PreparedStatementCache:
+    """
+    LRU por conexión de cursores preparados (sentencias del lado del servidor),
+    indexado por el texto SQL. Reutilizar el cursor evita que MySQL vuelva a
+    parsear la misma sentencia en cada llamada
+    """
+    
+    def __init__(self, max_statements=64, max_sql_length=8192):
+        self.max_statements = max_statements
+        self.max_sql_length = max_sql_length
+        # Las entradas desaparecen junto con la conexión que las preparó
+        self._caches = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def cacheable(self, query):
+        return len(query) <= self.max_sql_length
+    
+    def get_cursor(self, connection, query):
+        """
+        Devuelve (cursor, sql) para la sentencia. El cursor debe ejecutarse con
+        el mismo objeto `sql` devuelto para que el conector reutilice el
+        statement ya preparado en lugar de prepararlo de nuevo
+        """
+        with self.lock:
+            cache = self._caches.get(connection)
+            if cache is None:
+                cache = OrderedDict()
+                self._caches[connection] = cache
+            
+            entry = cache.get(query)
+            if entry is not None:
+                cache.move_to_end(query)
+                self.hits += 1
+                return entry
+            
+            self.misses += 1
+            evicted = None
+            if len(cache) >= self.max_statements:
+                _, evicted = cache.popitem(last=False)
+                self.evictions += 1
+        
+        if evicted is not None:
+            self._close_cursor(evicted[0])
+        
+        entry = (connection.cursor(prepared=True, dictionary=True), query)
+        with self.lock:
+            cache[query] = entry
+        return entry
+    
+    def discard(self, connection, query):
+        """Quitar una sentencia cuyo cursor quedó en estado desconocido"""
+        with self.lock:
+            cache = self._caches.get(connection)
+            entry = cache.pop(query, None) if cache is not None else None
+        if entry is not None:
+            self._close_cursor(entry[0])
+    
+    def invalidate(self, connection):
+        """Olvidar las sentencias de una conexión (reset o descarte)"""
+        with self.lock:
+            cache = self._caches.pop(connection, None)
+        # Tras un reset el servidor ya liberó los statements: no se cierran
+        return len(cache) if cache else 0
+    
+    def _close_cursor(self, cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    
+    def get_stats(self):
+        with self.lock:
+            total_requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total_requests * 100) if total_requests > 0 else 0,
+                'evictions': self.evictions,
+                'cached_statements': sum(len(c) for c in self._caches.values()),
+                'connections': len(self._caches),
+                'max_statements_per_connection': self.max_statements
+            }
+
+class RowStream:
+    """
+    Filas de Database.stream_query. La conexión vuelve al pool al terminar
+    de recorrerlas y se descarta si se cierra antes (cliente desconectado,
+    HEAD o error): close() libera la conexión aunque nunca se haya iterado,
+    a diferencia del finally de un generador que no llegó a arrancar.
+    `map` agrega una transformación por fila sin perder close()
+    """
+
+    def __init__(self, pool, connection, cursor, batch_size=500):
+        self.pool = pool
+        self.connection = connection
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.converters = build_row_converters(cursor.description)
+        self.transforms = []
+        self._lock = threading.Lock()
+
+    def map(self, transform):
+        self.transforms.append(transform)
+        return self
+
+    def __iter__(self):
+        try:
+            while self.connection is not None:
+                batch = self.cursor.fetchmany(self.batch_size)
+                if not batch:
+                    self._release(finished=True)
+                    break
+                for row in convert_rows(batch, self.converters):
+                    for transform in self.transforms:
+                        row = transform(row)
+                    yield row
+        except Error as e:
+            print(f"Error en consulta (streaming): {e}")
+            raise
+        finally:
+            # Error o generador cerrado a mitad de camino
+            self.close()
+
+    def close(self):
+        """Descartar la conexión si quedaron filas sin leer; idempotente"""
+        self._release(finished=False)
+
+    def _release(self, finished):
+        with self._lock:
+            connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        if finished:
+            try:
+                self.cursor.close()
+            except Error:
+                finished = False
+        if finished:
+            self.pool.return_connection(connection)
+        else:
+            # No se drena un resultado sin buffer: se descarta la conexión
+            self.pool.discard_connection(connection)
+
 class Database:
-    def __init__(self):
-        self.connection = None
+    def __init__(self, min_connections=None, max_connections=None):
         self.config = {
             'host': os.getenv('DB_HOST', 'localhost'),
             'user': os.getenv('DB_USER', 'root'),
@@ -23,184 +395,341 @@ class Database:
             'charset': 'utf8mb4',
             'use_unicode': True
         }
+        self.min_connections = min_connections or int(os.getenv('DB_POOL_MIN', 2))
+        self.max_connections = max_connections or int(os.getenv('DB_POOL_MAX', 10))
+        self.pool_options = {
+            'max_lifetime': int(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+            'idle_timeout': int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+            'acquire_timeout': int(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 30))
+        }
+        self.statement_cache = PreparedStatementCache(
+            max_statements=int(os.getenv('DB_STMT_CACHE_SIZE', 64))
+        )
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        # Cada hilo (request de Flask) trabaja con su propia conexión del pool
+        self._local = threading.local()
+    
+    def _get_pool(self):
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self.pool = DatabaseConnectionPool(
+                        self.config,
+                        min_connections=self.min_connections,
+                        max_connections=self.max_connections,
+                        **self.pool_options
+                    )
+        return self.pool
+    
+    @property
+    def connection(self):
+        """Conexión asignada al request/hilo actual, tomada del pool bajo demanda"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None and self.connect():
+            conn = self._local.connection
+        return conn
     
     def connect(self):
+        """Toma una conexión del pool para el request/hilo actual"""
+        current = getattr(self._local, 'connection', None)
+        if current is not None:
+            # La conexión actual está caída: se descarta antes de pedir otra
+            self._discard_connection(current)
+        
         try:
-            self.connection = mysql.connector.connect(**self.config)
+            self._local.connection = self._get_pool().get_connection()
             return True
-        except Error as e:
+        except Exception as e:
             print(f"Error de conexión: {e}")
             # Intentar reconectar después de un breve retraso
             import time
             time.sleep(1)
             try:
-                self.connection = mysql.connector.connect(**self.config)
+                self._local.connection = self._get_pool().get_connection()
                 return True
-            except Error as e2:
+            except Exception as e2:
                 print(f"Segundo intento de conexión fallido: {e2}")
+                self._local.connection = None
                 return False
     
     def ensure_connection(self):
-        """Asegura que la conexión esté activa antes de cada consulta"""
-        if not self.connection or not self.connection.is_connected():
-            return self.connect()
-        return True
+        """
+        Asegura que el request tenga una conexión asignada. No hace ping:
+        el pool valida al prestar y las caídas se detectan al ejecutar
+        """
+        return self.connection is not None
+    
+    def release_connection(self):
+        """Devuelve al pool la conexión del request/hilo actual"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            return
+        self._local.connection = None
+        
+        try:
+            # No devolver al pool una transacción a medio terminar
+            if conn.in_transaction:
+                conn.rollback()
+        except Error as e:
+            print(f"Error al liberar conexión: {e}")
+        
+        if self.pool:
+            self.pool.return_connection(conn)
+    
+    def _discard_connection(self, conn):
+        self._local.connection = None
+        self.statement_cache.invalidate(conn)
+        if self.pool:
+            self.pool.discard_connection(conn)
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Unidad de trabajo: abre una transacción en la conexión del request y
+        entrega un cursor (dictionary=True). Confirma con un único COMMIT al
+        salir y revierte ante cualquier excepción. Si ya hay una transacción
+        abierta, se une a ella y el COMMIT queda a cargo de la externa
+        """
+        connection = self.connection
+        if connection is None:
+            raise Error("No hay conexión disponible a la base de datos")
+        
+        owns_transaction = not connection.in_transaction
+        if owns_transaction:
+            connection.start_transaction()
+            self._local.rollback_hooks = []
+        cursor = connection.cursor(dictionary=True)
+        try:
+            yield cursor
+            if owns_transaction:
+                connection.commit()
+        except BaseException:
+            if owns_transaction:
+                try:
+                    connection.rollback()
+                except Error as e:
+                    print(f"Error al revertir transacción: {e}")
+                for callback in self._local.rollback_hooks:
+                    callback()
+            raise
+        finally:
+            if owns_transaction:
+                self._local.rollback_hooks = None
+            try:
+                cursor.close()
+            except Error:
+                pass
+    
+    def on_rollback(self, callback):
+        """
+        Registrar una acción a ejecutar si la transacción en curso se revierte
+        (p. ej. devolver stock concedido en memoria). Sin transacción no hace nada
+        """
+        hooks = getattr(self._local, 'rollback_hooks', None)
+        if hooks is not None:
+            hooks.append(callback)
+    
+    @contextmanager
+    def connection_scope(self):
+        """
+        Unidad de trabajo fuera de un request (tareas en segundo plano, scripts):
+        toma una conexión del pool y la devuelve al terminar
+        """
+        owns_connection = getattr(self._local, 'connection', None) is None
+        try:
+            yield self.connection
+        finally:
+            if owns_connection:
+                self.release_connection()
     
     def disconnect(self):
-        if self.connection and self.connection.is_connected():
+        self.release_connection()
+        if self.pool:
             try:
-                self.connection.close()
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
-            except Error as e:
-                print(f"Error al cerrar conexión: {e}")
+                self.pool.close_all()
             except Error as e:
                 print(f"Error al cerrar conexión: {e}")
+    
+    def _is_connection_lost(self, error):
+        """Errores del cliente que indican que el servidor cerró la conexión"""
+        if error.errno in CONNECTION_LOST_ERRNOS:
+            return True
+        # "MySQL Connection not available" no trae errno
+        return error.errno is None and isinstance(error, (InterfaceError, OperationalError))
+    
+    def _is_idempotent_read(self, query, connection):
+        if connection is not None and connection.in_transaction:
+            return False
+        words = query.split(None, 1)
+        if not words or words[0].upper() not in IDEMPOTENT_STATEMENTS:
+            return False
+        return 'FOR UPDATE' not in query.upper()
+    
+    def _reset_after_error(self, error):
+        error_msg = str(error).lower()
+        if self._is_connection_lost(error):
+            print("Conexión MySQL perdida, se tomará otra del pool...")
+            self._discard_connection(self._local.connection)
+        # Si hay error de sync, resetear la conexión
+        elif 'commands out of sync' in error_msg or 'not enough parameters' in error_msg:
+            print("Reseteando conexión MySQL debido a error de sincronización...")
+            try:
+                self._local.connection.cmd_reset_connection()
+                # El reset libera en el servidor los statements preparados
+                self.statement_cache.invalidate(self._local.connection)
+            except:
+                self._discard_connection(self._local.connection)
+    
+    def execute_query(self, query, params=None, fetch_one=False, fetch_all=True, prepared=False):
+        """
+        Ejecuta una consulta. Con prepared=True la sentencia se prepara una sola
+        vez por conexión y se reutiliza (para consultas calientes y repetitivas)
+        """
+        prepared = prepared and self.statement_cache.cacheable(query)
+        
+        # Sin ping previo: la vida de la conexión se valida en el pool y los
+        # errores de conexión se detectan al ejecutar
+        for attempt in range(2):
+            cursor = None
+            connection = self.connection
+            try:
+                if connection is None:
+                    return None
+                
+                if prepared:
+                    cursor, statement = self.statement_cache.get_cursor(connection, query)
+                    cursor.execute(statement, params)
+                else:
+                    cursor = connection.cursor(dictionary=True)
+                    cursor.execute(query, params)
+                
+                if fetch_one:
+                    result = cursor.fetchone()
+                    if prepared and cursor.with_rows:
+                        # El cursor se reutiliza: no dejar filas sin leer
+                        cursor.fetchall()
+                elif fetch_all:
+                    result = cursor.fetchall()
+                else:
+                    result = True
+                
+                # Fechas, horas y decimales a valores listos para JSON
+                if result and isinstance(result, list):
+                    convert_rows(result, build_row_converters(cursor.description))
+                elif result and result != True:
+                    convert_rows((result,), build_row_converters(cursor.description))
+                
+                return result
             except Error as e:
-                print(f"Error al cerrar conexión: {e}")
+                print(f"Error en consulta: {e}")
+                if prepared and cursor is not None:
+                    self.statement_cache.discard(connection, query)
+                    cursor = None
+                # Reintento transparente, una sola vez, para lecturas idempotentes
+                retry = (attempt == 0 and self._is_connection_lost(e)
+                         and self._is_idempotent_read(query, connection))
+                if getattr(self._local, 'connection', None) is connection:
+                    self._reset_after_error(e)
+                if not retry:
+                    return None
+            finally:
+                # SIEMPRE cerrar el cursor, incluso si hay error (los preparados
+                # quedan abiertos en la caché para reutilizarlos)
+                if cursor and not prepared:
+                    try:
+                        cursor.close()
+                    except:
+                        pass
+        return None
     
-    def execute_query(self, query, params=None, fetch_one=False, fetch_all=True):
+    def execute_insert(self, query, params):
         cursor = None
+        connection = self.connection
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
+            if connection is None:
+                return None
             
-            cursor = self.connection.cursor(dictionary=True)
+            cursor = connection.cursor()
             cursor.execute(query, params)
-            
-            if fetch_one:
-                result = cursor.fetchone()
-            elif fetch_all:
-                result = cursor.fetchall()
-            else:
-                result = True
-            
-            # Handle datetime/timedelta serialization
-            if result and isinstance(result, list):
-                for row in result:
-                    self._serialize_datetime_fields(row)
-            elif result and result != True:
-                self._serialize_datetime_fields(result)
-            
-            return result
+            # Con autocommit activo el INSERT ya quedó confirmado: un COMMIT
+            # adicional solo agrega otro viaje al servidor
+            if not self.config['autocommit']:
+                connection.commit()
+            last_id = cursor.lastrowid
+            return last_id
         except Error as e:
-            print(f"Error en consulta: {e}")
-            error_msg = str(e).lower()
-            # Si hay error de sync, resetear la conexión
-            if 'commands out of sync' in error_msg or 'not enough parameters' in error_msg:
-                print("Reseteando conexión MySQL debido a error de sincronización...")
-                if self.connection:
+            print(f"Error en inserción: {e}")
+            if getattr(self._local, 'connection', None) is connection:
+                if not self._is_connection_lost(e):
                     try:
-                        self.connection.cmd_reset_connection()
+                        connection.rollback()
                     except:
-                        self.connect()
+                        pass
+                self._reset_after_error(e)
             return None
         finally:
-            # SIEMPRE cerrar el cursor, incluso si hay error
+            # SIEMPRE cerrar el cursor
             if cursor:
                 try:
                     cursor.close()
                 except:
                     pass
     
-    def execute_insert(self, query, params):
+    def execute_update(self, query, params):
+        """Ejecuta un UPDATE/DELETE y devuelve las filas afectadas (None si hay error)"""
         cursor = None
+        connection = self.connection
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
+            if connection is None:
+                return None
             
-            cursor = self.connection.cursor()
+            cursor = connection.cursor()
             cursor.execute(query, params)
-            self.connection.commit()
-            last_id = cursor.lastrowid
-            return last_id
+            return cursor.rowcount
         except Error as e:
-            print(f"Error en inserción: {e}")
-            if self.connection:
-                try:
-                    self.connection.rollback()
-                except:
-                    pass
-                # Si hay error de sincronización, resetear conexión
-                if 'commands out of sync' in str(e).lower() or 'not enough parameters' in str(e).lower():
-                    print("Reseteando conexión MySQL debido a error de sincronización...")
-                    try:
-                        self.connection.cmd_reset_connection()
-                    except:
-                        self.connect()
+            print(f"Error en actualización: {e}")
+            if getattr(self._local, 'connection', None) is connection:
+                self._reset_after_error(e)
             return None
         finally:
-            # SIEMPRE cerrar el cursor
             if cursor:
                 try:
                     cursor.close()
                 except:
                     pass
     
-    def _serialize_datetime_fields(self, obj):
-        """Convert datetime and timedelta objects to strings for JSON serialization"""
-        if isinstance(obj, dict):
-            for key, value in obj.items():
-                if hasattr(value, 'strftime'):  # datetime objects
-                    obj[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                elif hasattr(value, 'total_seconds'):  # timedelta objects
-                    total_seconds = int(value.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    seconds = total_seconds % 60
-                    obj[key] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    def stream_query(self, query, params=None, batch_size=500):
+        """
+        Filas para resultados grandes: cursor sin buffer y lotes con
+        fetchmany, de modo que la memoria no crece con el tamaño del
+        resultado. La conexión del request pasa al RowStream (el request no
+        retiene una segunda conexión del pool) y la consulta se ejecuta
+        antes de devolverlo, así un pool agotado o un error de SQL se
+        detectan antes de enviar la respuesta. Quien lo recibe debe llamar
+        a close() aunque no lo recorra (ver stream_json_rows)
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and not connection.in_transaction:
+            # El RowStream se queda con la conexión; el request toma otra si la necesita
+            self._local.connection = None
+        else:
+            connection = self._get_pool().get_connection()
+        
+        pool = self.pool
+        try:
+            cursor = connection.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, params)
+        except Exception as e:
+            print(f"Error en consulta (streaming): {e}")
+            pool.discard_connection(connection)
+            raise
+        
+        return RowStream(pool, connection, cursor, batch_size)
+    
+    def get_statement_cache_stats(self):
+        """Estadísticas de la caché de sentencias preparadas"""
+        return self.statement_cache.get_stats()
 
 class AuthManager:
     def __init__(self, db):
@@ -214,7 +743,7 @@ class AuthManager:
     
     def login(self, email, password):
         query = "SELECT * FROM usuarios WHERE email = %s"
-        user = self.db.execute_query(query, (email,), fetch_one=True)
+        user = self.db.execute_query(query, (email,), fetch_one=True, prepared=True)
         
         if user and self.verify_password(password, user['password']):
             return user
@@ -239,199 +768,974 @@ class AuthManager:
         return user_id
 
 class ReservationManager:
-    def __init__(self, db):
+    # Duración de una reserva si configuracion_sistema no define tiempo_reserva_default
+    DEFAULT_DURATION_SECONDS = 7200
+    DURATION_REFRESH_SECONDS = 300
+    
+    def __init__(self, db, menu_manager=None):
         self.db = db
+        self.menu_manager = menu_manager or MenuManager(db)
+        self._duration = None
+        self._duration_loaded_at = None
+        # Índice en memoria de ocupación por fecha (desactivar con OCCUPANCY_INDEX=0)
+        self.occupancy = None
+        if os.getenv('OCCUPANCY_INDEX', '1') == '1':
+            self.occupancy = OccupancyIndex(ttl=int(os.getenv('OCCUPANCY_INDEX_TTL', 60)))
+        # Disponibilidad en caché por fecha (ver _availability_cache_key)
+        self.availability_cache = CacheManager(
+            max_size=int(os.getenv('AVAILABILITY_CACHE_SIZE', 500)),
+            default_ttl=int(os.getenv('AVAILABILITY_CACHE_TTL', 30))
+        )
+        self._date_generations = {}
+        self._tables_generation = 0
+        # Mesas que pasaron a 'reservada' desde el último tables_changed (ver check_availability)
+        self._reserved_tables = frozenset()
+        self._generation_lock = threading.Lock()
+        # Asignación automática de mesas (mejor ajuste o mesas contiguas)
+        self.allocator = TableAllocator(
+            adjacency_distance=float(os.getenv('TABLE_ADJACENCY_DISTANCE', 30)),
+            max_tables=int(os.getenv('TABLE_COMBINATION_MAX', 3))
+        )
+    
+    def _config_int(self, clave, default):
+        """Valor entero de configuracion_sistema, o `default` si no está definido"""
+        row = self.db.execute_query(
+            "SELECT valor FROM configuracion_sistema WHERE clave = %s", (clave,), fetch_one=True
+        )
+        try:
+            return int(row['valor']) if row else default
+        except (TypeError, ValueError):
+            return default
+    
+    def reservation_duration(self):
+        """
+        Duración de una reserva en segundos (tiempo_reserva_default, en
+        minutos), redondeada hacia arriba a slots de RESERVATION_SLOT_SECONDS
+        """
+        now = datetime.now()
+        if self._duration is None or now - self._duration_loaded_at > timedelta(seconds=self.DURATION_REFRESH_SECONDS):
+            minutes = self._config_int('tiempo_reserva_default', self.DEFAULT_DURATION_SECONDS // 60)
+            slots = max(1, -(-minutes * 60 // RESERVATION_SLOT_SECONDS))
+            self._duration = slots * RESERVATION_SLOT_SECONDS
+            self._duration_loaded_at = now
+        return self._duration
+    
+    def reservation_interval(self, hora):
+        """(inicio, fin) como 'HH:MM:SS' para una reserva que empieza a `hora`"""
+        inicio = time_to_seconds(hora)
+        return seconds_to_time(inicio), seconds_to_time(inicio + self.reservation_duration())
+    
+    def _get_tables(self):
+        """Todas las mesas con su zona, desde la caché del índice si está cargada"""
+        tables, version = self.occupancy.get_tables() if self.occupancy is not None else (None, 0)
+        if tables is None:
+            query = """
+                SELECT m.*, z.nombre as zona_nombre 
+                FROM mesas m
+                LEFT JOIN zonas z ON m.id_zona = z.id
+                ORDER BY m.id
+            """
+            tables = self.db.execute_query(query)
+            if tables is not None and self.occupancy is not None:
+                self.occupancy.set_tables(tables, version)
+                # La caché expiró o se invalidó: puede haber mesas nuevas o movidas
+                self.allocator.invalidate()
+        return tables
+    
+    def _busy_tables(self, fecha, hora):
+        """Mesas ocupadas a esa hora; carga la fecha en el índice si hace falta"""
+        duracion = self.reservation_duration()
+        busy = self.occupancy.busy_tables(fecha, hora, duracion)
+        if busy is None:
+            version = self.occupancy.version(fecha)
+            query = """
+                SELECT id, id_mesa, TIME_TO_SEC(hora) AS inicio, TIME_TO_SEC(hora_fin) AS fin
+                FROM reservas
+                WHERE fecha = %s AND estado = 'confirmada'
+            """
+            rows = self.db.execute_query(query, (fecha,), prepared=True)
+            if rows is not None and self.occupancy.load(fecha, rows, version):
+                busy = self.occupancy.busy_tables(fecha, hora, duracion)
+        return busy
+    
+    def _availability_cache_key(self, fecha):
+        """Clave de la fecha en la caché, con la generación de la fecha y de las mesas"""
+        fecha = date_key(fecha)
+        with self._generation_lock:
+            return f"disponibilidad:{fecha}:{self._tables_generation}:{self._date_generations.get(fecha, 0)}"
+    
+    def _invalidate_availability(self, *fechas):
+        """
+        Descartar la disponibilidad en caché de esas fechas. Al subir la
+        generación, un cálculo que empezó antes de la escritura se guarda bajo
+        una clave que ya nadie consulta
+        """
+        for fecha in fechas:
+            if not fecha:
+                continue
+            old_key = self._availability_cache_key(fecha)
+            with self._generation_lock:
+                key = date_key(fecha)
+                self._date_generations[key] = self._date_generations.get(key, 0) + 1
+            self.availability_cache.delete(old_key)
     
     def check_availability(self, fecha, hora, comensales, id_zona=None):
+        """
+        Mesas libres para el grupo a esa hora. Los resultados se guardan por
+        fecha en availability_cache y se descartan cuando cambia una reserva
+        de esa fecha o las mesas. Una mesa que pasa a 'reservada' al recibir
+        su primera reserva no descarta las demás fechas: se filtra al leer
+        """
+        cache_key = self._availability_cache_key(fecha)
+        query_key = (str(hora)[:5], int(comensales), str(id_zona or ''))
+        results = self.availability_cache.get(cache_key)
+        if results is not None and query_key in results:
+            available = results[query_key]
+        else:
+            available = self._compute_availability(fecha, hora, comensales, id_zona)
+            if available is None:
+                return None
+            # El dict guardado no se modifica (otros hilos lo leen): se guarda
+            # una copia con el resultado nuevo
+            updated = dict(results or {})
+            updated[query_key] = available
+            self.availability_cache.set(cache_key, updated)
+        
+        reserved = self._reserved_tables
+        if reserved:
+            available = [table for table in available if table['id'] not in reserved]
+        return available
+    
+    def _compute_availability(self, fecha, hora, comensales, id_zona=None):
+        if self.occupancy is not None:
+            tables = self._get_tables()
+            busy = self._busy_tables(fecha, hora) if tables is not None else None
+            if busy is not None:
+                return [
+                    table for table in tables
+                    if table['capacidad'] >= int(comensales)
+                    and table['estado'] == 'disponible'
+                    and table['id'] not in busy
+                    and (not id_zona or str(table['id_zona']) == str(id_zona))
+                ]
+        
+        # Sin índice (o si falló la carga): consulta directa con predicado de
+        # rango sobre (hora, hora_fin), que puede usar los índices de reservas
         self.db.ensure_connection()
+        inicio, fin = self.reservation_interval(hora)
+        
+        if id_zona:
+            query = """
+                SELECT m.*, z.nombre as zona_nombre 
+                FROM mesas m
+                LEFT JOIN zonas z ON m.id_zona = z.id
+                WHERE m.capacidad >= %s 
+                AND m.estado = 'disponible'
+                AND m.id NOT IN (
+                    SELECT id_mesa FROM reservas 
+                    WHERE fecha = %s 
+                    AND estado = 'confirmada'
+                    AND hora < %s AND hora_fin > %s
+                )
+                AND m.id_zona = %s
+            """
+            params = (comensales, fecha, fin, inicio, id_zona)
+        else:
+            query = """
+                SELECT m.*, z.nombre as zona_nombre 
+                FROM mesas m
+                LEFT JOIN zonas z ON m.id_zona = z.id
+                WHERE m.capacidad >= %s 
+                AND m.estado = 'disponible'
+                AND m.id NOT IN (
+                    SELECT id_mesa FROM reservas 
+                    WHERE fecha = %s 
+                    AND estado = 'confirmada'
+                    AND hora < %s AND hora_fin > %s
+                )
+            """
+            params = (comensales, fecha, fin, inicio)
+        
+        return self.db.execute_query(query, params, prepared=True)
+    
+    def _insert_reservation(self, cursor, id_usuario, id_mesa, fecha, hora, comensales, observaciones,
+                            id_reserva_principal=None):
+        """
+        Inserta la reserva y ocupa sus slots (dentro de una transacción).
+        Devuelve (id de la reserva, si la mesa cambió de estado)
+        """
+        inicio, fin = self.reservation_interval(hora)
+        
+        # Insertar reserva
+        insert_query = """
+            INSERT INTO reservas (id_usuario, id_mesa, fecha, hora, hora_fin, numero_comensales, observaciones, estado)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, 'confirmada')
+        """
+        params = (id_usuario, id_mesa, fecha, inicio, fin, comensales, observaciones)
+        if id_reserva_principal is not None:
+            # Mesa adicional de una combinación (ver reservas_combinadas.sql)
+            insert_query = """
+                INSERT INTO reservas (id_usuario, id_mesa, fecha, hora, hora_fin, numero_comensales, observaciones,
+                                      estado, id_reserva_principal)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, 'confirmada', %s)
+            """
+            params += (id_reserva_principal,)
+        try:
+            cursor.execute(insert_query, params)
+        except IntegrityError as e:
+            # unique_reserva (id_mesa, fecha, hora)
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                raise ConflictError(MESA_NO_DISPONIBLE)
+            raise
+        reservation_id = cursor.lastrowid
+        
+        # La clave única de reservas_slots impide la doble reserva sin
+        # bloquear rangos: solo compiten las reservas que se solapan
+        self._occupy_slots(cursor, reservation_id, id_mesa, fecha, inicio, fin)
+        
+        # Actualizar estado de la mesa
+        update_query = "UPDATE mesas SET estado = 'reservada' WHERE id = %s AND estado <> 'reservada'"
+        cursor.execute(update_query, (id_mesa,))
+        
+        return reservation_id, cursor.rowcount > 0
+    
+    def _occupy_slots(self, cursor, id_reserva, id_mesa, fecha, inicio, fin):
+        """
+        Ocupar los slots [inicio, fin) de la mesa; ConflictError si alguno ya
+        está tomado. inicio y fin deben estar alineados a
+        RESERVATION_SLOT_SECONDS (ver slot_aligned y reservation_duration):
+        con horas sueltas el redondeo haría chocar reservas que no se solapan
+        """
+        first = time_to_seconds(inicio) // RESERVATION_SLOT_SECONDS
+        last = -(-time_to_seconds(fin) // RESERVATION_SLOT_SECONDS)
+        try:
+            cursor.executemany(
+                "INSERT INTO reservas_slots (id_mesa, fecha, slot, id_reserva) VALUES (%s, %s, %s, %s)",
+                [(id_mesa, fecha, slot, id_reserva) for slot in range(first, last)]
+            )
+        except IntegrityError as e:
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                raise ConflictError(MESA_NO_DISPONIBLE)
+            raise
+    
+    def update_reservation(self, reservation_id, fecha, hora, comensales, observaciones, estado):
+        """
+        Actualiza la reserva (y las mesas adicionales de su combinación) y
+        vuelve a ocupar sus slots si sigue confirmada. Devuelve (filas
+        actualizadas, error) donde error es el motivo de un conflicto o
+        HORA_NO_ALINEADA si la hora cambia a una que no empieza un slot
+        """
+        inicio, fin = self.reservation_interval(hora)
+        try:
+            with self.db.transaction() as cursor:
+                cursor.execute("SELECT fecha, hora FROM reservas WHERE id = %s", (reservation_id,))
+                previous = cursor.fetchone()
+                # Solo una hora nueva debe caer en un slot: las reservas
+                # anteriores con horas sueltas se pueden editar o cancelar
+                if previous and time_to_seconds(previous['hora']) != time_to_seconds(hora) \
+                        and not slot_aligned(hora):
+                    return 0, HORA_NO_ALINEADA
+                cursor.execute("""
+                    UPDATE reservas 
+                    SET fecha = %s, hora = %s, hora_fin = %s, numero_comensales = %s, 
+                        observaciones = %s, estado = %s 
+                    WHERE id = %s
+                """, (fecha, inicio, fin, comensales, observaciones, estado, reservation_id))
+                rows_affected = cursor.rowcount
+                # Las mesas adicionales de una combinación siguen a la reserva principal
+                cursor.execute(
+                    "UPDATE reservas SET fecha = %s, hora = %s, hora_fin = %s, estado = %s WHERE id_reserva_principal = %s",
+                    (fecha, inicio, fin, estado, reservation_id)
+                )
+                
+                cursor.execute(
+                    "SELECT id, id_mesa FROM reservas WHERE id = %s OR id_reserva_principal = %s",
+                    (reservation_id, reservation_id)
+                )
+                group = cursor.fetchall()
+                if group:
+                    placeholders = ', '.join(['%s'] * len(group))
+                    cursor.execute(
+                        f"DELETE FROM reservas_slots WHERE id_reserva IN ({placeholders})",
+                        tuple(row['id'] for row in group)
+                    )
+                    if estado == 'confirmada':
+                        for row in group:
+                            self._occupy_slots(cursor, row['id'], row['id_mesa'], fecha, inicio, fin)
+        except ConflictError as e:
+            return 0, str(e)
+        except IntegrityError as e:
+            # unique_reserva al mover la reserva sobre otra de la misma mesa
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                return 0, MESA_NO_DISPONIBLE
+            raise
+        
+        self.reservation_changed(reservation_id, previous['fecha'] if previous else None, fecha)
+        return rows_affected, None
+    
+    def create_reservation(self, id_usuario, id_mesa, fecha, hora, comensales, observaciones=None):
+        result, _ = self.create_reservation_with_preorders(
+            id_usuario, id_mesa, fecha, hora, comensales, observaciones
+        )
+        return result['reservation_id'] if result else None
+    
+    def create_reservation_with_preorders(self, id_usuario, id_mesa, fecha, hora, comensales,
+                                          observaciones=None, preorders=None):
+        """
+        Crea la reserva y sus pre-pedidos en una sola transacción (un COMMIT):
+        bloqueo de disponibilidad, inserción de la reserva, pre-pedidos en lote
+        y descuento de stock. Si la mesa está ocupada o falta stock de algún
+        plato no se guarda nada.
+        
+        Devuelve (resultado, error): resultado es {'reservation_id', 'preorders'}
+        o None; error es el motivo del conflicto o None si fue un error interno
+        """
+        return self._book(id_usuario, [(id_mesa, comensales)], fecha, hora, observaciones, preorders)
+    
+    def _book(self, id_usuario, mesas, fecha, hora, observaciones=None, preorders=None):
+        """
+        Inserta en una transacción una reserva por cada (id_mesa, comensales);
+        las mesas adicionales quedan ligadas a la primera, que lleva los
+        pre-pedidos. Devuelve (resultado, error) como create_reservation_with_preorders
+        """
+        if not slot_aligned(hora):
+            return None, HORA_NO_ALINEADA
+        try:
+            reservation_ids = []
+            reserved_tables = []
+            with self.db.transaction() as cursor:
+                for id_mesa, comensales in mesas:
+                    reservation_id, estado_cambiado = self._insert_reservation(
+                        cursor, id_usuario, id_mesa, fecha, hora, comensales, observaciones,
+                        reservation_ids[0] if reservation_ids else None
+                    )
+                    reservation_ids.append(reservation_id)
+                    if estado_cambiado:
+                        reserved_tables.append(id_mesa)
+                if preorders:
+                    self.menu_manager.insert_preorders(cursor, reservation_ids[0], preorders)
+            
+            if self.occupancy is not None:
+                interval = self.reservation_interval(hora)
+                for reservation_id, (id_mesa, _) in zip(reservation_ids, mesas):
+                    self.occupancy.add(reservation_id, id_mesa, fecha, *interval)
+            if reserved_tables:
+                # Alguna mesa pasó a 'reservada': las demás fechas la filtran al
+                # leer, sin descartar toda la caché en cada primera reserva
+                self.tables_reserved(reserved_tables)
+            self._invalidate_availability(fecha)
+            return {
+                'reservation_id': reservation_ids[0],
+                'reservation_ids': reservation_ids,
+                'mesas': [id_mesa for id_mesa, _ in mesas],
+                'preorders': len(preorders or [])
+            }, None
+        except ConflictError as e:
+            return None, str(e)
+        except Exception as e:
+            print(f"Error al crear reserva (atomicidad): {e}")
+            return None, None
+    
+    def assign_tables(self, fecha, hora, comensales, id_zona=None):
+        """
+        Mesa más chica en la que entra el grupo, o combinación de mesas
+        contiguas de una misma zona. Devuelve la lista de mesas o None
+        """
+        all_tables = self._get_tables()
+        free_tables = self.check_availability(fecha, hora, 1, id_zona)
+        if not all_tables or not free_tables:
+            return None
+        return self.allocator.allocate(all_tables, free_tables, comensales)
+    
+    def create_auto_reservation(self, id_usuario, fecha, hora, comensales, observaciones=None,
+                                preorders=None, id_zona=None, attempts=3):
+        """
+        Reserva con asignación automática de mesas. Si otra reserva ganó
+        alguna de las mesas elegidas entre la asignación y el bloqueo, se
+        vuelve a asignar con la disponibilidad actualizada
+        """
+        conflict = 'No hay mesas disponibles para ese grupo en ese horario'
+        for _ in range(attempts):
+            tables = self.assign_tables(fecha, hora, comensales, id_zona)
+            if not tables:
+                return None, conflict
+            counts = TableAllocator.split_guests(tables, comensales)
+            result, conflict = self._book(
+                id_usuario, [(table['id'], count) for table, count in zip(tables, counts)],
+                fecha, hora, observaciones, preorders
+            )
+            if result or conflict != MESA_NO_DISPONIBLE:
+                return result, conflict
+            if self.occupancy is not None:
+                self.occupancy.invalidate(fecha)
+        return None, conflict
+    
+    def get_day_availability(self, fecha, comensales=1, id_zona=None, intervalo=30):
+        """
+        Matriz de disponibilidad (horario × mesa) de un día completo, con la
+        misma regla de solapamiento que check_availability. Se arma con NumPy a
+        partir de una sola lectura de las reservas confirmadas del día.
+        
+        Devuelve {'horas', 'mesas', 'disponible'} donde disponible[i][j] indica
+        si la mesa j está libre a la hora i, o None si hubo un error
+        """
+        dia = DIAS_SEMANA[datetime.strptime(str(fecha)[:10], '%Y-%m-%d').weekday()]
+        horario = self.db.execute_query(
+            "SELECT hora_apertura, hora_cierre, cerrado FROM horarios WHERE dia_semana = %s",
+            (dia,), fetch_one=True, prepared=True
+        )
+        cerrado = self.db.execute_query(
+            "SELECT id FROM dias_cerrados WHERE fecha = %s", (fecha,), fetch_one=True, prepared=True
+        )
+        tables = self._get_tables()
+        rows = self.db.execute_query(
+            "SELECT id_mesa, TIME_TO_SEC(hora) AS inicio, TIME_TO_SEC(hora_fin) AS fin "
+            "FROM reservas WHERE fecha = %s AND estado = 'confirmada'",
+            (fecha,), prepared=True
+        )
+        if tables is None or rows is None:
+            return None
+        
+        tables = self._fitting_tables(tables, comensales, id_zona)
+        slots = np.array([] if cerrado else self._day_slots(horario, intervalo), dtype=np.int64)
+        
+        # Ocupación: cada reserva marca su mesa en los horarios cuyo intervalo
+        # [hora, hora + duración) se solapa con [inicio, fin) de la reserva
+        column = {table['id']: j for j, table in enumerate(tables)}
+        reservations = [
+            (column[row['id_mesa']], int(row['inicio']), int(row['fin']))
+            for row in rows if row['id_mesa'] in column
+        ]
+        busy = np.zeros((len(slots), len(tables)), dtype=np.int32)
+        if reservations and len(slots):
+            columns, starts, ends = np.array(reservations, dtype=np.int64).T
+            slot_ends = slots + self.reservation_duration()
+            overlap = (starts[None, :] < slot_ends[:, None]) & (ends[None, :] > slots[:, None])
+            np.add.at(busy, (slice(None), columns), overlap.astype(np.int32))
+        
+        return {
+            'horas': [f"{s // 3600:02d}:{s % 3600 // 60:02d}" for s in slots.tolist()],
+            'mesas': tables,
+            'disponible': busy == 0
+        }
+    
+    def check_availability_batch(self, queries):
+        """
+        Disponibilidad de varias consultas {fecha, hora, comensales, id_zona}:
+        las mesas y las reservas confirmadas de todas las fechas se leen una
+        sola vez y cada consulta se evalúa en memoria. Devuelve las listas de
+        mesas libres en el mismo orden de `queries`, o None si hubo un error
+        """
+        fechas = sorted({date_key(query['fecha']) for query in queries})
+        tables = self._get_tables()
+        if tables is None:
+            return None
+        rows = []
+        if fechas:
+            placeholders = ', '.join(['%s'] * len(fechas))
+            rows = self.db.execute_query(f"""
+                SELECT id_mesa, fecha, TIME_TO_SEC(hora) AS inicio, TIME_TO_SEC(hora_fin) AS fin
+                FROM reservas
+                WHERE fecha IN ({placeholders}) AND estado = 'confirmada'
+            """, tuple(fechas))
+            if rows is None:
+                return None
+        
+        days = {fecha: DayOccupancy() for fecha in fechas}
+        for row in rows:
+            days[date_key(row['fecha'])].add(row['id_mesa'], int(row['inicio']), int(row['fin']))
+        
+        duracion = self.reservation_duration()
+        results = []
+        for query in queries:
+            day = days[date_key(query['fecha'])]
+            inicio = time_to_seconds(query['hora'])
+            results.append([
+                table for table in self._fitting_tables(tables, query['comensales'], query.get('id_zona'))
+                if not day.overlaps(table['id'], inicio, inicio + duracion)
+            ])
+        return results
+    
+    @staticmethod
+    def _fitting_tables(tables, comensales, id_zona=None):
+        """Mesas habilitadas donde entra el grupo (misma regla que check_availability)"""
+        return [
+            table for table in tables
+            if table['capacidad'] >= int(comensales)
+            and table['estado'] == 'disponible'
+            and (not id_zona or str(table['id_zona']) == str(id_zona))
+        ]
+    
+    @staticmethod
+    def _day_slots(horario, intervalo):
+        """
+        Horarios de inicio (segundos) de un día según su fila de horarios.
+        Solo se ofrecen horas reservables: la apertura y el intervalo se
+        redondean hacia arriba a slots de RESERVATION_SLOT_SECONDS
+        """
+        if horario and horario['cerrado']:
+            return []
+        apertura = time_to_seconds(horario['hora_apertura']) if horario else 12 * 3600
+        cierre = time_to_seconds(horario['hora_cierre']) if horario else 23 * 3600
+        apertura = -(-apertura // RESERVATION_SLOT_SECONDS) * RESERVATION_SLOT_SECONDS
+        paso = max(1, -(-int(intervalo) * 60 // RESERVATION_SLOT_SECONDS)) * RESERVATION_SLOT_SECONDS
+        return list(range(apertura, cierre, paso))
+    
+    def find_next_slots(self, fecha, hora, comensales, id_zona=None, limite=5, intervalo=30):
+        """
+        Las `limite` opciones libres (fecha, hora, mesa) más cercanas a la
+        fecha y hora preferidas, dentro de dias_anticipo_reserva y respetando
+        horarios y dias_cerrados. Se resuelve con una sola lectura de las
+        reservas de la ventana y un barrido en memoria de los horarios
+        ordenados por cercanía. Devuelve la lista de opciones o None
+        """
+        now = datetime.now()
+        preferida = datetime.strptime(f"{str(fecha)[:10]} {str(hora)[:5]}", '%Y-%m-%d %H:%M')
+        desde = now.date()
+        hasta = desde + timedelta(days=self._config_int('dias_anticipo_reserva', 30))
+        if preferida.date() > hasta:
+            return []
+        
+        horarios = self.db.execute_query("SELECT dia_semana, hora_apertura, hora_cierre, cerrado FROM horarios")
+        cerrados = self.db.execute_query(
+            "SELECT fecha FROM dias_cerrados WHERE fecha BETWEEN %s AND %s", (desde, hasta)
+        )
+        tables = self._get_tables()
+        rows = self.db.execute_query("""
+            SELECT id_mesa, fecha, TIME_TO_SEC(hora) AS inicio, TIME_TO_SEC(hora_fin) AS fin
+            FROM reservas
+            WHERE fecha BETWEEN %s AND %s AND estado = 'confirmada'
+        """, (desde, hasta))
+        if horarios is None or cerrados is None or tables is None or rows is None:
+            return None
         
-        print(f"DEBUG - fecha: {fecha}, hora: {hora}, comensales: {comensales}, id_zona: {id_zona}")
+        # Mesas candidatas de la más chica a la más grande (mejor ajuste)
+        tables = sorted(self._fitting_tables(tables, comensales, id_zona), key=lambda t: (t['capacidad'], t['id']))
+        if not tables:
+            return []
         
-        if id_zona:
-            query = """
-                SELECT m.*, z.nombre as zona_nombre 
-                FROM mesas m
-                LEFT JOIN zonas z ON m.id_zona = z.id
-                WHERE m.capacidad >= %s 
-                AND m.estado = 'disponible'
-                AND m.id NOT IN (
-                    SELECT id_mesa FROM reservas 
-                    WHERE fecha = %s 
-                    AND estado = 'confirmada'
-                    AND ABS(TIME_TO_SEC(hora) - TIME_TO_SEC(STR_TO_DATE(%s, '%H:%i'))) < 7200
-                )
-                AND m.id_zona = %s
-            """
-            params = (comensales, fecha, hora, id_zona)
-        else:
-            query = """
-                SELECT m.*, z.nombre as zona_nombre 
-                FROM mesas m
-                LEFT JOIN zonas z ON m.id_zona = z.id
-                WHERE m.capacidad >= %s 
-                AND m.estado = 'disponible'
-                AND m.id NOT IN (
-                    SELECT id_mesa FROM reservas 
-                    WHERE fecha = %s 
-                    AND estado = 'confirmada'
-                    AND ABS(TIME_TO_SEC(hora) - TIME_TO_SEC(STR_TO_DATE(%s, '%H:%i'))) < 7200
-                )
-            """
-            params = (comensales, fecha, hora)
+        horarios = {row['dia_semana']: row for row in horarios}
+        cerrados = {date_key(row['fecha']) for row in cerrados}
+        days = {}
+        for row in rows:
+            day = days.setdefault(date_key(row['fecha']), DayOccupancy())
+            day.add(row['id_mesa'], int(row['inicio']), int(row['fin']))
+        
+        # Candidatos de toda la ventana, ordenados por distancia a la preferida
+        candidates = []
+        dia = desde
+        while dia <= hasta:
+            if dia.isoformat() not in cerrados:
+                for inicio in self._day_slots(horarios.get(DIAS_SEMANA[dia.weekday()]), intervalo):
+                    momento = datetime.combine(dia, datetime.min.time()) + timedelta(seconds=inicio)
+                    if momento >= now:
+                        candidates.append((abs((momento - preferida).total_seconds()), momento, inicio))
+            dia += timedelta(days=1)
+        candidates.sort(key=lambda candidate: candidate[:2])
         
-        return self.db.execute_query(query, params)
+        duracion = self.reservation_duration()
+        options = []
+        for _, momento, inicio in candidates:
+            day = days.get(momento.date().isoformat())
+            table = next(
+                (t for t in tables if day is None or not day.overlaps(t['id'], inicio, inicio + duracion)),
+                None
+            )
+            if table is not None:
+                options.append({'fecha': momento.strftime('%Y-%m-%d'), 'hora': momento.strftime('%H:%M'), 'mesa': table})
+                if len(options) >= int(limite):
+                    break
+        return options
     
-    def create_reservation(self, id_usuario, id_mesa, fecha, hora, comensales, observaciones=None):
-        try:
-            # Iniciar transacción para atomicidad
-            if not self.db.connection or not self.db.connection.is_connected():
-                self.db.connect()
-            
-            # Desactivar autocommit temporalmente
-            self.db.connection.autocommit = False
-            cursor = self.db.connection.cursor()
-            
-            try:
-                # Verificación final de disponibilidad con locking de la mesa
-                check_query = """
-                    SELECT COUNT(*) as conflicting_reservations 
-                    FROM reservas 
-                    WHERE id_mesa = %s 
-                    AND fecha = %s 
-                    AND ABS(TIME_TO_SEC(hora) - TIME_TO_SEC(%s)) < 7200
-                    AND estado = 'confirmada'
-                    FOR UPDATE
-                """
-                cursor.execute(check_query, (id_mesa, fecha, hora))
-                result = cursor.fetchone()
-                
-                if result[0] > 0:
-                    cursor.close()
-                    self.db.connection.rollback()
-                    return None  # Mesa no disponible (doble reserva)
-                
-                # Insertar reserva
-                insert_query = """
-                    INSERT INTO reservas (id_usuario, id_mesa, fecha, hora, numero_comensales, observaciones, estado)
-                    VALUES (%s, %s, %s, %s, %s, %s, 'confirmada')
-                """
-                cursor.execute(insert_query, (id_usuario, id_mesa, fecha, hora, comensales, observaciones))
-                reservation_id = cursor.lastrowid
-                
-                # Actualizar estado de la mesa
-                update_query = "UPDATE mesas SET estado = 'reservada' WHERE id = %s"
-                cursor.execute(update_query, (id_mesa,))
-                
-                # Confirmar transacción
-                self.db.connection.commit()
-                cursor.close()
-                
-                return reservation_id
-                
-            except Exception as e:
-                # Rollback en caso de error
-                self.db.connection.rollback()
-                if 'cursor' in locals():
-                    cursor.close()
-                raise e
-                
-        except Exception as e:
-            print(f"Error al crear reserva (atomicidad): {e}")
-            return None
-        finally:
-            # Restaurar autocommit
-            if self.db.connection:
-                self.db.connection.autocommit = True
+    def reservation_changed(self, id_reserva, *fechas, tables_changed=False):
+        """
+        Avisar que una reserva se modificó o eliminó fuera del manager.
+        `fechas` son la fecha anterior y la nueva; con tables_changed también
+        cambió el estado de alguna mesa
+        """
+        if self.occupancy is not None:
+            # La fecha anterior se descarta completa: las mesas adicionales de una
+            # combinación se movieron o eliminaron junto con la reserva principal
+            fechas = (self.occupancy.remove(id_reserva),) + fechas
+            for fecha in fechas:
+                if fecha:
+                    self.occupancy.invalidate(fecha)
+        self._invalidate_availability(*set(date_key(fecha) for fecha in fechas if fecha))
+        if tables_changed:
+            self.tables_changed()
+    
+    def tables_changed(self):
+        """Avisar al índice, al asignador y a la caché que cambiaron las mesas o zonas"""
+        self.allocator.invalidate()
+        if self.occupancy is not None:
+            self.occupancy.invalidate_tables()
+        with self._generation_lock:
+            self._tables_generation += 1
+            self._reserved_tables = frozenset()
+        self.availability_cache.clear()
+    
+    def tables_reserved(self, ids):
+        """
+        Mesas que pasaron de 'disponible' a 'reservada'. Solo se quitan de la
+        disponibilidad, así que basta con filtrarlas al leer la caché; el
+        cambio inverso (o de capacidad, zona, etc.) usa tables_changed
+        """
+        if self.occupancy is not None:
+            self.occupancy.invalidate_tables()
+        with self._generation_lock:
+            self._reserved_tables = self._reserved_tables | frozenset(ids)
     
     def get_user_reservations(self, user_id):
-        query = """
-            SELECT r.*, m.numero as mesa_numero, z.nombre as zona_nombre
+        query = f"""
+            SELECT r.*, m.numero as mesa_numero, z.nombre as zona_nombre,
+                   {COMBINED_TABLES_COLUMN}
             FROM reservas r
             JOIN mesas m ON r.id_mesa = m.id
             LEFT JOIN zonas z ON m.id_zona = z.id
-            WHERE r.id_usuario = %s
+            WHERE r.id_usuario = %s AND r.id_reserva_principal IS NULL
             ORDER BY r.fecha DESC, r.hora DESC
         """
-        return self.db.execute_query(query, (user_id,))
+        rows = self.db.execute_query(query, (user_id,))
+        return [with_combined_tables(row) for row in rows] if rows is not None else None
     
-    def get_all_reservations(self):
-        query = """
-            SELECT r.*, u.nombre as cliente_nombre, u.email, m.numero as mesa_numero, z.nombre as zona_nombre
+    def get_user_reservations_page(self, user_id, limit=None, after=None):
+        """
+        Página de reservas del usuario, keyset sobre (fecha, hora, id) como
+        get_reservations_page. Devuelve {'reservas', 'siguiente', 'limit'}
+        """
+        limit = normalize_page_limit(limit)
+        clauses, params = ["r.id_usuario = %s", "r.id_reserva_principal IS NULL"], [user_id]
+        if after:
+            clause, keyset_params = reservation_keyset_clause(after)
+            clauses.append(clause)
+            params.extend(keyset_params)
+        
+        query = f"""
+            SELECT r.*, m.numero as mesa_numero, z.nombre as zona_nombre,
+                   {COMBINED_TABLES_COLUMN}
+            FROM reservas r
+            JOIN mesas m ON r.id_mesa = m.id
+            LEFT JOIN zonas z ON m.id_zona = z.id
+            WHERE {' AND '.join(clauses)}
+            ORDER BY r.fecha DESC, r.hora DESC, r.id DESC
+            LIMIT %s
+        """
+        params.append(limit + 1)
+        rows = self.db.execute_query(query, tuple(params))
+        if rows is None:
+            return None
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_page_cursor([last['fecha'][:10], last['hora'], last['id']])
+        
+        rows = [with_combined_tables(row) for row in rows]
+        return {'reservas': rows, 'siguiente': next_cursor, 'limit': limit}
+    
+    def get_all_reservations(self, stream=False, **filters):
+        """
+        Todas las reservas filtradas, una fila por reserva (ver
+        with_combined_tables). Con stream=True devuelve un RowStream
+        """
+        clauses, params = build_reservation_filters(**filters)
+        clauses.append("r.id_reserva_principal IS NULL")
+        where = f"WHERE {' AND '.join(clauses)}"
+        query = f"""
+            SELECT r.*, u.nombre as cliente_nombre, u.email, m.numero as mesa_numero, z.nombre as zona_nombre,
+                   {COMBINED_TABLES_COLUMN}
             FROM reservas r
             JOIN usuarios u ON r.id_usuario = u.id
             JOIN mesas m ON r.id_mesa = m.id
             LEFT JOIN zonas z ON m.id_zona = z.id
-            ORDER BY r.fecha DESC, r.hora DESC
+            {where}
+            ORDER BY r.fecha DESC, r.hora DESC, r.id DESC
+        """
+        if stream:
+            return self.db.stream_query(query, tuple(params)).map(with_combined_tables)
+        rows = self.db.execute_query(query, tuple(params))
+        return [with_combined_tables(row) for row in rows] if rows is not None else None
+    
+    def get_reservations_page(self, limit=None, after=None, **filters):
+        """
+        Página de reservas con paginación keyset sobre (fecha, hora, id):
+        el costo no depende de cuántas reservas históricas existan.
+        Devuelve {'reservas': [...], 'siguiente': cursor o None, 'limit': n}
+        """
+        limit = normalize_page_limit(limit)
+        clauses, params = build_reservation_filters(**filters)
+        clauses.append("r.id_reserva_principal IS NULL")
+        
+        if after:
+            clause, keyset_params = reservation_keyset_clause(after)
+            clauses.append(clause)
+            params.extend(keyset_params)
+        
+        where = f"WHERE {' AND '.join(clauses)}"
+        query = f"""
+            SELECT r.*, u.nombre as cliente_nombre, u.email, m.numero as mesa_numero, z.nombre as zona_nombre,
+                   {COMBINED_TABLES_COLUMN}
+            FROM reservas r
+            JOIN usuarios u ON r.id_usuario = u.id
+            JOIN mesas m ON r.id_mesa = m.id
+            LEFT JOIN zonas z ON m.id_zona = z.id
+            {where}
+            ORDER BY r.fecha DESC, r.hora DESC, r.id DESC
+            LIMIT %s
         """
-        return self.db.execute_query(query)
+        params.append(limit + 1)
+        rows = self.db.execute_query(query, tuple(params))
+        if rows is None:
+            return None
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_page_cursor([last['fecha'][:10], last['hora'], last['id']])
+        
+        rows = [with_combined_tables(row) for row in rows]
+        return {'reservas': rows, 'siguiente': next_cursor, 'limit': limit}
 
 class MenuManager:
-    def __init__(self, db):
+    def __init__(self, db, stock_ledger=None):
         self.db = db
+        # Libro de stock en memoria opcional (ver stock_ledger.py)
+        self.stock_ledger = stock_ledger
     
     def get_menu_items(self):
-        query = """
+        # Con libro de stock un plato puede tener la fila en 0 y unidades en
+        # un lote local: el filtro de stock se aplica después de sumarlas
+        stock_filter = "AND p.stock_disponible > 0" if self.stock_ledger is None else ""
+        query = f"""
             SELECT p.*, c.nombre as categoria_nombre 
             FROM platos p 
             LEFT JOIN (SELECT DISTINCT categoria as nombre FROM platos) c ON p.categoria = c.nombre
-            WHERE p.disponible = TRUE AND p.stock_disponible > 0
+            WHERE p.disponible = TRUE {stock_filter}
             ORDER BY p.categoria, p.nombre
         """
-        return self.db.execute_query(query)
+        items = self.db.execute_query(query)
+        if items is None or self.stock_ledger is None:
+            return items
+        return [item for item in self.with_ledger_stock(items) if item['stock_disponible'] > 0]
+    
+    def ledger_units(self, id_plato):
+        """Unidades del plato en lotes del libro de stock (ya descontadas de la fila)"""
+        if self.stock_ledger is None:
+            return 0
+        return self.stock_ledger.available(id_plato) or 0
+    
+    def with_ledger_stock(self, platos):
+        """
+        Sumar a stock_disponible de cada plato las unidades de su lote local;
+        acepta una lista o un RowStream (exportación en streaming)
+        """
+        if self.stock_ledger is None:
+            return platos
+        if isinstance(platos, list):
+            for plato in platos:
+                plato['stock_disponible'] += self.ledger_units(plato['id'])
+            return platos
+        return platos.map(
+            lambda plato: dict(plato, stock_disponible=plato['stock_disponible'] + self.ledger_units(plato['id']))
+        )
     
     def check_stock(self, id_plato, cantidad):
         query = "SELECT stock_disponible FROM platos WHERE id = %s"
         plato = self.db.execute_query(query, (id_plato,), fetch_one=True)
-        return plato and plato['stock_disponible'] >= cantidad
+        if not plato:
+            return False
+        # Las unidades del lote local ya no figuran en la fila de platos
+        stock = plato['stock_disponible'] + self.ledger_units(id_plato)
+        return stock >= cantidad
     
     def update_stock(self, id_plato, cantidad):
-        query = "UPDATE platos SET stock_disponible = stock_disponible - %s WHERE id = %s"
-        return self.db.execute_query(query, (cantidad, id_plato), fetch_all=False)
+        """
+        Descuenta stock en una sola sentencia condicionada: no hay SELECT previo
+        ni ventana para sobrevender. Devuelve False si no alcanzaba el stock
+        """
+        query = """
+            UPDATE platos SET stock_disponible = stock_disponible - %s
+            WHERE id = %s AND stock_disponible >= %s
+        """
+        affected = self.db.execute_update(query, (cantidad, id_plato, cantidad))
+        return bool(affected)
+    
+    def reserve_stock(self, cursor, quantities):
+        """
+        Descuenta el stock de varios platos ({id_plato: cantidad}) con un único
+        UPDATE condicionado, dentro de la transacción en curso. Si algún plato
+        no existe o no tiene stock suficiente lanza ConflictError.
+        Con libro de stock el descuento se concede en memoria contra un lote
+        ya descontado en MySQL y se devuelve si la transacción se revierte
+        """
+        if self.stock_ledger is not None:
+            if not self.stock_ledger.reserve(quantities):
+                self._raise_stock_conflict(cursor, quantities)
+            self.db.on_rollback(lambda: self.stock_ledger.release(quantities))
+            return
+        
+        placeholders = ', '.join(['%s'] * len(quantities))
+        cases = ' '.join(['WHEN %s THEN %s'] * len(quantities))
+        case_params = tuple(value for item in quantities.items() for value in item)
+        
+        cursor.execute(f"""
+            UPDATE platos
+            SET stock_disponible = stock_disponible - CASE id {cases} END
+            WHERE id IN ({placeholders})
+            AND stock_disponible >= CASE id {cases} END
+        """, case_params + tuple(quantities) + case_params)
+        
+        if cursor.rowcount == len(quantities):
+            return
+        
+        self._raise_stock_conflict(cursor, quantities)
+    
+    def _raise_stock_conflict(self, cursor, quantities):
+        """Camino de error: identificar el plato que no alcanzó"""
+        placeholders = ', '.join(['%s'] * len(quantities))
+        cursor.execute(
+            f"SELECT id, nombre, stock_disponible FROM platos WHERE id IN ({placeholders})",
+            tuple(quantities)
+        )
+        platos = {row['id']: row for row in cursor.fetchall()}
+        for id_plato, cantidad in quantities.items():
+            plato = platos.get(id_plato)
+            if not plato:
+                raise ConflictError(f'El plato {id_plato} no existe')
+            if plato['stock_disponible'] < cantidad:
+                raise ConflictError(f"Stock insuficiente para '{plato['nombre']}'")
+        raise ConflictError('No se pudo reservar el stock de los platos')
+    
+    def insert_preorders(self, cursor, id_reserva, preorders):
+        """
+        Inserta varios pre-pedidos de una reserva dentro de la transacción en
+        curso con dos sentencias: el descuento condicionado de stock de todos
+        los platos y un INSERT ... SELECT que toma el precio de cada plato.
+        Lanza ConflictError si falta stock. Devuelve el id del primer pre-pedido
+        """
+        # Sumar cantidades por plato para validar el stock total pedido
+        quantities = {}
+        for preorder in preorders:
+            id_plato = int(preorder['id_plato'])
+            quantities[id_plato] = quantities.get(id_plato, 0) + int(preorder['cantidad'])
+        
+        self.reserve_stock(cursor, quantities)
+        
+        # Las filas de platos ya quedaron bloqueadas por el UPDATE anterior
+        values = ' UNION ALL '.join(['SELECT %s AS id_plato, %s AS cantidad, %s AS orden'] * len(preorders))
+        params = [id_reserva]
+        for orden, preorder in enumerate(preorders):
+            params.extend([int(preorder['id_plato']), int(preorder['cantidad']), orden])
+        cursor.execute(f"""
+            INSERT INTO prepedidos (id_reserva, id_plato, cantidad, precio_unitario)
+            SELECT %s, p.id, v.cantidad, p.precio
+            FROM ({values}) v
+            JOIN platos p ON p.id = v.id_plato
+            ORDER BY v.orden
+        """, tuple(params))
+        
+        # Igual que lastrowid en un INSERT multi-fila: id del primer pre-pedido
+        return cursor.lastrowid
     
     def create_preorder(self, id_reserva, id_plato, cantidad):
         try:
-            # Verificar stock antes de crear pre-pedido
-            if not self.check_stock(id_plato, cantidad):
-                return None
-            
-            # Iniciar transacción
-            if not self.db.connection or not self.db.connection.is_connected():
-                self.db.connect()
-            
-            self.db.connection.autocommit = False
-            cursor = self.db.connection.cursor()
-            
-            try:
-                # Insertar pre-pedido
-                insert_query = """
-                    INSERT INTO prepedidos (id_reserva, id_plato, cantidad, precio_unitario)
-                    VALUES (%s, %s, %s, (SELECT precio FROM platos WHERE id = %s))
-                """
-                cursor.execute(insert_query, (id_reserva, id_plato, cantidad, id_plato))
-                preorder_id = cursor.lastrowid
-                
-                # Actualizar stock
-                update_query = "UPDATE platos SET stock_disponible = stock_disponible - %s WHERE id = %s"
-                cursor.execute(update_query, (cantidad, id_plato))
-                
-                # Confirmar transacción
-                self.db.connection.commit()
-                cursor.close()
+            with self.db.transaction() as cursor:
+                return self.insert_preorders(
+                    cursor, id_reserva, [{'id_plato': id_plato, 'cantidad': cantidad}]
+                )
+        except ConflictError as e:
+            print(f"Pre-pedido rechazado: {e}")
+            return None
+        except Exception as e:
+            print(f"Error al crear pre-pedido: {e}")
+            return None
+    
+    def create_preorders_bulk(self, prepedidos):
+        """
+        Registra pre-pedidos de varias reservas (filas con fila, id_reserva,
+        id_plato, nombre_plato y cantidad) en una sola transacción: un
+        descuento de stock por plato con la cantidad total pedida y un
+        executemany para todos los INSERT. Las filas de reservas que ya no
+        están confirmadas o de platos sin stock suficiente se informan como
+        errores sin afectar al resto. Devuelve los resultados o None
+        """
+        resultados = {
+            'procesados': [],
+            'errores': [],
+            'total_procesados': 0,
+            'total_errores': 0
+        }
+        
+        def reject(rows, error):
+            resultados['errores'].extend(
+                {'fila': row['fila'], 'error': error, 'plato': row['nombre_plato']} for row in rows
+            )
+        
+        try:
+            with self.db.transaction() as cursor:
+                reservas = sorted({int(row['id_reserva']) for row in prepedidos})
+                confirmadas = set()
+                if reservas:
+                    placeholders = ', '.join(['%s'] * len(reservas))
+                    cursor.execute(
+                        f"SELECT id FROM reservas WHERE id IN ({placeholders}) AND estado = 'confirmada'",
+                        tuple(reservas)
+                    )
+                    confirmadas = {row['id'] for row in cursor.fetchall()}
                 
-                return preorder_id
+                by_plato = {}
+                for row in prepedidos:
+                    if int(row['id_reserva']) in confirmadas:
+                        by_plato.setdefault(int(row['id_plato']), []).append(row)
+                    else:
+                        reject([row], f"La reserva {row['id_reserva']} no está confirmada")
                 
-            except Exception as e:
-                self.db.connection.rollback()
-                if 'cursor' in locals():
-                    cursor.close()
-                raise e
+                # Un descuento condicionado por plato (en orden de id, como
+                # reserve_stock) para que un plato sin stock no frene al resto
+                accepted = []
+                for id_plato in sorted(by_plato):
+                    rows = by_plato[id_plato]
+                    try:
+                        self.reserve_stock(cursor, {id_plato: sum(int(row['cantidad']) for row in rows)})
+                        accepted.extend(rows)
+                    except ConflictError as e:
+                        reject(rows, str(e))
                 
+                if accepted:
+                    platos = sorted({int(row['id_plato']) for row in accepted})
+                    placeholders = ', '.join(['%s'] * len(platos))
+                    cursor.execute(f"SELECT id, precio FROM platos WHERE id IN ({placeholders})", tuple(platos))
+                    precios = {row['id']: row['precio'] for row in cursor.fetchall()}
+                    
+                    accepted.sort(key=lambda row: row['fila'])
+                    cursor.executemany("""
+                        INSERT INTO prepedidos (id_reserva, id_plato, cantidad, precio_unitario)
+                        VALUES (%s, %s, %s, %s)
+                    """, [
+                        (int(row['id_reserva']), int(row['id_plato']), int(row['cantidad']),
+                         precios[int(row['id_plato'])])
+                        for row in accepted
+                    ])
+                    resultados['procesados'] = [
+                        {
+                            'fila': row['fila'],
+                            'id_reserva': row['id_reserva'],
+                            'plato': row['nombre_plato'],
+                            'cantidad': row['cantidad']
+                        }
+                        for row in accepted
+                    ]
+            
+            resultados['errores'].sort(key=lambda error: error['fila'])
+            resultados['total_procesados'] = len(resultados['procesados'])
+            resultados['total_errores'] = len(resultados['errores'])
+            return resultados
+            
         except Exception as e:
-            print(f"Error al crear pre-pedido: {e}")
+            print(f"Error al registrar pre-pedidos: {e}")
             return None
-        finally:
-            if self.db.connection:
-                self.db.connection.autocommit = True
     
     def get_reservation_preorders(self, id_reserva):
         query = """
@@ -443,6 +1747,55 @@ class MenuManager:
         """
         return self.db.execute_query(query, (id_reserva,))
     
+    def _preorders_by_reservation(self, ids):
+        """Pre-pedidos de varias reservas en una consulta: {id_reserva: [filas]}"""
+        if not ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(ids))
+        items = {}
+        for row in self.db.execute_query(f"""
+            SELECT pp.*, p.nombre as plato_nombre, p.precio as plato_precio
+            FROM prepedidos pp
+            JOIN platos p ON pp.id_plato = p.id
+            WHERE pp.id_reserva IN ({placeholders})
+            ORDER BY p.nombre
+        """, tuple(ids)) or []:
+            items.setdefault(row['id_reserva'], []).append(row)
+        return items
+    
+    def attach_preorders(self, reservations, include_items=True):
+        """
+        Agrega 'preorder_summary' (y 'preorders' si include_items) a cada
+        reserva con dos consultas en total, en lugar de dos por reserva
+        """
+        ids = [reservation['id'] for reservation in reservations]
+        if not ids:
+            return reservations
+        placeholders = ', '.join(['%s'] * len(ids))
+        
+        summaries = self.db.execute_query(f"""
+            SELECT 
+                pp.id_reserva,
+                SUM(pp.cantidad * pp.precio_unitario) as total,
+                COUNT(*) as items_count,
+                SUM(pp.cantidad) as total_items
+            FROM prepedidos pp
+            WHERE pp.id_reserva IN ({placeholders})
+            GROUP BY pp.id_reserva
+        """, tuple(ids)) or []
+        summaries = {row.pop('id_reserva'): row for row in summaries}
+        
+        items = self._preorders_by_reservation(ids) if include_items else {}
+        
+        for reservation in reservations:
+            # Mismo resultado que get_preorder_summary para reservas sin pre-pedidos
+            reservation['preorder_summary'] = summaries.get(
+                reservation['id'], {'total': None, 'items_count': 0, 'total_items': None}
+            )
+            if include_items:
+                reservation['preorders'] = items.get(reservation['id'], [])
+        return reservations
+    
     def get_preorder_summary(self, id_reserva):
         query = """
             SELECT 
@@ -454,116 +1807,161 @@ class MenuManager:
         """
         return self.db.execute_query(query, (id_reserva,), fetch_one=True)
     
+    CONSUMPTION_NOTE_RESERVATION_QUERY = """
+        SELECT r.*, u.nombre as cliente_nombre, u.email as cliente_email,
+               m.numero as mesa_numero, z.nombre as zona_nombre
+        FROM reservas r
+        JOIN usuarios u ON r.id_usuario = u.id
+        JOIN mesas m ON r.id_mesa = m.id
+        LEFT JOIN zonas z ON m.id_zona = z.id
+    """
+    
     def generate_consumption_note(self, id_reserva, additional_items=None):
         """
         Genera una nota de consumo consolidada con pre-pedidos y consumo adicional
         """
         try:
             # Obtener información de la reserva
-            reservation_query = """
-                SELECT r.*, u.nombre as cliente_nombre, u.email as cliente_email,
-                       m.numero as mesa_numero, z.nombre as zona_nombre
-                FROM reservas r
-                JOIN usuarios u ON r.id_usuario = u.id
-                JOIN mesas m ON r.id_mesa = m.id
-                LEFT JOIN zonas z ON m.id_zona = z.id
-                WHERE r.id = %s
-            """
-            reservation = self.db.execute_query(reservation_query, (id_reserva,), fetch_one=True)
+            reservation = self.db.execute_query(
+                self.CONSUMPTION_NOTE_RESERVATION_QUERY + " WHERE r.id = %s",
+                (id_reserva,), fetch_one=True
+            )
             
             if not reservation:
                 return None
             
-            # Obtener pre-pedidos
-            preorders = self.get_reservation_preorders(id_reserva)
-            preorder_summary = self.get_preorder_summary(id_reserva)
+            # Obtener pre-pedidos (los totales se calculan sobre estas filas)
+            preorders = self.get_reservation_preorders(id_reserva) or []
+            note_data = self._build_consumption_note(reservation, preorders, additional_items)
+            
+            # Cabecera y detalles en una sola transacción
+            with self.db.transaction() as cursor:
+                self._save_consumption_notes(cursor, [note_data])
+            return note_data
+            
+        except Exception as e:
+            print(f"Error al generar nota de consumo: {e}")
+            return None
+    
+    def generate_service_consumption_notes(self, fecha, hora_desde=None, hora_hasta=None):
+        """
+        Genera las notas de consumo de todas las reservas de un servicio
+        (fecha y rango horario opcional) que todavía no tienen nota. Usa una
+        consulta para las reservas, otra para sus pre-pedidos y una sola
+        transacción para todas las notas. Devuelve la lista de notas
+        """
+        try:
+            clauses = [
+                "r.fecha = %s",
+                "r.estado IN ('confirmada', 'completada')",
+                "NOT EXISTS (SELECT 1 FROM notas_consumo nc WHERE nc.id_reserva = r.id)"
+            ]
+            params = [fecha]
+            if hora_desde:
+                clauses.append("r.hora >= %s")
+                params.append(hora_desde)
+            if hora_hasta:
+                clauses.append("r.hora < %s")
+                params.append(hora_hasta)
             
-            # Calcular totales
-            preorder_total = preorder_summary['total'] if preorder_summary else 0
-            additional_total = 0
+            reservations = self.db.execute_query(
+                self.CONSUMPTION_NOTE_RESERVATION_QUERY
+                + f" WHERE {' AND '.join(clauses)} ORDER BY r.hora, r.id",
+                tuple(params)
+            )
+            if not reservations:
+                return []
             
-            if additional_items:
-                for item in additional_items:
-                    additional_total += item['cantidad'] * item['precio_unitario']
+            preorders = self._preorders_by_reservation([r['id'] for r in reservations])
+            notes = [
+                self._build_consumption_note(reservation, preorders.get(reservation['id'], []))
+                for reservation in reservations
+            ]
             
-            # Crear nota de consumo
-            note_data = {
-                'reserva': reservation,
-                'pre_pedidos': preorders,
-                'items_adicionales': additional_items or [],
-                'resumen': {
-                    'subtotal_prepedidos': preorder_total,
-                    'subtotal_adicional': additional_total,
-                    'total_general': preorder_total + additional_total,
-                    'total_items': (preorder_summary['total_items'] if preorder_summary else 0) + 
-                                  (sum(item['cantidad'] for item in additional_items) if additional_items else 0)
-                },
-                'fecha_generacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'estado': 'generada'
-            }
+            with self.db.transaction() as cursor:
+                self._save_consumption_notes(cursor, notes)
+            return notes
             
-            # Opcional: Guardar en base de datos
-            insert_query = """
+        except Exception as e:
+            print(f"Error al generar notas de consumo del servicio: {e}")
+            return None
+    
+    @staticmethod
+    def _build_consumption_note(reservation, preorders, additional_items=None):
+        """Nota de consumo (sin guardar) con totales calculados en memoria"""
+        additional_items = additional_items or []
+        preorder_total = sum(p['cantidad'] * p['precio_unitario'] for p in preorders)
+        additional_total = sum(item['cantidad'] * item['precio_unitario'] for item in additional_items)
+        
+        return {
+            'reserva': reservation,
+            'pre_pedidos': preorders,
+            'items_adicionales': additional_items,
+            'resumen': {
+                'subtotal_prepedidos': preorder_total,
+                'subtotal_adicional': additional_total,
+                'total_general': preorder_total + additional_total,
+                'total_items': sum(p['cantidad'] for p in preorders) +
+                               sum(item['cantidad'] for item in additional_items)
+            },
+            'fecha_generacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'estado': 'generada'
+        }
+    
+    @staticmethod
+    def _save_consumption_notes(cursor, notes):
+        """
+        Insertar cabeceras (una por nota, para obtener su id) y todos los
+        detalles con un único executemany dentro de la transacción del cursor
+        """
+        details = []
+        for note_data in notes:
+            cursor.execute("""
                 INSERT INTO notas_consumo (id_reserva, subtotal_prepedidos, subtotal_adicional, 
                                          total_general, estado, fecha_generacion)
                 VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            note_id = self.db.execute_insert(insert_query, (
-                id_reserva,
-                preorder_total,
-                additional_total,
-                preorder_total + additional_total,
-                'generada',
+            """, (
+                note_data['reserva']['id'],
+                note_data['resumen']['subtotal_prepedidos'],
+                note_data['resumen']['subtotal_adicional'],
+                note_data['resumen']['total_general'],
+                note_data['estado'],
                 note_data['fecha_generacion']
             ))
+            note_id = note_data['id'] = cursor.lastrowid
             
-            if note_id:
-                note_data['id'] = note_id
-                
-                # Guardar detalles de la nota
-                if preorders:
-                    for preorder in preorders:
-                        detail_query = """
-                            INSERT INTO notas_consumo_detalle (id_nota, tipo_item, id_item, descripcion, 
-                                                             cantidad, precio_unitario, subtotal)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        """
-                        self.db.execute_insert(detail_query, (
-                            note_id,
-                            'prepedido',
-                            preorder['id'],
-                            f"Pre-pedido: {preorder['plato_nombre']}",
-                            preorder['cantidad'],
-                            preorder['precio_unitario'],
-                            preorder['cantidad'] * preorder['precio_unitario']
-                        ))
-                
-                if additional_items:
-                    for item in additional_items:
-                        detail_query = """
-                            INSERT INTO notas_consumo_detalle (id_nota, tipo_item, id_item, descripcion, 
-                                                             cantidad, precio_unitario, subtotal)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        """
-                        self.db.execute_insert(detail_query, (
-                            note_id,
-                            'adicional',
-                            item.get('id_plato'),
-                            item.get('descripcion', f"Consumo adicional"),
-                            item['cantidad'],
-                            item['precio_unitario'],
-                            item['cantidad'] * item['precio_unitario']
-                        ))
-            
-            return note_data
-            
-        except Exception as e:
-            print(f"Error al generar nota de consumo: {e}")
-            return None
+            for preorder in note_data['pre_pedidos']:
+                details.append((
+                    note_id,
+                    'prepedido',
+                    preorder['id'],
+                    f"Pre-pedido: {preorder['plato_nombre']}",
+                    preorder['cantidad'],
+                    preorder['precio_unitario'],
+                    preorder['cantidad'] * preorder['precio_unitario']
+                ))
+            for item in note_data['items_adicionales']:
+                details.append((
+                    note_id,
+                    'adicional',
+                    item.get('id_plato'),
+                    item.get('descripcion', f"Consumo adicional"),
+                    item['cantidad'],
+                    item['precio_unitario'],
+                    item['cantidad'] * item['precio_unitario']
+                ))
+        
+        if details:
+            cursor.executemany("""
+                INSERT INTO notas_consumo_detalle (id_nota, tipo_item, id_item, descripcion, 
+                                                 cantidad, precio_unitario, subtotal)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, details)
     
-    def get_consumption_notes(self, id_reserva=None):
+    def get_consumption_notes(self, id_reserva=None, stream=False, **filters):
         """
-        Obtiene notas de consumo (todas o de una reserva específica)
+        Obtiene notas de consumo (todas o de una reserva específica).
+        Con stream=True devuelve un RowStream
         """
         if id_reserva:
             query = """
@@ -578,16 +1976,75 @@ class MenuManager:
             """
             return self.db.execute_query(query, (id_reserva,))
         else:
-            query = """
+            clauses, params = self._consumption_note_filters(**filters)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            query = f"""
                 SELECT nc.*, r.fecha as reserva_fecha, u.nombre as cliente_nombre,
                        m.numero as mesa_numero
                 FROM notas_consumo nc
                 JOIN reservas r ON nc.id_reserva = r.id
                 JOIN usuarios u ON r.id_usuario = u.id
                 JOIN mesas m ON r.id_mesa = m.id
-                ORDER BY nc.fecha_generacion DESC
+                {where}
+                ORDER BY nc.fecha_generacion DESC, nc.id DESC
             """
-            return self.db.execute_query(query)
+            if stream:
+                return self.db.stream_query(query, tuple(params))
+            return self.db.execute_query(query, tuple(params))
+    
+    def _consumption_note_filters(self, fecha_desde=None, fecha_hasta=None, estado=None,
+                                  id_zona=None, id_mesa=None):
+        # El estado filtra la nota; fechas, zona y mesa usan los mismos filtros que reservas
+        clauses, params = build_reservation_filters(
+            fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, id_zona=id_zona,
+            id_mesa=id_mesa, date_column='nc.fecha_generacion'
+        )
+        if estado:
+            clauses.append("nc.estado = %s")
+            params.append(estado)
+        return clauses, params
+    
+    def get_consumption_notes_page(self, limit=None, after=None, **filters):
+        """
+        Página de notas de consumo con paginación keyset sobre
+        (fecha_generacion, id). Devuelve {'notas': [...], 'siguiente': ..., 'limit': n}
+        """
+        limit = normalize_page_limit(limit)
+        clauses, params = self._consumption_note_filters(**filters)
+        
+        if after:
+            fecha_generacion, last_id = decode_page_cursor(after, 2)
+            clauses.append("""
+                nc.fecha_generacion <= %s AND (
+                    nc.fecha_generacion < %s OR (nc.fecha_generacion = %s AND nc.id < %s)
+                )
+            """)
+            params.extend([fecha_generacion, fecha_generacion, fecha_generacion, last_id])
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"""
+            SELECT nc.*, r.fecha as reserva_fecha, u.nombre as cliente_nombre,
+                   m.numero as mesa_numero
+            FROM notas_consumo nc
+            JOIN reservas r ON nc.id_reserva = r.id
+            JOIN usuarios u ON r.id_usuario = u.id
+            JOIN mesas m ON r.id_mesa = m.id
+            {where}
+            ORDER BY nc.fecha_generacion DESC, nc.id DESC
+            LIMIT %s
+        """
+        params.append(limit + 1)
+        rows = self.db.execute_query(query, tuple(params))
+        if rows is None:
+            return None
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_page_cursor([last['fecha_generacion'], last['id']])
+        
+        return {'notas': rows, 'siguiente': next_cursor, 'limit': limit}
     
     def get_consumption_note_details(self, id_nota):
         """
@@ -620,103 +2077,263 @@ class MenuManager:
         note['detalles'] = details
         return note
     
-    def import_platos_from_excel(self, df):
+    def _fetch_in(self, query, values, chunk_size=EXCEL_LOOKUP_CHUNK):
+        """
+        Ejecutar `query` (con un marcador {placeholders} para el IN) por lotes
+        de `chunk_size` valores y devolver todas las filas
+        """
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            result = self.db.execute_query(query.format(placeholders=placeholders), tuple(chunk))
+            if result is None:
+                raise Error("No se pudieron consultar los datos de validación")
+            rows.extend(result)
+        return rows
+    
+    def validate_excel_preorders(self, df, solicitado=None):
+        """
+        Valida pre-pedidos de un DataFrame (nombre_plato, cantidad, id_reserva).
+        Platos y reservas se resuelven con una consulta IN por conjunto de
+        valores distintos y las reglas se aplican por columnas. El stock se
+        compara con la cantidad acumulada de cada plato en el archivo; al
+        validar por lotes, `solicitado` ({plato: cantidad}) lleva lo pedido en
+        los lotes anteriores y se actualiza. Las filas se numeran con el
+        índice del DataFrame. Devuelve (prepedidos_validos, errores)
+        """
+        filas = pd.Series(df.index + 1, index=df.index)
+        solicitado = {} if solicitado is None else solicitado
+        
+        # Platos: nombre requerido, existente y con stock
+        raw_names = df['nombre_plato']
+        names = raw_names.astype(str).str.strip()
+        has_name = raw_names.notna() & names.ne('')
+        # Misma equivalencia que la collation de MySQL (sin distinguir
+        # mayúsculas ni acentos): "Pure de papa" es "Puré de papa"
+        keys = names.map(collation_key).where(has_name)
+        
+        platos = {}
+        for plato in self._fetch_in(
+            "SELECT id, nombre, stock_disponible, precio FROM platos WHERE nombre IN ({placeholders})",
+            names[has_name].unique()
+        ):
+            platos.setdefault(collation_key(plato['nombre']), plato)
+        
+        plato_exists = keys.isin(list(platos))
+        stock = keys.map({
+            key: plato['stock_disponible'] + self.ledger_units(plato['id'])
+            for key, plato in platos.items()
+        })
+        has_stock = plato_exists & (stock > 0)
+        
+        # Cantidad: numérica (se trunca como int()) y positiva
+        cantidad = pd.to_numeric(df['cantidad'], errors='coerce').astype(float)
+        cantidad_valid = np.isfinite(cantidad)
+        cantidad = np.trunc(cantidad)
+        cantidad_positive = cantidad_valid & (cantidad > 0)
+        
+        counted = has_stock & cantidad_positive
+        pedido = cantidad.where(counted, 0)
+        acumulado = pedido.groupby(keys.fillna('')).cumsum() + keys.map(solicitado).fillna(0)
+        for key, total in pedido[counted].groupby(keys[counted]).sum().items():
+            solicitado[key] = solicitado.get(key, 0) + total
+        exceeds_stock = counted & (acumulado > stock)
+        
+        # Reserva: id numérico, positivo, existente y confirmada
+        id_reserva = pd.to_numeric(df['id_reserva'], errors='coerce').astype(float)
+        id_valid = np.isfinite(id_reserva)
+        id_reserva = np.trunc(id_reserva)
+        id_positive = id_valid & (id_reserva > 0)
+        
+        estados = {
+            row['id']: row['estado']
+            for row in self._fetch_in(
+                "SELECT id, estado FROM reservas WHERE id IN ({placeholders})",
+                id_reserva[id_positive].astype(int).unique().tolist()
+            )
+        }
+        estado = id_reserva.where(id_positive).map(estados)
+        
+        checks = [
+            (~has_name, lambda i: "El nombre del plato es requerido"),
+            (has_name & ~plato_exists, lambda i: f"El plato '{raw_names[i]}' no existe"),
+            (plato_exists & ~has_stock, lambda i: f"El plato '{raw_names[i]}' no tiene stock disponible"),
+            (exceeds_stock, lambda i: (
+                f"El plato '{raw_names[i]}' no tiene stock suficiente "
+                f"(disponible: {int(stock[i])}, solicitado en el archivo: {int(acumulado[i])})"
+            )),
+            (~cantidad_valid, lambda i: "La cantidad debe ser un número válido"),
+            (cantidad_valid & ~cantidad_positive, lambda i: "La cantidad debe ser mayor a 0"),
+            (~id_valid, lambda i: "El ID de reserva debe ser un número válido"),
+            (id_valid & ~id_positive, lambda i: "El ID de reserva debe ser mayor a 0"),
+            (id_positive & estado.isna(), lambda i: f"La reserva {int(id_reserva[i])} no existe"),
+            (estado.notna() & estado.ne('confirmada'),
+             lambda i: f"La reserva {int(id_reserva[i])} no está confirmada"),
+        ]
+        
+        row_errors = []
+        invalid = pd.Series(False, index=df.index)
+        for order, (mask, message) in enumerate(checks):
+            mask = mask.fillna(False).astype(bool)
+            invalid |= mask
+            row_errors.extend((filas[i], order, f"Fila {filas[i]}: {message(i)}") for i in df.index[mask])
+        errors = [message for _, _, message in sorted(row_errors, key=lambda e: e[:2])]
+        
+        valid = ~invalid
+        valid_preorders = [
+            {
+                'fila': int(fila),
+                'id_reserva': int(reserva),
+                'nombre_plato': nombre,
+                'cantidad': int(cant),
+                'plato_info': platos[key]
+            }
+            for fila, reserva, nombre, cant, key in zip(
+                filas[valid], id_reserva[valid], names[valid], cantidad[valid], keys[valid]
+            )
+        ]
+        return valid_preorders, errors
+    
+    def import_platos_from_excel(self, data, progress=None):
         """
-        Importa platos desde un DataFrame de pandas
+        Importa platos desde un DataFrame de pandas (o una secuencia de
+        DataFrames, p. ej. los lotes de upload_reader.TabularUpload)
         El DataFrame debe tener las columnas: id, nombre, stock_disponible, precio, categoria
         Los IDs se mantienen para actualizar platos existentes
+        
+        La limpieza y validación se hacen por columnas; las filas válidas se
+        escriben con INSERT ... ON DUPLICATE KEY UPDATE en lotes de
+        IMPORT_CHUNK filas (executemany) dentro de una sola transacción.
+        `progress(resultados)` se llama después de cada lote. Los UploadError
+        del lector (archivo inválido) se propagan. Con libro de stock se
+        descartan los lotes de los platos actualizados
         """
+        batches = [data] if isinstance(data, pd.DataFrame) else data
+        results = {
+            'actualizados': 0,
+            'creados': 0,
+            'errores': [],
+            'procesados': 0
+        }
+        seen_ids = set()
         try:
-            if not self.db.connection or not self.db.connection.is_connected():
-                self.db.connect()
-            
-            self.db.connection.autocommit = False
-            cursor = self.db.connection.cursor()
-            
-            results = {
-                'actualizados': 0,
-                'creados': 0,
-                'errores': [],
-                'procesados': 0
-            }
-            
-            for index, row in df.iterrows():
-                try:
-                    plato_id = int(row['id']) if pd.notna(row['id']) else None
-                    nombre = str(row['nombre']).strip() if pd.notna(row['nombre']) else None
-                    stock = int(row['stock_disponible']) if pd.notna(row['stock_disponible']) else 0
-                    precio = float(row['precio']) if pd.notna(row['precio']) else 0.0
-                    categoria = str(row['categoria']).strip() if pd.notna(row['categoria']) else 'General'
-                    
-                    if not nombre:
-                        results['errores'].append(f"Fila {index+1}: Nombre del plato es requerido")
-                        continue
-                    
-                    if stock < 0:
-                        results['errores'].append(f"Fila {index+1}: Stock no puede ser negativo")
-                        continue
-                    
-                    if precio < 0:
-                        results['errores'].append(f"Fila {index+1}: Precio no puede ser negativo")
-                        continue
-                    
-                    if plato_id:
-                        check_query = "SELECT id FROM platos WHERE id = %s"
-                        cursor.execute(check_query, (plato_id,))
-                        existing = cursor.fetchone()
-                        
-                        # Si el stock es 0, automáticamente marcar como no disponible
-                        is_disponible = stock > 0
-                        
-                        if existing:
-                            update_query = """
-                                UPDATE platos 
-                                SET nombre = %s, stock_disponible = %s, stock_maximo = %s, 
-                                    precio = %s, categoria = %s, disponible = %s
-                                WHERE id = %s
-                            """
-                            cursor.execute(update_query, (nombre, stock, stock, precio, categoria, is_disponible, plato_id))
-                            results['actualizados'] += 1
-                        else:
-                            insert_query = """
-                                INSERT INTO platos (nombre, stock_disponible, stock_maximo, disponible, precio, categoria)
-                                VALUES (%s, %s, %s, %s, %s, %s)
-                            """
-                            cursor.execute(insert_query, (nombre, stock, stock, is_disponible, precio, categoria))
-                            results['creados'] += 1
-                    else:
-                        # Si el stock es 0, automáticamente marcar como no disponible
-                        is_disponible = stock > 0
-                        insert_query = """
-                            INSERT INTO platos (nombre, stock_disponible, stock_maximo, disponible, precio, categoria)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                        """
-                        cursor.execute(insert_query, (nombre, stock, stock, is_disponible, precio, categoria))
-                        results['creados'] += 1
-                    
-                    results['procesados'] += 1
-                    
-                except Exception as e:
-                    results['errores'].append(f"Fila {index+1}: Error al procesar - {str(e)}")
-                    continue
-            
-            self.db.connection.commit()
-            cursor.close()
+            with self.db.transaction() as cursor:
+                for df in batches:
+                    self._import_platos_batch(cursor, df, results, seen_ids)
+                    if progress:
+                        progress(results)
+            if self.stock_ledger is not None:
+                # El stock del archivo reemplaza los lotes en memoria solo de
+                # los platos escritos; los demás conservan sus unidades
+                self.stock_ledger.invalidate_many(seen_ids)
             return results
             
+        except UploadError:
+            raise
         except Exception as e:
-            self.db.connection.rollback()
-            if 'cursor' in locals():
-                cursor.close()
             print(f"Error al importar platos: {e}")
             return None
-        finally:
-            if self.db.connection:
-                self.db.connection.autocommit = True
     
-    def get_all_platos(self):
+    def _import_platos_batch(self, cursor, df, results, seen_ids):
+        """Validar un lote de platos y escribirlo en la transacción del cursor"""
+        filas = pd.Series(df.index + 1, index=df.index)
+        column = lambda name: df[name] if name in df.columns else pd.Series(np.nan, index=df.index)
+        
+        raw_id, raw_stock, raw_precio = column('id'), column('stock_disponible'), column('precio')
+        # id y stock se truncan como lo hacía int(); infinitos o fuera del
+        # rango de INT/DECIMAL(10,2) de MySQL quedan como inválidos
+        plato_id = np.trunc(pd.to_numeric(raw_id, errors='coerce').astype(float))
+        stock = np.trunc(pd.to_numeric(raw_stock, errors='coerce').astype(float))
+        precio = pd.to_numeric(raw_precio, errors='coerce').astype(float)
+        plato_id = plato_id.where(np.isfinite(plato_id) & (plato_id.abs() <= MYSQL_INT_MAX))
+        stock = stock.where(np.isfinite(stock) & (stock.abs() <= MYSQL_INT_MAX))
+        precio = precio.where(np.isfinite(precio) & (precio.abs() <= PRECIO_MAX))
+        # Un id 0 o negativo se trata como plato nuevo, igual que antes
+        sin_id = raw_id.isna() | (plato_id <= 0)
+        
+        raw_nombre, raw_categoria = column('nombre'), column('categoria')
+        nombre = raw_nombre.astype(str).str.strip().where(raw_nombre.notna(), '')
+        categoria = raw_categoria.astype(str).str.strip().where(raw_categoria.notna(), 'General')
+        
+        # Un error por fila, en el mismo orden en que se validaba fila a fila
+        checks = [
+            (raw_id.notna() & plato_id.isna() & ~sin_id, "Error al procesar - ID inválido"),
+            (raw_stock.notna() & stock.isna(), "Error al procesar - Stock inválido"),
+            (raw_precio.notna() & precio.isna(), "Error al procesar - Precio inválido"),
+            (nombre.eq(''), "Nombre del plato es requerido"),
+            (stock < 0, "Stock no puede ser negativo"),
+            (precio < 0, "Precio no puede ser negativo"),
+        ]
+        error = pd.Series(None, index=df.index, dtype=object)
+        for mask, message in checks:
+            error = error.where(error.notna() | ~mask, message)
+        
+        valid = error.isna()
+        results['errores'].extend(
+            f"Fila {fila}: {message}" for fila, message in zip(filas[~valid], error[~valid])
+        )
+        results['procesados'] += int(valid.sum())
+        
+        plato_id = plato_id.where(~sin_id)[valid].astype('Int64')
+        stock = stock[valid].fillna(0).astype(int)
+        records = pd.DataFrame({
+            'id': plato_id,
+            'nombre': nombre[valid],
+            'stock': stock,
+            # Si el stock es 0, automáticamente marcar como no disponible
+            'disponible': stock > 0,
+            'precio': precio[valid].fillna(0.0).astype(float),
+            'categoria': categoria[valid]
+        })
+        
+        with_id = records[records['id'].notna()]
+        existing = {
+            row['id'] for row in self._fetch_in(
+                "SELECT id FROM platos WHERE id IN ({placeholders})",
+                with_id['id'].astype(int).unique().tolist()
+            )
+        }
+        # Un id repetido en el archivo actualiza el plato creado por su primera aparición
+        updates = with_id['id'].isin(existing | seen_ids) | with_id['id'].duplicated()
+        seen_ids.update(int(id_plato) for id_plato in with_id['id'])
+        results['actualizados'] += int(updates.sum())
+        results['creados'] += len(records) - int(updates.sum())
+        
+        upsert_rows = [
+            (int(id_plato), nombre_plato, int(stock_plato), int(stock_plato), bool(disponible), float(precio_plato), cat)
+            for id_plato, nombre_plato, stock_plato, disponible, precio_plato, cat
+            in with_id[['id', 'nombre', 'stock', 'disponible', 'precio', 'categoria']].itertuples(index=False)
+        ]
+        insert_rows = [
+            (nombre_plato, int(stock_plato), int(stock_plato), bool(disponible), float(precio_plato), cat)
+            for nombre_plato, stock_plato, disponible, precio_plato, cat
+            in records.loc[records['id'].isna(), ['nombre', 'stock', 'disponible', 'precio', 'categoria']].itertuples(index=False)
+        ]
+        
+        for start in range(0, len(upsert_rows), IMPORT_CHUNK):
+            cursor.executemany("""
+                INSERT INTO platos (id, nombre, stock_disponible, stock_maximo, disponible, precio, categoria)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    nombre = VALUES(nombre), stock_disponible = VALUES(stock_disponible),
+                    stock_maximo = VALUES(stock_maximo), disponible = VALUES(disponible),
+                    precio = VALUES(precio), categoria = VALUES(categoria)
+            """, upsert_rows[start:start + IMPORT_CHUNK])
+        for start in range(0, len(insert_rows), IMPORT_CHUNK):
+            cursor.executemany("""
+                INSERT INTO platos (nombre, stock_disponible, stock_maximo, disponible, precio, categoria)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, insert_rows[start:start + IMPORT_CHUNK])
+    
+    def get_all_platos(self, stream=False):
         """
-        Obtiene todos los platos (incluyendo los no disponibles)
+        Obtiene todos los platos (incluyendo los no disponibles).
+        Con stream=True devuelve un RowStream
         """
         query = "SELECT * FROM platos ORDER BY id"
-        return self.db.execute_query(query)
\ No newline at end of file
+        if stream:
+            return self.with_ledger_stock(self.db.stream_query(query))
+        platos = self.db.execute_query(query)
+        return self.with_ledger_stock(platos) if platos is not None else None
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Índice en memoria de ocupación de mesas por fecha
+Cumple RNF-001: Rendimiento - las consultas de disponibilidad se responden
+sin recorrer las reservas del día en MySQL
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+
+def time_to_seconds(hora) -> int:
+    """Convertir 'HH:MM', 'HH:MM:SS' o un timedelta de MySQL a segundos"""
+    if hasattr(hora, 'total_seconds'):
+        return int(hora.total_seconds())
+    parts = [int(part) for part in str(hora).split(':')]
+    while len(parts) < 3:
+        parts.append(0)
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def seconds_to_time(seconds: int) -> str:
+    """Segundos a 'HH:MM:SS' (las horas pueden pasar de 24, como en TIME de MySQL)"""
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def date_key(fecha) -> str:
+    """Clave 'YYYY-MM-DD' para fechas como date, 'YYYY-MM-DD' o 'YYYY-MM-DD HH:MM:SS'"""
+    return str(fecha)[:10]
+
+
+class DayOccupancy:
+    """Intervalos (inicio, fin) de las reservas confirmadas de un día, ordenados por mesa"""
+
+    __slots__ = ('intervals', 'max_length', 'loaded_at')
+
+    def __init__(self):
+        self.intervals = {}
+        self.max_length = 0
+        self.loaded_at = time.monotonic()
+
+    def add(self, id_mesa, inicio, fin):
+        insort(self.intervals.setdefault(id_mesa, []), (inicio, fin))
+        self.max_length = max(self.max_length, fin - inicio)
+
+    def remove(self, id_mesa, inicio, fin):
+        intervals = self.intervals.get(id_mesa)
+        if intervals and (inicio, fin) in intervals:
+            intervals.remove((inicio, fin))
+
+    def overlaps(self, id_mesa, inicio, fin):
+        """Hay alguna reserva con inicio < fin y fin_reserva > inicio"""
+        intervals = self.intervals.get(id_mesa, ())
+        # Candidatas: las que empiezan antes del fin pedido, recorridas hacia
+        # atrás hasta donde ninguna podría seguir abierta
+        i = bisect_left(intervals, (fin,))
+        while i > 0:
+            i -= 1
+            start, end = intervals[i]
+            if end > inicio:
+                return True
+            if start + self.max_length <= inicio:
+                return False
+        return False
+
+
+class OccupancyIndex:
+    """
+    Por fecha y por mesa, lista ordenada de los intervalos [inicio, fin) en
+    segundos de las reservas confirmadas. Una mesa está ocupada para
+    [t, t + duración) si alguna reserva cumple inicio < t + duración y
+    fin > t: se resuelve con una búsqueda binaria por mesa.
+
+    - Las fechas se cargan bajo demanda con una sola consulta y se mantienen
+      al día desde los caminos que crean, modifican o eliminan reservas
+    - Cada fecha y la lista de mesas expiran a los `ttl` segundos para
+      absorber escrituras hechas por otros procesos; el índice solo orienta
+      la asignación: la clave primaria (id_mesa, fecha, slot) de
+      reservas_slots al insertar es la garantía de que no hay doble reserva
+    - Una versión por fecha evita guardar una carga que quedó vieja porque
+      hubo una escritura mientras se consultaba MySQL
+    """
+
+    def __init__(self, ttl: int = 60, max_dates: int = 62):
+        self.ttl = ttl
+        self.max_dates = max_dates
+        self._days = OrderedDict()
+        self._reservations = {}
+        self._versions = {}
+        self._tables = None
+        self._tables_loaded_at = 0.0
+        self._tables_version = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _get_day(self, fecha):
+        day = self._days.get(fecha)
+        if day is None:
+            return None
+        if time.monotonic() - day.loaded_at > self.ttl:
+            self._drop_day(fecha)
+            return None
+        self._days.move_to_end(fecha)
+        return day
+
+    def _drop_day(self, fecha):
+        self._days.pop(fecha, None)
+        for id_reserva in [k for k, v in self._reservations.items() if v[0] == fecha]:
+            del self._reservations[id_reserva]
+
+    def _bump(self, fecha):
+        self._versions[fecha] = self._versions.get(fecha, 0) + 1
+
+    def version(self, fecha) -> int:
+        """Versión de la fecha; se pasa a `load` para descartar cargas viejas"""
+        with self._lock:
+            return self._versions.get(date_key(fecha), 0)
+
+    def load(self, fecha, rows: Iterable[Dict], version: int) -> bool:
+        """
+        Guardar las reservas confirmadas de una fecha (filas con id, id_mesa,
+        inicio y fin en segundos). Si la fecha cambió desde `version` no se guarda
+        """
+        fecha = date_key(fecha)
+        day = DayOccupancy()
+        entries = []
+        for row in rows:
+            inicio, fin = int(row['inicio']), int(row['fin'])
+            day.add(row['id_mesa'], inicio, fin)
+            entries.append((row['id'], row['id_mesa'], inicio, fin))
+
+        with self._lock:
+            if self._versions.get(fecha, 0) != version:
+                return False
+            self._drop_day(fecha)
+            self._days[fecha] = day
+            for id_reserva, id_mesa, inicio, fin in entries:
+                self._reservations[id_reserva] = (fecha, id_mesa, inicio, fin)
+            while len(self._days) > self.max_dates:
+                self._drop_day(next(iter(self._days)))
+        return True
+
+    def busy_tables(self, fecha, hora, duracion: int) -> Optional[Set[int]]:
+        """Mesas ocupadas en [hora, hora + duracion), o None si la fecha no está cargada"""
+        inicio = time_to_seconds(hora)
+        fin = inicio + duracion
+        with self._lock:
+            day = self._get_day(date_key(fecha))
+            if day is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {id_mesa for id_mesa in day.intervals if day.overlaps(id_mesa, inicio, fin)}
+
+    def add(self, id_reserva, id_mesa, fecha, hora, hora_fin) -> None:
+        """Registrar una reserva confirmada (después del COMMIT)"""
+        fecha = date_key(fecha)
+        inicio, fin = time_to_seconds(hora), time_to_seconds(hora_fin)
+        with self._lock:
+            self._bump(fecha)
+            day = self._get_day(fecha)
+            if day is not None:
+                day.add(id_mesa, inicio, fin)
+                self._reservations[id_reserva] = (fecha, id_mesa, inicio, fin)
+
+    def remove(self, id_reserva, fecha=None) -> Optional[str]:
+        """
+        Quitar una reserva eliminada, cancelada o movida. Si se conoce la
+        fecha se invalida también una carga de esa fecha que esté en curso.
+        Devuelve la fecha en la que estaba indexada (o None)
+        """
+        with self._lock:
+            if fecha is not None:
+                self._bump(date_key(fecha))
+            entry = self._reservations.pop(id_reserva, None)
+            if entry is None:
+                return None
+            fecha, id_mesa, inicio, fin = entry
+            self._bump(fecha)
+            day = self._days.get(fecha)
+            if day is not None:
+                day.remove(id_mesa, inicio, fin)
+            return fecha
+
+    def invalidate(self, fecha=None) -> None:
+        """Olvidar una fecha (o todas); se recargará en la próxima consulta"""
+        with self._lock:
+            fechas = [date_key(fecha)] if fecha is not None else list(self._days)
+            for value in fechas:
+                self._bump(value)
+                self._drop_day(value)
+
+    def get_tables(self):
+        """
+        Mesas en caché (con zona_nombre) y versión de la caché; las mesas son
+        None si hay que consultarlas y guardarlas con `set_tables`. Como las
+        fechas, expiran a los `ttl` segundos para ver los cambios de estado,
+        capacidad o mesas nuevas hechos por otros procesos
+        """
+        with self._lock:
+            if self._tables is not None and time.monotonic() - self._tables_loaded_at > self.ttl:
+                self._tables = None
+                self._tables_version += 1
+            return self._tables, self._tables_version
+
+    def set_tables(self, tables: List[Dict], version: int) -> None:
+        with self._lock:
+            if self._tables_version == version:
+                self._tables = tables
+                self._tables_loaded_at = time.monotonic()
+
+    def invalidate_tables(self) -> None:
+        """Descartar la caché de mesas (alta, edición, baja o cambio de estado)"""
+        with self._lock:
+            self._tables = None
+            self._tables_version += 1
+
+    def get_stats(self) -> Dict:
+        """Obtener estadísticas del índice de ocupación"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'fechas_cargadas': len(self._days),
+                'reservas_indexadas': len(self._reservations),
+                'aciertos': self.hits,
+                'fallos': self.misses,
+                'tasa_aciertos': f"{(self.hits / total * 100) if total else 0:.2f}%"
+            }
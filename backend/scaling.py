@@ -5,8 +5,10 @@ Cumple RNF-005: Escalabilidad - soportar crecimiento progresivo de usuarios
 
 import time
 import json
+import bisect
 import hashlib
 import threading
+from collections import deque
 from typing import Any, Optional, Dict, List, Callable
 from functools import wraps
 import pickle
@@ -87,6 +89,18 @@ class CacheManager:
         lru_key = min(self.access_times.keys(), key=lambda k: self.access_times[k])
         self._remove(lru_key)
     
+    def delete(self, key: Any) -> None:
+        """Eliminar una entrada del caché"""
+        with self.lock:
+            self._remove(self._generate_key(key))
+    
+    def pop(self, key: Any) -> Optional[Any]:
+        """Obtener y eliminar una entrada de forma atómica (None si no está o expiró)"""
+        with self.lock:
+            value = self.get(key)
+            self._remove(self._generate_key(key))
+            return value
+    
     def clear(self) -> None:
         """Limpiar todo el caché"""
         with self.lock:
@@ -176,97 +190,353 @@ class FileCache:
         except Exception:
             pass
 
-class DatabaseConnectionPool:
-    """Pool de conexiones a base de datos para escalabilidad"""
+class LatencyHistogram:
+    """Histograma de latencias (ms) con buckets fijos, seguro entre hilos"""
+    
+    DEFAULT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 30000)
+    
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, value_ms: float) -> None:
+        """Registrar una observación en milisegundos"""
+        index = bisect.bisect_left(self.buckets, value_ms)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value_ms
+            if value_ms > self.max:
+                self.max = value_ms
+    
+    def snapshot(self) -> Dict:
+        """Obtener una copia de los contadores del histograma"""
+        with self.lock:
+            buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)}
+            buckets['le_inf'] = self.counts[-1]
+            return {
+                'count': self.count,
+                'avg_ms': (self.total / self.count) if self.count else 0,
+                'max_ms': self.max,
+                'buckets': buckets
+            }
+
+class _PooledConnection:
+    """Metadatos de una conexión administrada por el pool"""
     
-    def __init__(self, db_config: Dict, min_connections: int = 2, max_connections: int = 10):
+    __slots__ = ('conn', 'created_at', 'last_used', 'checked_out_at')
+    
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.checked_out_at = None
+
+class DatabaseConnectionPool:
+    """
+    Pool de conexiones a base de datos para escalabilidad
+    
+    - Los hilos que esperan conexión se atienden en orden FIFO sobre un
+      threading.Condition (sin sondeo activo)
+    - Las conexiones se validan con ping solo al prestarlas y solo si llevan
+      más de `validation_interval` segundos inactivas
+    - Las conexiones se reciclan al superar `max_lifetime` y un hilo de fondo
+      cierra las que llevan más de `idle_timeout` sin uso (respetando el mínimo)
+    - El mismo hilo hace ping cada `keepalive_interval` a las conexiones ociosas
+      para que el servidor no las cierre por `wait_timeout`
+    """
+    
+    def __init__(self, db_config: Dict, min_connections: int = 2, max_connections: int = 10,
+                 max_lifetime: int = 1800, idle_timeout: int = 300,
+                 validation_interval: int = 30, acquire_timeout: int = 30,
+                 reap_interval: int = 30, keepalive_interval: int = 120):
         self.db_config = db_config
         self.min_connections = min_connections
         self.max_connections = max_connections
-        self.pool = []
-        self.active_connections = []
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.validation_interval = validation_interval
+        self.acquire_timeout = acquire_timeout
+        self.reap_interval = reap_interval
+        self.keepalive_interval = keepalive_interval
+        
+        self.idle_connections = deque()
+        self.active_connections = {}
+        self.waiters = deque()
+        self.pending_creations = 0
         self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        
+        self.created_total = 0
+        self.closed_total = 0
+        self.validation_failures = 0
+        self.timeouts = 0
+        self.wait_time_histogram = LatencyHistogram()
+        self.checkout_histogram = LatencyHistogram()
+        
+        self._closed = threading.Event()
         
         # Inicializar pool
         self._initialize_pool()
+        
+        self._reaper = threading.Thread(target=self._reap_loop, name='db-pool-reaper', daemon=True)
+        self._reaper.start()
     
     def _initialize_pool(self):
         """Inicializar pool con conexiones mínimas"""
-        import mysql.connector
         from mysql.connector import Error
         
         for _ in range(self.min_connections):
             try:
-                conn = mysql.connector.connect(**self.db_config, pool_name="restaurante_pool")
-                self.pool.append(conn)
+                record = self._create_connection()
+                self.idle_connections.append(record)
             except Error as e:
                 print(f"Error al crear conexión en pool: {e}")
     
-    def get_connection(self):
-        """Obtener conexión del pool"""
+    def _create_connection(self) -> _PooledConnection:
+        import mysql.connector
+        conn = mysql.connector.connect(**self.db_config)
         with self.lock:
-            if self.pool:
-                conn = self.pool.pop()
-                self.active_connections.append(conn)
-                return conn
+            self.created_total += 1
+        return _PooledConnection(conn)
+    
+    def _close_record(self, record: _PooledConnection) -> None:
+        try:
+            record.conn.close()
+        except:
+            pass
+        with self.lock:
+            self.closed_total += 1
+    
+    def _total_connections(self) -> int:
+        return len(self.idle_connections) + len(self.active_connections) + self.pending_creations
+    
+    def _is_expired(self, record: _PooledConnection, now: float) -> bool:
+        return bool(self.max_lifetime) and now - record.created_at > self.max_lifetime
+    
+    def _claim(self, deadline: float):
+        """
+        Esperar turno (FIFO) y reservar una conexión ociosa o un cupo para
+        crear una nueva. Devuelve (registro_ocioso, crear_nueva).
+        """
+        with self.condition:
+            waiter = None
+            try:
+                while True:
+                    if not self.waiters or self.waiters[0] is waiter:
+                        if self.idle_connections:
+                            # LIFO: reutilizar la conexión más caliente
+                            return self.idle_connections.pop(), False
+                        if self._total_connections() < self.max_connections:
+                            self.pending_creations += 1
+                            return None, True
+                    
+                    if waiter is None:
+                        waiter = object()
+                        self.waiters.append(waiter)
+                    
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise Exception("Timeout esperando conexión del pool")
+                    self.condition.wait(remaining)
+            finally:
+                if waiter is not None:
+                    self.waiters.remove(waiter)
+                    # El siguiente en la fila puede tener turno ahora
+                    self.condition.notify_all()
+    
+    def _validate(self, record: _PooledConnection, now: float) -> bool:
+        """Validación perezosa: ping solo si la conexión estuvo inactiva un tiempo"""
+        if self._is_expired(record, now):
+            return False
+        if now - record.last_used < self.validation_interval:
+            return True
+        try:
+            record.conn.ping(reconnect=False)
+            return True
+        except Exception:
+            with self.lock:
+                self.validation_failures += 1
+            return False
+    
+    def get_connection(self, timeout: Optional[float] = None):
+        """Obtener conexión del pool"""
+        start = time.monotonic()
+        deadline = start + (self.acquire_timeout if timeout is None else timeout)
+        
+        while True:
+            record, create = self._claim(deadline)
             
-            # Si no hay conexiones disponibles y no excede el máximo
-            if len(self.active_connections) < self.max_connections:
+            if create:
                 try:
-                    import mysql.connector
-                    conn = mysql.connector.connect(**self.db_config, pool_name="restaurante_pool")
-                    self.active_connections.append(conn)
-                    return conn
+                    record = self._create_connection()
                 except Exception as e:
+                    with self.condition:
+                        self.pending_creations -= 1
+                        self.condition.notify_all()
                     raise Exception(f"No se pudo crear nueva conexión: {e}")
+                with self.condition:
+                    self.pending_creations -= 1
+            elif not self._validate(record, time.monotonic()):
+                self._close_record(record)
+                with self.condition:
+                    self.condition.notify_all()
+                continue
             
-            # Esperar por una conexión disponible
-            return self._wait_for_connection()
-    
-    def _wait_for_connection(self):
-        """Esperar por una conexión disponible"""
-        import time
-        timeout = 30  # 30 segundos timeout
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            if self.pool:
-                conn = self.pool.pop()
-                self.active_connections.append(conn)
-                return conn
-            time.sleep(0.1)
-        
-        raise Exception("Timeout esperando conexión del pool")
+            now = time.monotonic()
+            record.checked_out_at = now
+            with self.lock:
+                self.active_connections[id(record.conn)] = record
+            self.wait_time_histogram.observe((now - start) * 1000)
+            return record.conn
     
     def return_connection(self, conn):
         """Devolver conexión al pool"""
-        with self.lock:
-            if conn in self.active_connections:
-                self.active_connections.remove(conn)
-                
-                # Verificar que la conexión sigue válida
-                try:
-                    if conn.is_connected():
-                        self.pool.append(conn)
-                    else:
-                        conn.close()
-                except:
-                    pass  # Conexión inválida, simplemente la cerramos
-                
-                # Mantener el pool dentro de los límites
-                while len(self.pool) > self.min_connections:
-                    extra_conn = self.pool.pop()
-                    extra_conn.close()
+        with self.condition:
+            record = self.active_connections.pop(id(conn), None)
+            if record is None:
+                return
+            
+            now = time.monotonic()
+            self.checkout_histogram.observe((now - record.checked_out_at) * 1000)
+            record.checked_out_at = None
+            record.last_used = now
+            
+            if self._is_expired(record, now) or self._closed.is_set():
+                expired = record
+            else:
+                expired = None
+                self.idle_connections.append(record)
+            self.condition.notify_all()
+        
+        if expired is not None:
+            self._close_record(expired)
+    
+    def discard_connection(self, conn):
+        """Descartar una conexión rota sin devolverla al pool"""
+        with self.condition:
+            record = self.active_connections.pop(id(conn), None)
+            self.condition.notify_all()
+        if record is not None:
+            self._close_record(record)
+        else:
+            try:
+                conn.close()
+            except:
+                pass
+    
+    def _reap_loop(self):
+        while not self._closed.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Error en limpieza del pool: {e}")
+    
+    def reap(self) -> int:
+        """Cerrar conexiones ociosas vencidas o que superaron su tiempo de vida"""
+        now = time.monotonic()
+        to_close = []
+        
+        with self.condition:
+            keep = deque()
+            # Las más antiguas quedan a la izquierda del deque
+            while self.idle_connections:
+                record = self.idle_connections.popleft()
+                idle_for = now - record.last_used
+                surplus = self._total_connections() + len(keep) >= self.min_connections
+                if self._is_expired(record, now) or (self.idle_timeout and idle_for > self.idle_timeout and surplus):
+                    to_close.append(record)
+                else:
+                    keep.append(record)
+            self.idle_connections = keep
+        
+        for record in to_close:
+            self._close_record(record)
+        
+        self._keepalive(now)
+        
+        # Reponer el mínimo fuera del lock para no bloquear a los demás hilos
+        while not self._closed.is_set():
+            with self.condition:
+                if self._total_connections() >= self.min_connections:
+                    break
+                self.pending_creations += 1
+            try:
+                record = self._create_connection()
+            except Exception as e:
+                with self.condition:
+                    self.pending_creations -= 1
+                print(f"Error al crear conexión en pool: {e}")
+                break
+            with self.condition:
+                self.pending_creations -= 1
+                self.idle_connections.appendleft(record)
+                self.condition.notify_all()
+        
+        return len(to_close)
+    
+    def _keepalive(self, now: float) -> None:
+        """Hacer ping a las conexiones ociosas que llevan tiempo sin usarse"""
+        if not self.keepalive_interval:
+            return
+        
+        with self.condition:
+            stale = [r for r in self.idle_connections if now - r.last_used > self.keepalive_interval]
+            for record in stale:
+                self.idle_connections.remove(record)
+        
+        for record in stale:
+            try:
+                record.conn.ping(reconnect=False)
+            except Exception:
+                with self.lock:
+                    self.validation_failures += 1
+                self._close_record(record)
+                continue
+            record.last_used = time.monotonic()
+            with self.condition:
+                if self._closed.is_set():
+                    closed = True
+                else:
+                    closed = False
+                    self.idle_connections.appendleft(record)
+                    self.condition.notify_all()
+            if closed:
+                self._close_record(record)
+    
+    def close_all(self):
+        """Cerrar todas las conexiones del pool"""
+        self._closed.set()
+        with self.condition:
+            records = list(self.idle_connections) + list(self.active_connections.values())
+            self.idle_connections.clear()
+            self.active_connections.clear()
+            self.condition.notify_all()
+        for record in records:
+            self._close_record(record)
     
     def get_pool_stats(self) -> Dict:
         """Obtener estadísticas del pool"""
         with self.lock:
             return {
-                'available_connections': len(self.pool),
+                'available_connections': len(self.idle_connections),
                 'active_connections': len(self.active_connections),
-                'total_connections': len(self.pool) + len(self.active_connections),
+                'total_connections': len(self.idle_connections) + len(self.active_connections),
                 'min_connections': self.min_connections,
-                'max_connections': self.max_connections
+                'max_connections': self.max_connections,
+                'waiting_threads': len(self.waiters),
+                'created_total': self.created_total,
+                'closed_total': self.closed_total,
+                'validation_failures': self.validation_failures,
+                'timeouts': self.timeouts,
+                'wait_time_ms': self.wait_time_histogram.snapshot(),
+                'checkout_duration_ms': self.checkout_histogram.snapshot()
             }
 
 class QueryOptimizer:
@@ -492,6 +762,7 @@ __all__ = [
     'CacheManager',
     'FileCache', 
     'DatabaseConnectionPool',
+    'LatencyHistogram',
     'QueryOptimizer',
     'LoadBalancer',
     'AsyncTaskQueue',
@@ -0,0 +1,316 @@
+"""
+Libro de stock en memoria para platos con alta demanda
+Cumple RNF-005: Escalabilidad - el stock de los platos del día no queda
+limitado por la contención sobre una sola fila de `platos`
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class _DishAllocation:
+    """Unidades de un plato ya descontadas en MySQL y disponibles localmente"""
+
+    __slots__ = ('remaining', 'granted_total', 'leases', 'last_activity', 'invalidated')
+
+    def __init__(self):
+        self.remaining = 0
+        self.granted_total = 0
+        self.leases = 0
+        self.last_activity = time.monotonic()
+        # El administrador fijó el stock mientras se pedía un lote
+        self.invalidated = False
+
+
+class StockLedger:
+    """
+    Contadores de stock por plato repartidos en shards con lock propio.
+
+    - Cada plato toma de MySQL un lote (`lease_size` unidades) con un UPDATE
+      condicionado y confirmado de inmediato; los pre-pedidos se descuentan
+      de ese lote en memoria, sin tocar la fila de `platos`
+    - Como el lote ya está descontado en la base, varios procesos nunca
+      pueden vender la misma unidad
+    - Un hilo de fondo devuelve en lote (write-behind) las unidades no usadas
+      de los platos inactivos por más de `idle_return` segundos
+    - El lote se pide a MySQL fuera del lock del shard: los demás platos del
+      shard se siguen atendiendo mientras tanto
+    - Si el proceso se cae con lotes sin usar, esas unidades quedan
+      descontadas (nunca se sobrevende) hasta el próximo ajuste de stock del
+      administrador
+    """
+
+    def __init__(self, db_config: Dict, lease_size: int = 20, shards: int = 16,
+                 idle_return: int = 30, flush_interval: int = 5):
+        self.db_config = dict(db_config, autocommit=True)
+        self.lease_size = lease_size
+        self.idle_return = idle_return
+        self.flush_interval = flush_interval
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+
+        # Conexión propia: los lotes se confirman fuera de la transacción del
+        # request y no compiten por el pool
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+        self.leases_taken = 0
+        self.units_returned = 0
+        self.local_grants = 0
+        self.rejections = 0
+
+    def _shard(self, id_plato):
+        return self.shards[id_plato % len(self.shards)]
+
+    def _execute(self, statements):
+        """Ejecutar `statements(connection)` en la conexión del libro, reconectando una vez"""
+        with self._connection_lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None:
+                        self._connection = mysql.connector.connect(**self.db_config)
+                    return statements(self._connection)
+                except Error as e:
+                    print(f"Error en libro de stock: {e}")
+                    try:
+                        self._connection.close()
+                    except Exception:
+                        pass
+                    self._connection = None
+                    if attempt:
+                        raise
+
+    def start(self):
+        """Arrancar el hilo de write-behind"""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='stock-ledger-flush', daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _lease(self, id_plato, needed):
+        """Tomar de MySQL hasta `lease_size` unidades (o las necesarias) del plato"""
+        def take(connection):
+            connection.start_transaction()
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT stock_disponible FROM platos WHERE id = %s FOR UPDATE", (id_plato,))
+                row = cursor.fetchone()
+                if not row:
+                    connection.rollback()
+                    return 0
+                amount = min(max(self.lease_size, needed), row[0])
+                if amount > 0:
+                    cursor.execute(
+                        "UPDATE platos SET stock_disponible = stock_disponible - %s WHERE id = %s",
+                        (amount, id_plato)
+                    )
+                connection.commit()
+                return amount
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+        amount = self._execute(take)
+        if amount:
+            self.leases_taken += 1
+        return amount
+
+    def reserve(self, quantities: Dict[int, int]) -> bool:
+        """
+        Descontar en memoria {id_plato: cantidad}. Todo o nada: si algún
+        plato no alcanza, se devuelven las unidades ya tomadas y retorna False
+        """
+        granted = {}
+        for id_plato, cantidad in sorted(quantities.items()):
+            if not self._take(id_plato, cantidad):
+                self.rejections += 1
+                self.release(granted)
+                return False
+            granted[id_plato] = cantidad
+
+        self.local_grants += 1
+        return True
+
+    def _take(self, id_plato, cantidad) -> bool:
+        """Descontar `cantidad` del lote del plato, pidiendo un lote nuevo si no alcanza"""
+        allocations, lock = self._shard(id_plato)
+        with lock:
+            allocation = allocations.get(id_plato)
+            if allocation is None:
+                allocation = allocations[id_plato] = _DishAllocation()
+            allocation.last_activity = time.monotonic()
+            if allocation.remaining >= cantidad:
+                allocation.remaining -= cantidad
+                allocation.granted_total += cantidad
+                return True
+            needed = cantidad - allocation.remaining
+
+        # Ida y vuelta a MySQL (SELECT ... FOR UPDATE) sin el lock del shard
+        leased = self._lease(id_plato, needed)
+
+        with lock:
+            if allocation.invalidated:
+                # El lote se tomó del stock anterior al que fijó el
+                # administrador: se descarta en lugar de sumarlo al nuevo
+                leased = 0
+            current = allocations.get(id_plato)
+            if current is None:
+                # El write-behind devolvió el lote anterior mientras tanto
+                current = allocations[id_plato] = _DishAllocation()
+            current.remaining += leased
+            if leased:
+                current.leases += 1
+            current.last_activity = time.monotonic()
+            if current.remaining < cantidad:
+                return False
+            current.remaining -= cantidad
+            current.granted_total += cantidad
+            return True
+
+    def release(self, quantities: Dict[int, int]) -> None:
+        """Devolver al libro unidades concedidas (p. ej. si la transacción se revirtió)"""
+        for id_plato, cantidad in quantities.items():
+            allocations, lock = self._shard(id_plato)
+            with lock:
+                allocation = allocations.get(id_plato)
+                if allocation is not None:
+                    allocation.remaining += cantidad
+                    allocation.granted_total -= cantidad
+
+    def available(self, id_plato: int) -> Optional[int]:
+        """Unidades locales del plato (None si el libro no lo está administrando)"""
+        allocations, lock = self._shard(id_plato)
+        with lock:
+            allocation = allocations.get(id_plato)
+            return allocation.remaining if allocation is not None else None
+
+    def invalidate(self, id_plato: Optional[int] = None) -> None:
+        """
+        Olvidar los lotes de un plato (o de todos) sin devolverlos: se usa
+        cuando el administrador fija el stock, que pasa a ser el valor real
+        """
+        if id_plato is not None:
+            self.invalidate_many([id_plato])
+            return
+        for allocations, lock in self.shards:
+            with lock:
+                for allocation in allocations.values():
+                    allocation.invalidated = True
+                allocations.clear()
+
+    def invalidate_many(self, ids: Iterable[int]) -> None:
+        """Olvidar los lotes de los platos `ids` (p. ej. los que escribió una importación)"""
+        for id_plato in ids:
+            allocations, lock = self._shard(id_plato)
+            with lock:
+                allocation = allocations.pop(id_plato, None)
+                if allocation is not None:
+                    allocation.invalidated = True
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error al devolver stock al libro: {e}")
+
+    def flush(self, force: bool = False) -> int:
+        """Devolver a MySQL, en un solo UPDATE, las unidades de los platos inactivos"""
+        now = time.monotonic()
+        deltas = {}
+        for allocations, lock in self.shards:
+            with lock:
+                for id_plato, allocation in list(allocations.items()):
+                    if force or now - allocation.last_activity > self.idle_return:
+                        if allocation.remaining:
+                            deltas[id_plato] = allocation.remaining
+                        del allocations[id_plato]
+
+        if not deltas:
+            return 0
+
+        placeholders = ', '.join(['%s'] * len(deltas))
+        cases = ' '.join(['WHEN %s THEN %s'] * len(deltas))
+        params = tuple(value for item in deltas.items() for value in item) + tuple(deltas)
+
+        def give_back(connection):
+            cursor = connection.cursor()
+            cursor.execute(
+                f"UPDATE platos SET stock_disponible = stock_disponible + CASE id {cases} END "
+                f"WHERE id IN ({placeholders})",
+                params
+            )
+            cursor.close()
+
+        try:
+            self._execute(give_back)
+        except Error:
+            # Reintentar en el próximo ciclo
+            for id_plato, remaining in deltas.items():
+                allocations, lock = self._shard(id_plato)
+                with lock:
+                    allocation = allocations.setdefault(id_plato, _DishAllocation())
+                    allocation.remaining += remaining
+            raise
+
+        self.units_returned += sum(deltas.values())
+        return len(deltas)
+
+    def close(self):
+        """Detener el write-behind y devolver todas las unidades locales"""
+        self._stop.set()
+        try:
+            self.flush(force=True)
+        except Exception as e:
+            print(f"Error al cerrar libro de stock: {e}")
+        with self._connection_lock:
+            if self._connection is not None:
+                try:
+                    self._connection.close()
+                except Exception:
+                    pass
+                self._connection = None
+
+    def get_stats(self) -> Dict:
+        """Obtener estadísticas del libro de stock"""
+        dishes = 0
+        local_units = 0
+        for allocations, lock in self.shards:
+            with lock:
+                dishes += len(allocations)
+                local_units += sum(a.remaining for a in allocations.values())
+        return {
+            'platos_administrados': dishes,
+            'unidades_locales': local_units,
+            'lotes_tomados': self.leases_taken,
+            'unidades_devueltas': self.units_returned,
+            'reservas_locales': self.local_grants,
+            'rechazos': self.rejections,
+            'shards': len(self.shards),
+            'lease_size': self.lease_size
+        }
+
+
+def setup_stock_ledger(db_config: Dict) -> StockLedger:
+    """
+    Configurar libro de stock (activar con STOCK_LEDGER=1). El write-behind
+    arranca aquí, al cargar la aplicación, para que también corra bajo un
+    servidor WSGI y las unidades de los lotes vuelvan a la base
+    """
+    ledger = StockLedger(
+        db_config,
+        lease_size=int(os.getenv('STOCK_LEDGER_LEASE', 20)),
+        shards=int(os.getenv('STOCK_LEDGER_SHARDS', 16)),
+        idle_return=int(os.getenv('STOCK_LEDGER_IDLE_RETURN', 30))
+    )
+    ledger.start()
+    return ledger
@@ -0,0 +1,157 @@
+"""
+Asignación automática de mesas: mejor ajuste y combinación de mesas contiguas
+Cumple RF-003: Reservas - aprovechar la capacidad del salón para grupos grandes
+"""
+
+import math
+import threading
+from typing import Dict, List, Optional
+
+
+class TableAllocator:
+    """
+    Elige, para un grupo de `comensales`, la mesa libre más chica en la que
+    entran o una combinación de mesas contiguas de la misma zona.
+
+    - Dos mesas son contiguas si sus posiciones (posicion_x, posicion_y)
+      están a una distancia menor o igual a `adjacency_distance`
+    - El grafo de contigüidad se arma una vez por versión de las mesas con
+      una grilla de celdas, sin comparar todos los pares
+    - La búsqueda enumera subconjuntos conexos de hasta `max_tables` mesas
+      sin repetirlos y poda en cuanto un conjunto ya alcanza a los comensales
+      o no puede mejorar la mejor opción encontrada
+    - Se prefiere la opción con menos asientos vacíos y, a igualdad, la de
+      menos mesas
+    """
+
+    # (asientos vacíos, mesas) de una combinación que no se puede mejorar
+    PERFECT_COMBINATION = (0, 2)
+
+    def __init__(self, adjacency_distance: float = 30, max_tables: int = 3):
+        self.adjacency_distance = adjacency_distance
+        self.max_tables = max_tables
+        self._graph = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Descartar el grafo (alta, baja o cambio de posición de mesas)"""
+        with self._lock:
+            self._graph = None
+
+    def _build_graph(self, tables: List[Dict]) -> Dict[int, List[int]]:
+        cell = self.adjacency_distance or 1
+        grid = {}
+        for table in tables:
+            key = (table.get('id_zona'),
+                   math.floor((table.get('posicion_x') or 0) / cell),
+                   math.floor((table.get('posicion_y') or 0) / cell))
+            grid.setdefault(key, []).append(table)
+
+        graph = {table['id']: [] for table in tables}
+        for (zona, cx, cy), members in grid.items():
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for other in grid.get((zona, cx + dx, cy + dy), ()):
+                        for table in members:
+                            if other['id'] == table['id']:
+                                continue
+                            distance = math.hypot(
+                                (table.get('posicion_x') or 0) - (other.get('posicion_x') or 0),
+                                (table.get('posicion_y') or 0) - (other.get('posicion_y') or 0)
+                            )
+                            if distance <= self.adjacency_distance:
+                                graph[table['id']].append(other['id'])
+        return graph
+
+    def graph(self, tables: List[Dict]) -> Dict[int, List[int]]:
+        """Grafo de contigüidad de todas las mesas (se arma una sola vez)"""
+        with self._lock:
+            if self._graph is None:
+                self._graph = self._build_graph(tables)
+            return self._graph
+
+    def allocate(self, all_tables: List[Dict], free_tables: List[Dict], comensales: int) -> Optional[List[Dict]]:
+        """
+        Mesas para el grupo (una o varias contiguas, de mayor a menor
+        capacidad) entre `free_tables`, o None si no hay ninguna opción.
+        `all_tables` se usa para el grafo
+        """
+        comensales = int(comensales)
+        free = {table['id']: table for table in free_tables}
+        if not free:
+            return None
+
+        # Mejor opción con una sola mesa
+        best = None
+        fitting = [table for table in free.values() if table['capacidad'] >= comensales]
+        if fitting:
+            table = min(fitting, key=lambda t: (t['capacidad'], t['id']))
+            best = (table['capacidad'] - comensales, 1, [table['id']])
+            if best[0] == 0:
+                return [table]
+
+        if self.max_tables > 1:
+            graph = self.graph(all_tables)
+            order = sorted(free)
+            rank = {id_mesa: i for i, id_mesa in enumerate(order)}
+            for root in order:
+                best = self._extend(graph, free, rank, [root], free[root]['capacidad'],
+                                    self._neighbors(graph, free, rank, root, {root}, rank[root]),
+                                    comensales, best)
+                if best and best[:2] <= self.PERFECT_COMBINATION:
+                    break
+
+        if not best:
+            return None
+        return sorted((free[id_mesa] for id_mesa in best[2]), key=lambda t: (-t['capacidad'], t['id']))
+
+    def _neighbors(self, graph, free, rank, id_mesa, selected, root_rank):
+        return {
+            other for other in graph.get(id_mesa, ())
+            if other in free and other not in selected and rank[other] > root_rank
+        }
+
+    def _extend(self, graph, free, rank, selected, capacity, extension, comensales, best):
+        """
+        Enumeración de subconjuntos conexos cuya mesa de menor id es la raíz
+        (cada subconjunto se visita una sola vez)
+        """
+        if capacity >= comensales:
+            candidate = (capacity - comensales, len(selected), list(selected))
+            if len(selected) > 1 and (best is None or candidate[:2] < best[:2]):
+                best = candidate
+            # Agregar más mesas solo aumenta los asientos vacíos
+            return best
+        if len(selected) >= self.max_tables:
+            return best
+
+        root_rank = rank[selected[0]]
+        extension = set(extension)
+        while extension:
+            other = min(extension, key=rank.get)
+            extension.discard(other)
+            new_capacity = capacity + free[other]['capacidad']
+            # Poda: con una mesa más ya no se mejora la mejor opción
+            if best is not None and new_capacity >= comensales and \
+                    (new_capacity - comensales, len(selected) + 1) >= best[:2]:
+                continue
+            new_extension = extension | {
+                n for n in self._neighbors(graph, free, rank, other, set(selected) | {other}, root_rank)
+                if all(n not in graph.get(s, ()) for s in selected)
+            }
+            best = self._extend(graph, free, rank, selected + [other], new_capacity,
+                                new_extension, comensales, best)
+            if best and best[:2] <= self.PERFECT_COMBINATION:
+                return best
+        return best
+
+    @staticmethod
+    def split_guests(tables: List[Dict], comensales: int) -> List[int]:
+        """Repartir los comensales entre las mesas asignadas (las más grandes primero)"""
+        remaining = int(comensales)
+        counts = []
+        for table in tables:
+            count = min(table['capacidad'], remaining)
+            counts.append(count)
+            remaining -= count
+        return counts
@@ -0,0 +1,210 @@
+"""
+Lectura por lotes de archivos Excel/CSV subidos
+Cumple RNF-001: Rendimiento - un archivo grande no se carga completo en
+memoria dentro del hilo del request
+"""
+
+import csv
+import hashlib
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+from openpyxl import load_workbook
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+ALLOWED_EXTENSIONS = EXCEL_EXTENSIONS + ('.csv',)
+
+# Bloque de copia al guardar el archivo en disco
+SPOOL_BLOCK = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """Archivo rechazado (tamaño, filas, formato o encabezados); `details` va en la respuesta 400"""
+
+    def __init__(self, message: str, **details):
+        super().__init__(message)
+        self.details = details
+
+
+class TabularUpload:
+    """
+    Archivo subido guardado en un temporal en disco y leído en DataFrames
+    de `batch_rows` filas.
+
+    - Al guardarlo se corta en cuanto supera `max_bytes` y se calcula su
+      SHA-256
+    - .xlsx/.xlsm se leen con openpyxl en modo read_only (fila a fila) y .csv
+      con el módulo csv; .xls (formato binario) no admite
+      lectura incremental y se lee completo, acotado a `max_rows`
+    - El encabezado se valida antes de leer los datos; un archivo con
+      columnas faltantes se rechaza sin recorrerlo
+    - El índice de cada lote sigue la posición en el archivo (fila de datos
+      0, 1, ...), así los mensajes "Fila N" coinciden con los de pd.read_excel
+    """
+
+    def __init__(self, file_storage, max_bytes: int = 20 * 1024 * 1024,
+                 max_rows: int = 50000, batch_rows: int = 1000):
+        self.file_storage = file_storage
+        self.filename = file_storage.filename or ''
+        self.extension = os.path.splitext(self.filename)[1].lower()
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.batch_rows = batch_rows
+        self.path = None
+        self.size = 0
+        self.sha256 = None
+        self.columns = None
+
+    def __enter__(self):
+        if self.path is None:
+            self.spool()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def spool(self) -> str:
+        """Copiar el archivo a disco por bloques; UploadError si supera `max_bytes`"""
+        if self.extension not in ALLOWED_EXTENSIONS:
+            raise UploadError('El archivo debe ser un Excel (.xlsx o .xls) o un CSV')
+
+        digest = hashlib.sha256()
+        handle, self.path = tempfile.mkstemp(suffix=self.extension, prefix='upload_')
+        try:
+            with os.fdopen(handle, 'wb') as target:
+                while True:
+                    block = self.file_storage.stream.read(SPOOL_BLOCK)
+                    if not block:
+                        break
+                    self.size += len(block)
+                    if self.size > self.max_bytes:
+                        raise UploadError(
+                            f'El archivo supera el tamaño máximo de {self.max_bytes // (1024 * 1024)} MB',
+                            tamano_maximo=self.max_bytes
+                        )
+                    digest.update(block)
+                    target.write(block)
+        except BaseException:
+            # __exit__ no corre si falla __enter__: el temporal se borra aquí
+            self.close()
+            raise
+
+        self.sha256 = digest.hexdigest()
+        return self.path
+
+    def close(self):
+        """Eliminar el temporal"""
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def _rows(self) -> Iterator[List]:
+        """Filas crudas (la primera es el encabezado)"""
+        if self.extension == '.csv':
+            with open(self.path, newline='', encoding='utf-8-sig') as source:
+                sample = source.read(64 * 1024)
+                source.seek(0)
+                try:
+                    dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+                except csv.Error:
+                    dialect = csv.excel
+                for row in csv.reader(source, dialect):
+                    yield [value if value != '' else None for value in row]
+        elif self.extension == '.xls':
+            df = pd.read_excel(self.path, header=None, nrows=self.max_rows + 2)
+            for row in df.itertuples(index=False):
+                yield [None if pd.isna(value) else value for value in row]
+        else:
+            workbook = load_workbook(self.path, read_only=True, data_only=True)
+            try:
+                for row in workbook.worksheets[0].iter_rows(values_only=True):
+                    yield list(row)
+            finally:
+                workbook.close()
+
+    @staticmethod
+    def _normalize_header(header, column_mapping: Optional[Dict[str, str]]):
+        columns = [str(value).strip() if value is not None else '' for value in header]
+        if column_mapping is not None:
+            # Minúsculas, sin espacios y nombres alternativos a estándar
+            columns = [column.lower() for column in columns]
+            columns = [column_mapping.get(column, column) for column in columns]
+        return columns
+
+    def _read_header(self, rows, required_columns, column_mapping):
+        header = next(rows, None)
+        if header is None:
+            raise UploadError('El archivo está vacío')
+
+        self.columns = self._normalize_header(header, column_mapping)
+        missing_columns = [column for column in required_columns if column not in self.columns]
+        if missing_columns:
+            raise UploadError(
+                'El archivo no tiene las columnas requeridas',
+                columnas_requeridas=required_columns,
+                columnas_faltantes=missing_columns,
+                columnas_encontradas=[column for column in self.columns if column]
+            )
+
+    def check_header(self, required_columns: List[str],
+                     column_mapping: Optional[Dict[str, str]] = None) -> List[str]:
+        """Validar solo el encabezado (p. ej. antes de encolar la importación)"""
+        rows = self._rows()
+        try:
+            self._read_header(rows, required_columns, column_mapping)
+        finally:
+            rows.close()
+        return self.columns
+
+    def batches(self, required_columns: List[str],
+                column_mapping: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        DataFrames de hasta `batch_rows` filas con las columnas del encabezado.
+        Con `column_mapping` los encabezados se pasan a minúsculas y se
+        traducen. UploadError si faltan columnas o se supera `max_rows`
+        """
+        rows = self._rows()
+        self._read_header(rows, required_columns, column_mapping)
+
+        width = len(self.columns)
+        batch, index = [], []
+        # Filas vacías pendientes: se pasan (como pd.read_excel, y la
+        # validación las reporta) solo si después aparece una fila con datos;
+        # las del final de la hoja (p. ej. con formato) se descartan
+        empty = []
+        for position, row in enumerate(rows):
+            if position >= self.max_rows:
+                raise UploadError(
+                    f'El archivo supera el máximo de {self.max_rows} filas',
+                    filas_maximas=self.max_rows
+                )
+            if all(value is None for value in row):
+                empty.append(position)
+                continue
+            pending = [(empty_position, [None] * width) for empty_position in empty]
+            pending.append((position, (list(row) + [None] * width)[:width]))
+            empty = []
+            for row_position, values in pending:
+                batch.append(values)
+                index.append(row_position)
+                if len(batch) >= self.batch_rows:
+                    yield pd.DataFrame(batch, columns=self.columns, index=index)
+                    batch, index = [], []
+
+        if batch:
+            yield pd.DataFrame(batch, columns=self.columns, index=index)
+
+
+def open_upload(file_storage) -> TabularUpload:
+    """Archivo subido con los límites configurados (UPLOAD_MAX_MB, UPLOAD_MAX_ROWS, UPLOAD_BATCH_ROWS)"""
+    return TabularUpload(
+        file_storage,
+        max_bytes=int(os.getenv('UPLOAD_MAX_MB', 20)) * 1024 * 1024,
+        max_rows=int(os.getenv('UPLOAD_MAX_ROWS', 50000)),
+        batch_rows=int(os.getenv('UPLOAD_BATCH_ROWS', 1000))
+    )
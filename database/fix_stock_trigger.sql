@@ -0,0 +1,11 @@
+-- Eliminar el trigger que descontaba stock al insertar pre-pedidos
+-- El backend ya descuenta el stock con un UPDATE condicionado en la misma
+-- transacción del pre-pedido; con el trigger instalado el stock se
+-- descontaba dos veces.
+
+USE restaurante;
+
+DROP TRIGGER IF EXISTS actualizar_stock_prepedido;
+
+-- devolver_stock_prepedido (AFTER DELETE) se mantiene: al eliminar un
+-- pre-pedido su cantidad vuelve al stock del plato.
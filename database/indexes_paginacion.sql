@@ -0,0 +1,18 @@
+-- Índices para paginación keyset y filtros de los listados de administración
+-- (/api/admin/reservas y /api/notas-consumo)
+
+USE restaurante;
+
+-- Orden (fecha DESC, hora DESC, id DESC) con rango por fecha
+CREATE INDEX idx_reservas_fecha_hora_id ON reservas(fecha, hora, id);
+
+-- Filtro por estado manteniendo el orden de paginación
+CREATE INDEX idx_reservas_estado_fecha_hora ON reservas(estado, fecha, hora, id);
+
+-- El filtro por mesa usa la clave única existente unique_reserva (id_mesa, fecha, hora)
+
+-- Notas de consumo: orden (fecha_generacion DESC, id DESC)
+CREATE INDEX idx_notas_consumo_fecha_id ON notas_consumo(fecha_generacion, id);
+
+-- Filtro por estado de la nota
+CREATE INDEX idx_notas_consumo_estado_fecha ON notas_consumo(estado, fecha_generacion, id);
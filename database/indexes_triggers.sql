@@ -9,16 +9,9 @@ CREATE INDEX idx_mesas_estado ON mesas(estado);
 CREATE INDEX idx_notas_consumo_reserva ON notas_consumo(id_reserva);
 
 -- Triggers para actualización automática de stock
-DELIMITER //
-CREATE TRIGGER actualizar_stock_prepedido
-AFTER INSERT ON prepedidos
-FOR EACH ROW
-BEGIN
-    UPDATE platos 
-    SET stock_disponible = stock_disponible - NEW.cantidad 
-    WHERE id = NEW.id_plato;
-END//
-DELIMITER ;
+-- El descuento al crear pre-pedidos lo hace el backend con un UPDATE
+-- condicionado (stock_disponible >= cantidad); un trigger AFTER INSERT lo
+-- descontaría dos veces. Ver fix_stock_trigger.sql para bases ya instaladas.
 
 DELIMITER //
 CREATE TRIGGER devolver_stock_prepedido
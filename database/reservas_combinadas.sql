@@ -0,0 +1,13 @@
+-- Reservas con varias mesas contiguas (asignación automática de mesas)
+-- Cada mesa de la combinación tiene su propia fila en reservas, de modo que
+-- la verificación de solapamiento por mesa no cambia; las mesas adicionales
+-- apuntan a la reserva principal, que es la que lleva los pre-pedidos.
+
+USE restaurante;
+
+ALTER TABLE reservas
+    ADD COLUMN id_reserva_principal INT NULL AFTER id_mesa,
+    ADD CONSTRAINT fk_reservas_principal
+        FOREIGN KEY (id_reserva_principal) REFERENCES reservas(id) ON DELETE CASCADE;
+
+CREATE INDEX idx_reservas_principal ON reservas(id_reserva_principal);
@@ -0,0 +1,71 @@
+-- Intervalo explícito de cada reserva: hora (inicio) y hora_fin
+-- La verificación de solapamiento pasa de
+--   ABS(TIME_TO_SEC(hora) - TIME_TO_SEC(:hora)) < 7200
+-- a un predicado de rango que puede usar índices:
+--   hora < :fin AND hora_fin > :inicio
+-- La duración sale de configuracion_sistema.tiempo_reserva_default (minutos).
+
+USE restaurante;
+
+-- Duración por defecto (ya incluida en optimization_3fn.sql)
+CREATE TABLE IF NOT EXISTS configuracion_sistema (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    clave VARCHAR(100) UNIQUE NOT NULL,
+    valor TEXT,
+    descripcion TEXT,
+    tipo VARCHAR(20) DEFAULT 'string',
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO configuracion_sistema (clave, valor, descripcion, tipo) VALUES
+('tiempo_reserva_default', '120', 'Tiempo por defecto para reserva en minutos', 'number');
+
+-- 1. Columna nueva (TIME admite valores mayores a 24:00, p. ej. 22:00 + 2h = 24:00:00)
+ALTER TABLE reservas ADD COLUMN hora_fin TIME NULL AFTER hora;
+
+-- 2. Backfill de las reservas existentes
+UPDATE reservas
+SET hora_fin = ADDTIME(hora, SEC_TO_TIME(60 * COALESCE(
+    (SELECT CAST(valor AS UNSIGNED) FROM configuracion_sistema WHERE clave = 'tiempo_reserva_default'),
+    120
+)))
+WHERE hora_fin IS NULL;
+
+ALTER TABLE reservas MODIFY hora_fin TIME NOT NULL;
+
+-- 3. Índice para el solapamiento por mesa: igualdad en (id_mesa, fecha),
+-- rango en hora y hora_fin leída del propio índice. Con FOR UPDATE solo se
+-- bloquean las reservas de esa mesa que empiezan antes del fin pedido.
+CREATE INDEX idx_reservas_mesa_fecha_intervalo ON reservas(id_mesa, fecha, hora, hora_fin);
+
+-- Disponibilidad de un día completo (todas las mesas)
+CREATE INDEX idx_reservas_fecha_estado_intervalo ON reservas(fecha, estado, hora, hora_fin);
+
+-- 4. Otros procesos que insertan o mueven reservas (n8n, scripts) no envían
+-- hora_fin: se completa con la duración configurada y, si cambia la hora,
+-- se conserva la duración que tenía la reserva.
+DROP TRIGGER IF EXISTS trg_reservas_hora_fin_insert;
+DROP TRIGGER IF EXISTS trg_reservas_hora_fin_update;
+
+DELIMITER //
+CREATE TRIGGER trg_reservas_hora_fin_insert
+BEFORE INSERT ON reservas
+FOR EACH ROW
+BEGIN
+    IF NEW.hora_fin IS NULL THEN
+        SET NEW.hora_fin = ADDTIME(NEW.hora, SEC_TO_TIME(60 * COALESCE(
+            (SELECT CAST(valor AS UNSIGNED) FROM configuracion_sistema WHERE clave = 'tiempo_reserva_default'),
+            120
+        )));
+    END IF;
+END//
+
+CREATE TRIGGER trg_reservas_hora_fin_update
+BEFORE UPDATE ON reservas
+FOR EACH ROW
+BEGIN
+    IF NEW.hora <> OLD.hora AND NEW.hora_fin <=> OLD.hora_fin THEN
+        SET NEW.hora_fin = ADDTIME(NEW.hora, TIMEDIFF(OLD.hora_fin, OLD.hora));
+    END IF;
+END//
+DELIMITER ;
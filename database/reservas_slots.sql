@@ -0,0 +1,37 @@
+-- Ocupación de mesas por slots de 15 minutos
+-- Reemplaza el SELECT ... FOR UPDATE sobre reservas (que bloqueaba rangos y
+-- huecos del índice y frenaba reservas de otras mesas y horarios) por una
+-- clave única: dos reservas que se solapan en la misma mesa intentan
+-- insertar el mismo (id_mesa, fecha, slot) y la segunda falla por clave
+-- duplicada. slot = número de bloque de 15 minutos desde las 00:00; el
+-- backend solo acepta horas múltiplo de 15 minutos y redondea la duración
+-- a slots enteros, así reservas que solo se tocan no comparten slot.
+-- Las escrituras directas a reservas (fuera del backend) deben insertar
+-- también sus slots para quedar protegidas.
+
+USE restaurante;
+
+CREATE TABLE IF NOT EXISTS reservas_slots (
+    id_mesa INT NOT NULL,
+    fecha DATE NOT NULL,
+    slot SMALLINT NOT NULL,
+    id_reserva INT NOT NULL,
+    PRIMARY KEY (id_mesa, fecha, slot),
+    INDEX idx_reservas_slots_reserva (id_reserva),
+    FOREIGN KEY (id_reserva) REFERENCES reservas(id) ON DELETE CASCADE
+);
+
+-- Backfill de las reservas confirmadas desde hoy (hasta 100 slots = 25 horas)
+INSERT IGNORE INTO reservas_slots (id_mesa, fecha, slot, id_reserva)
+SELECT r.id_mesa, r.fecha, FLOOR(TIME_TO_SEC(r.hora) / 900) + n.i, r.id
+FROM reservas r
+JOIN (
+    SELECT d.i * 10 + u.i AS i
+    FROM (SELECT 0 AS i UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+          UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) d
+    CROSS JOIN
+         (SELECT 0 AS i UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+          UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) u
+) n ON FLOOR(TIME_TO_SEC(r.hora) / 900) + n.i < CEIL(TIME_TO_SEC(r.hora_fin) / 900)
+WHERE r.estado = 'confirmada'
+AND r.fecha >= CURDATE();
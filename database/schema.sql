@@ -62,12 +62,17 @@ CREATE TABLE horarios (
 );
 
 -- Tabla de reservas
+-- hora_fin: fin del intervalo [hora, hora_fin); si no se envía la completan
+-- los triggers trg_reservas_hora_fin_* del final (ver reservas_hora_fin.sql)
+-- id_reserva_principal: mesas adicionales de una reserva combinada (ver reservas_combinadas.sql)
 CREATE TABLE reservas (
     id INT AUTO_INCREMENT PRIMARY KEY,
     id_usuario INT NOT NULL,
     id_mesa INT NOT NULL,
+    id_reserva_principal INT NULL,
     fecha DATE NOT NULL,
     hora TIME NOT NULL,
+    hora_fin TIME NOT NULL,
     numero_comensales INT NOT NULL,
     estado ENUM('confirmada', 'cancelada', 'completada', 'no_asistio') DEFAULT 'confirmada',
     observaciones TEXT,
@@ -75,7 +80,26 @@ CREATE TABLE reservas (
     actualizada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (id_usuario) REFERENCES usuarios(id) ON DELETE CASCADE,
     FOREIGN KEY (id_mesa) REFERENCES mesas(id) ON DELETE CASCADE,
-    UNIQUE KEY unique_reserva (id_mesa, fecha, hora)
+    CONSTRAINT fk_reservas_principal
+        FOREIGN KEY (id_reserva_principal) REFERENCES reservas(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_reserva (id_mesa, fecha, hora),
+    INDEX idx_reservas_principal (id_reserva_principal),
+    INDEX idx_reservas_mesa_fecha_intervalo (id_mesa, fecha, hora, hora_fin),
+    INDEX idx_reservas_fecha_estado_intervalo (fecha, estado, hora, hora_fin)
+);
+
+-- Ocupación de mesas por slots de 15 minutos (ver reservas_slots.sql)
+-- slot = número de bloque de 15 minutos desde las 00:00; las reservas
+-- empiezan en un múltiplo de 15 minutos y su duración se redondea a slots
+-- enteros. Dos reservas solapadas en la misma mesa chocan en la clave primaria
+CREATE TABLE reservas_slots (
+    id_mesa INT NOT NULL,
+    fecha DATE NOT NULL,
+    slot SMALLINT NOT NULL,
+    id_reserva INT NOT NULL,
+    PRIMARY KEY (id_mesa, fecha, slot),
+    INDEX idx_reservas_slots_reserva (id_reserva),
+    FOREIGN KEY (id_reserva) REFERENCES reservas(id) ON DELETE CASCADE
 );
 
 -- Tabla de pre-pedidos
@@ -111,7 +135,21 @@ CREATE TABLE dias_cerrados (
     creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Configuración del sistema (ver optimization_3fn.sql); los triggers de
+-- hora_fin leen de aquí la duración por defecto de una reserva
+CREATE TABLE IF NOT EXISTS configuracion_sistema (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    clave VARCHAR(100) UNIQUE NOT NULL,
+    valor TEXT,
+    descripcion TEXT,
+    tipo VARCHAR(20) DEFAULT 'string',
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
 -- Insertar datos iniciales
+INSERT IGNORE INTO configuracion_sistema (clave, valor, descripcion, tipo) VALUES
+('tiempo_reserva_default', '120', 'Tiempo por defecto para reserva en minutos', 'number');
+
 INSERT INTO usuarios (nombre, email, password, rol, telefono) VALUES
 ('Administrador', 'admin@restaurante.com', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj6QJw/2Ej7W', 'administrador', '1234567890'),
 ('Cliente Ejemplo', 'cliente@ejemplo.com', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj6QJw/2Ej7W', 'cliente', '0987654321');
@@ -144,4 +182,30 @@ INSERT INTO horarios (dia_semana, hora_apertura, hora_cierre) VALUES
 ('jueves', '12:00:00', '23:00:00'),
 ('viernes', '12:00:00', '23:00:00'),
 ('sabado', '13:00:00', '23:00:00'),
-('domingo', '13:00:00', '21:00:00');
\ No newline at end of file
+('domingo', '13:00:00', '21:00:00');
+
+-- hora_fin para quien inserta o mueve reservas sin enviarla (n8n, scripts):
+-- se completa con la duración configurada y, si cambia la hora, se conserva
+-- la duración que tenía la reserva (igual que reservas_hora_fin.sql)
+DELIMITER //
+CREATE TRIGGER trg_reservas_hora_fin_insert
+BEFORE INSERT ON reservas
+FOR EACH ROW
+BEGIN
+    IF NEW.hora_fin IS NULL THEN
+        SET NEW.hora_fin = ADDTIME(NEW.hora, SEC_TO_TIME(60 * COALESCE(
+            (SELECT CAST(valor AS UNSIGNED) FROM configuracion_sistema WHERE clave = 'tiempo_reserva_default'),
+            120
+        )));
+    END IF;
+END//
+
+CREATE TRIGGER trg_reservas_hora_fin_update
+BEFORE UPDATE ON reservas
+FOR EACH ROW
+BEGIN
+    IF NEW.hora <> OLD.hora AND NEW.hora_fin <=> OLD.hora_fin THEN
+        SET NEW.hora_fin = ADDTIME(NEW.hora, TIMEDIFF(OLD.hora_fin, OLD.hora));
+    END IF;
+END//
+DELIMITER ;
@@ -428,6 +428,11 @@ function validateReservationForm() {
         if (timeInMinutes < openingTime || timeInMinutes > closingTime) {
             errors.push('❌ El horario de atención es de 12:00 a 23:00 hrs');
         }
+        
+        // Las reservas empiezan en :00, :15, :30 o :45
+        if (minutes % 15 !== 0) {
+            errors.push('❌ La hora debe ser múltiplo de 15 minutos (:00, :15, :30 o :45)');
+        }
     }
     
     // Validar tiempo mínimo de anticipación (1 hora)
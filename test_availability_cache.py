@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Caché de disponibilidad de ReservationManager: el dict guardado no se
+modifica y una mesa que pasa a 'reservada' no descarta las demás fechas
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from models import ReservationManager
+
+MESAS = [{'id': 1, 'capacidad': 4}, {'id': 2, 'capacidad': 4}]
+
+
+def make_manager():
+    manager = ReservationManager(db=None, menu_manager=object())
+    manager.occupancy = None
+    manager.computed = []
+
+    def compute(fecha, hora, comensales, id_zona=None):
+        manager.computed.append((fecha, hora))
+        return list(MESAS)
+
+    manager._compute_availability = compute
+    return manager
+
+
+def test_cached_results_are_not_mutated():
+    manager = make_manager()
+    manager.check_availability('2026-10-20', '20:00', 2)
+    key = manager._availability_cache_key('2026-10-20')
+    first = manager.availability_cache.get(key)
+    manager.check_availability('2026-10-20', '21:00', 2)
+    assert list(first) == [('20:00', 2, '')]
+    assert len(manager.availability_cache.get(key)) == 2
+    manager.check_availability('2026-10-20', '20:00', 2)
+    assert len(manager.computed) == 2
+
+
+def test_reserved_table_is_filtered_without_clearing_other_dates():
+    manager = make_manager()
+    manager.check_availability('2026-10-20', '20:00', 2)
+    manager.check_availability('2026-10-21', '20:00', 2)
+
+    manager.tables_reserved([2])
+    manager._invalidate_availability('2026-10-20')
+
+    assert [t['id'] for t in manager.check_availability('2026-10-21', '20:00', 2)] == [1]
+    assert manager.computed == [('2026-10-20', '20:00'), ('2026-10-21', '20:00')]
+
+    manager.tables_changed()
+    manager.check_availability('2026-10-21', '20:00', 2)
+    assert len(manager.computed) == 3
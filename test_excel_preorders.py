@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Validación de pre-pedidos desde Excel (MenuManager.validate_excel_preorders)
+con una base simulada: no requiere MySQL
+"""
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from models import MenuManager, collation_key
+
+
+class FakeDB:
+    """Responde las consultas IN como lo haría MySQL con utf8mb4_unicode_ci"""
+
+    def __init__(self, platos, reservas):
+        self.platos = platos
+        self.reservas = reservas
+
+    def execute_query(self, query, params=None, **kwargs):
+        if 'FROM platos' in query:
+            wanted = {collation_key(value) for value in params}
+            return [dict(p) for p in self.platos if collation_key(p['nombre']) in wanted]
+        if 'FROM reservas' in query:
+            return [dict(r) for r in self.reservas if r['id'] in params]
+        raise AssertionError(query)
+
+
+def make_manager():
+    return MenuManager(FakeDB(
+        platos=[
+            {'id': 1, 'nombre': 'Puré de papa', 'stock_disponible': 5, 'precio': 8.0},
+            {'id': 2, 'nombre': 'Sopa', 'stock_disponible': 0, 'precio': 3.0},
+        ],
+        reservas=[{'id': 7, 'estado': 'confirmada'}, {'id': 8, 'estado': 'cancelada'}],
+    ))
+
+
+def test_collation_key_ignores_case_accents_and_spaces():
+    assert collation_key(' PURE de Papa ') == collation_key('Puré de papa')
+
+
+def test_accented_name_matches_unaccented_row():
+    df = pd.DataFrame({'nombre_plato': ['Pure de papa'], 'cantidad': [2], 'id_reserva': [7]})
+    valid, errors = make_manager().validate_excel_preorders(df)
+    assert errors == []
+    assert valid[0]['plato_info']['id'] == 1
+    assert valid[0]['nombre_plato'] == 'Pure de papa'
+
+
+def test_row_messages_and_cumulative_stock():
+    df = pd.DataFrame({
+        'nombre_plato': ['Puré de papa', 'pure DE papa', 'Sopa', 'Nada', None],
+        'cantidad': [3, 3, 1, 'x', 1],
+        'id_reserva': [7, 7, 8, 9, 7],
+    })
+    valid, errors = make_manager().validate_excel_preorders(df)
+    assert [p['fila'] for p in valid] == [1]
+    assert errors == [
+        "Fila 2: El plato 'pure DE papa' no tiene stock suficiente "
+        "(disponible: 5, solicitado en el archivo: 6)",
+        "Fila 3: El plato 'Sopa' no tiene stock disponible",
+        "Fila 3: La reserva 8 no está confirmada",
+        "Fila 4: El plato 'Nada' no existe",
+        "Fila 4: La cantidad debe ser un número válido",
+        "Fila 4: La reserva 9 no existe",
+        "Fila 5: El nombre del plato es requerido",
+    ]
+
+
+def test_requested_quantity_carries_across_batches():
+    manager = make_manager()
+    solicitado = {}
+    first = pd.DataFrame({'nombre_plato': ['Puré de papa'], 'cantidad': [4], 'id_reserva': [7]}, index=[0])
+    second = pd.DataFrame({'nombre_plato': ['Pure de papa'], 'cantidad': [2], 'id_reserva': [7]}, index=[1])
+    assert manager.validate_excel_preorders(first, solicitado)[1] == []
+    errors = manager.validate_excel_preorders(second, solicitado)[1]
+    assert errors and errors[0].startswith("Fila 2: El plato 'Pure de papa' no tiene stock suficiente")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Trabajos de importación en segundo plano (backend/import_jobs.py): estados
+en_cola -> en_proceso -> completado/error, on_finish y expiración
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from import_jobs import ImportJobManager
+from scaling import AsyncTaskQueue
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None:
+        assert time.monotonic() < deadline, 'el trabajo no terminó'
+        time.sleep(0.01)
+
+
+def test_job_goes_through_queue_process_and_completion():
+    finished = []
+    manager = ImportJobManager(AsyncTaskQueue(max_workers=1), on_finish=lambda: finished.append(True))
+    started, release = threading.Event(), threading.Event()
+
+    def work(job, total):
+        started.set()
+        release.wait(5)
+        job.update(filas_procesadas=total, creados=total)
+        return {'creados': total}
+
+    first = manager.submit('platos', 1, work, 3)
+    second = manager.submit('platos', 1, lambda job: None)
+    assert started.wait(5)
+    assert first.to_dict()['estado'] == 'en_proceso'
+    assert first.iniciado_en is not None
+    # Un solo worker: el segundo espera en la cola
+    assert second.to_dict()['estado'] == 'en_cola'
+    assert manager.get_stats() == {'en_cola': 1, 'en_proceso': 1, 'completado': 0, 'error': 0}
+
+    release.set()
+    wait_finished(first)
+    wait_finished(second)
+    data = first.to_dict()
+    assert data['estado'] == 'completado'
+    assert data['resultado'] == {'creados': 3}
+    assert data['progreso']['filas_procesadas'] == 3
+    assert data['error'] is None and data['finalizado_en'] is not None
+    assert manager.get(first.id) is first
+    assert finished == [True, True]
+
+
+def test_exception_leaves_job_in_error():
+    finished = []
+    manager = ImportJobManager(AsyncTaskQueue(max_workers=1), on_finish=lambda: finished.append(True))
+
+    def work(job):
+        job.update(filas_procesadas=10)
+        raise ValueError('archivo corrupto')
+
+    job = manager.submit('platos', 1, work)
+    wait_finished(job)
+    data = job.to_dict()
+    assert data['estado'] == 'error'
+    assert data['error'] == 'archivo corrupto'
+    assert data['resultado'] is None
+    assert data['progreso']['filas_procesadas'] == 10
+    assert finished == [True]
+
+
+def test_finished_jobs_expire():
+    queue = AsyncTaskQueue(max_workers=1)
+    manager = ImportJobManager(queue, ttl=0)
+    job = manager.submit('platos', 1, lambda job: 'ok')
+    wait_finished(job)
+    time.sleep(0.01)
+    assert manager.get(job.id) is None
+    assert manager.get('no-existe') is None
+    # También se libera el resultado que guardaba la cola
+    assert queue.pending_tasks == {}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Índice de ocupación en memoria (backend/occupancy_index.py): límites de los
+intervalos, búsqueda hacia atrás con max_length y versiones por fecha
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from occupancy_index import DayOccupancy, OccupancyIndex, seconds_to_time, time_to_seconds
+
+H = 3600
+
+
+def test_time_conversions():
+    assert time_to_seconds('20:15') == 20 * H + 15 * 60
+    assert time_to_seconds('20:15:30') == 20 * H + 15 * 60 + 30
+    assert seconds_to_time(24 * H) == '24:00:00'
+    assert time_to_seconds(seconds_to_time(25 * H + 61)) == 25 * H + 61
+
+
+def test_touching_intervals_do_not_overlap():
+    day = DayOccupancy()
+    day.add(1, 20 * H, 22 * H)
+    assert not day.overlaps(1, 22 * H, 24 * H)
+    assert not day.overlaps(1, 18 * H, 20 * H)
+    assert day.overlaps(1, 21 * H + 59 * 60, 24 * H)
+    assert day.overlaps(1, 18 * H, 20 * H + 1)
+    assert day.overlaps(1, 20 * H + 30 * 60, 20 * H + 45 * 60)
+    assert not day.overlaps(2, 20 * H, 22 * H)
+
+
+def test_long_reservation_found_behind_short_ones():
+    day = DayOccupancy()
+    day.add(1, 10 * H, 20 * H)
+    for start in (11, 12, 13):
+        day.add(1, start * H, start * H + 900)
+    assert day.max_length == 10 * H
+    # Las cortas anteriores no se solapan, pero la larga sigue abierta
+    assert day.overlaps(1, 15 * H, 16 * H)
+    assert not day.overlaps(1, 20 * H, 21 * H)
+
+
+def test_remove_frees_the_interval():
+    day = DayOccupancy()
+    day.add(1, 12 * H, 14 * H)
+    day.remove(1, 12 * H, 14 * H)
+    day.remove(1, 12 * H, 14 * H)
+    assert not day.overlaps(1, 12 * H, 14 * H)
+
+
+def test_overlaps_matches_linear_scan():
+    rng = random.Random(7)
+    for _ in range(200):
+        day = DayOccupancy()
+        intervals = []
+        for _ in range(rng.randint(0, 8)):
+            start = rng.randrange(0, 96) * 900
+            end = start + rng.randint(1, 16) * 900
+            day.add(1, start, end)
+            intervals.append((start, end))
+        start = rng.randrange(0, 96) * 900
+        end = start + rng.randint(1, 16) * 900
+        expected = any(s < end and e > start for s, e in intervals)
+        assert day.overlaps(1, start, end) == expected
+
+
+def test_index_load_add_remove():
+    index = OccupancyIndex()
+    assert index.busy_tables('2026-10-20', '20:00', 2 * H) is None
+
+    version = index.version('2026-10-20')
+    assert index.load('2026-10-20', [{'id': 1, 'id_mesa': 5, 'inicio': 20 * H, 'fin': 22 * H}], version)
+    assert index.busy_tables('2026-10-20', '21:00', 2 * H) == {5}
+    assert index.busy_tables('2026-10-20', '22:00', 2 * H) == set()
+
+    index.add(2, 6, '2026-10-20 00:00:00', '22:00', '24:00')
+    assert index.busy_tables('2026-10-20', '22:00', 2 * H) == {6}
+
+    assert index.remove(1) == '2026-10-20'
+    assert index.remove(1) is None
+    assert index.busy_tables('2026-10-20', '21:00', H) == set()
+
+
+def test_stale_load_is_discarded():
+    index = OccupancyIndex()
+    version = index.version('2026-10-20')
+    # Una escritura mientras se consultaba MySQL deja la carga vieja
+    index.add(3, 5, '2026-10-20', '20:00', '22:00')
+    assert not index.load('2026-10-20', [], version)
+    assert index.busy_tables('2026-10-20', '20:00', H) is None
+
+
+def test_expired_and_invalidated_dates_are_reloaded():
+    index = OccupancyIndex(ttl=-1)
+    index.load('2026-10-20', [], index.version('2026-10-20'))
+    assert index.busy_tables('2026-10-20', '20:00', H) is None
+
+    index = OccupancyIndex()
+    index.load('2026-10-20', [], index.version('2026-10-20'))
+    index.invalidate('2026-10-20')
+    assert index.busy_tables('2026-10-20', '20:00', H) is None
+    assert index.get_stats()['fechas_cargadas'] == 0
+
+
+def test_max_dates_evicts_oldest():
+    index = OccupancyIndex(max_dates=2)
+    for fecha in ('2026-10-20', '2026-10-21', '2026-10-22'):
+        index.load(fecha, [], index.version(fecha))
+    assert index.busy_tables('2026-10-20', '20:00', H) is None
+    assert index.busy_tables('2026-10-22', '20:00', H) == set()
+
+
+def test_table_cache_expires():
+    index = OccupancyIndex(ttl=-1)
+    tables, version = index.get_tables()
+    index.set_tables([{'id': 1}], version)
+    # Cambios hechos por otros procesos (n8n, SQL) se ven al expirar
+    assert index.get_tables()[0] is None
+
+    index = OccupancyIndex()
+    tables, version = index.get_tables()
+    index.set_tables([{'id': 1}], version)
+    assert index.get_tables()[0] == [{'id': 1}]
+    index.invalidate_tables()
+    assert index.get_tables()[0] is None
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Listados de reservas con una reserva combinada (dos mesas): una sola fila
+por reserva con sus mesas en `mesas`. Base simulada: no requiere MySQL
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from models import ReservationManager, RowStream
+
+MESAS = {1: '1', 2: '2', 3: '3'}
+
+RESERVAS = [
+    # Reserva de 6 comensales en las mesas 1 y 2
+    {'id': 10, 'id_usuario': 5, 'id_mesa': 1, 'id_reserva_principal': None, 'fecha': '2026-10-20',
+     'hora': '20:00:00', 'numero_comensales': 4, 'estado': 'confirmada'},
+    {'id': 11, 'id_usuario': 5, 'id_mesa': 2, 'id_reserva_principal': 10, 'fecha': '2026-10-20',
+     'hora': '20:00:00', 'numero_comensales': 2, 'estado': 'confirmada'},
+    # Reserva de una sola mesa
+    {'id': 12, 'id_usuario': 5, 'id_mesa': 3, 'id_reserva_principal': None, 'fecha': '2026-10-19',
+     'hora': '13:00:00', 'numero_comensales': 2, 'estado': 'confirmada'},
+]
+
+
+class FakeDB:
+    """Aplica el filtro de reservas principales y arma mesas_adicionales como MySQL"""
+
+    def __init__(self):
+        self.queries = []
+
+    def _rows(self, query):
+        self.queries.append(query)
+        rows = [r for r in RESERVAS if 'r.id_reserva_principal IS NULL' not in query
+                or r['id_reserva_principal'] is None]
+        result = []
+        for r in sorted(rows, key=lambda r: (r['fecha'], r['hora'], r['id']), reverse=True):
+            row = dict(r, mesa_numero=MESAS[r['id_mesa']], zona_nombre='Salón')
+            if 'mesas_adicionales' in query:
+                extra = [
+                    {'id_reserva': c['id'], 'id_mesa': c['id_mesa'], 'mesa_numero': MESAS[c['id_mesa']],
+                     'numero_comensales': c['numero_comensales']}
+                    for c in RESERVAS if c['id_reserva_principal'] == r['id']
+                ]
+                row['mesas_adicionales'] = json.dumps(extra) if extra else None
+            result.append(row)
+        return result
+
+    def execute_query(self, query, params=None, **kwargs):
+        return self._rows(query)
+
+    def stream_query(self, query, params=None, batch_size=500):
+        return RowStream(self, 'conexion', FakeCursor(self._rows(query)), batch_size)
+
+    def return_connection(self, connection):
+        pass
+
+    def discard_connection(self, connection):
+        pass
+
+
+class FakeCursor:
+    description = []
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        pass
+
+
+def check_combined(rows):
+    assert [row['id'] for row in rows] == [10, 12]
+    combined = rows[0]
+    assert [mesa['id_mesa'] for mesa in combined['mesas']] == [1, 2]
+    assert [mesa['id_reserva'] for mesa in combined['mesas']] == [10, 11]
+    assert combined['comensales_total'] == 6
+    assert 'mesas_adicionales' not in combined
+    assert rows[1]['mesas'] == [{'id_reserva': 12, 'id_mesa': 3, 'mesa_numero': '3', 'numero_comensales': 2}]
+    assert rows[1]['comensales_total'] == 2
+
+
+def test_user_listing_and_page_have_one_row_per_booking():
+    manager = ReservationManager(FakeDB())
+    check_combined(manager.get_user_reservations(5))
+    check_combined(manager.get_user_reservations_page(5, limit=10)['reservas'])
+
+
+def test_admin_page_and_stream_have_one_row_per_booking():
+    manager = ReservationManager(FakeDB())
+    check_combined(manager.get_reservations_page(limit=10)['reservas'])
+    check_combined(list(manager.get_all_reservations(stream=True)))
+    check_combined(manager.get_all_reservations())
+
+
+def test_table_filter_matches_additional_tables():
+    db = FakeDB()
+    ReservationManager(db).get_all_reservations(id_mesa=2)
+    assert 'rc.id_reserva_principal = r.id AND rc.id_mesa = %s' in db.queries[-1]
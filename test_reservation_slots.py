@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Alineación de reservas a slots de 15 minutos (reservas_slots): horas
+aceptadas, duración redondeada y edición de reservas anteriores con horas
+sueltas. Base simulada: no requiere MySQL
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from models import HORA_NO_ALINEADA, RESERVATION_SLOT_SECONDS, ReservationManager, slot_aligned
+
+
+class FakeCursor:
+    def __init__(self, reserva):
+        self.reserva = reserva
+        self.slots = []
+        self.result = None
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        if query.startswith("SELECT fecha, hora"):
+            self.result = [dict(self.reserva)]
+        elif query.startswith("SELECT id, id_mesa"):
+            self.result = [{'id': self.reserva['id'], 'id_mesa': self.reserva['id_mesa']}]
+        else:
+            self.rowcount = 1
+
+    def executemany(self, query, rows):
+        self.slots.extend(row[2] for row in rows)
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeDB:
+    def __init__(self, duracion_minutos, reserva=None):
+        self.duracion_minutos = duracion_minutos
+        self.cursor = FakeCursor(reserva or {})
+
+    def execute_query(self, query, params=None, **kwargs):
+        if 'configuracion_sistema' in query:
+            return {'valor': str(self.duracion_minutos)}
+        raise AssertionError(query)
+
+    @contextmanager
+    def transaction(self):
+        yield self.cursor
+
+
+def test_slot_aligned():
+    assert slot_aligned('19:15') and slot_aligned('19:45:00')
+    assert not slot_aligned('19:10') and not slot_aligned('19:15:30') and not slot_aligned('tarde')
+
+
+def test_duration_rounds_up_to_whole_slots():
+    assert ReservationManager(FakeDB(100)).reservation_duration() == 105 * 60
+    assert ReservationManager(FakeDB(120)).reservation_duration() == 120 * 60
+    assert ReservationManager(FakeDB(5)).reservation_duration() == RESERVATION_SLOT_SECONDS
+
+
+def test_offered_times_are_aligned():
+    horario = {'cerrado': False, 'hora_apertura': '12:10', 'hora_cierre': '14:00'}
+    slots = ReservationManager._day_slots(horario, 20)
+    assert slots[0] == 12 * 3600 + 15 * 60
+    assert all(slot % RESERVATION_SLOT_SECONDS == 0 for slot in slots)
+
+
+def test_update_keeps_legacy_unaligned_time():
+    reserva = {'id': 1, 'id_mesa': 3, 'fecha': '2026-10-20', 'hora': '19:10:00'}
+    manager = ReservationManager(FakeDB(120, reserva))
+    manager.occupancy = None
+    # Cancelar o editar sin cambiar la hora sigue funcionando
+    assert manager.update_reservation(1, '2026-10-20', '19:10', 4, None, 'cancelada') == (1, None)
+
+
+def test_update_rejects_new_unaligned_time():
+    reserva = {'id': 1, 'id_mesa': 3, 'fecha': '2026-10-20', 'hora': '19:00:00'}
+    manager = ReservationManager(FakeDB(120, reserva))
+    assert manager.update_reservation(1, '2026-10-20', '19:10', 4, None, 'confirmada') == (0, HORA_NO_ALINEADA)
+
+    manager = ReservationManager(FakeDB(120, reserva))
+    manager.occupancy = None
+    assert manager.update_reservation(1, '2026-10-20', '19:15', 4, None, 'confirmada') == (1, None)
+    assert manager.db.cursor.slots == list(range(77, 85))
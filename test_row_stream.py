@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Liberación de la conexión de Database.stream_query (RowStream): al terminar
+vuelve al pool y al cerrarse antes, aunque nunca se haya iterado, se descarta
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from models import RowStream
+
+
+class FakeCursor:
+    description = []
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.closed = False
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self):
+        self.returned = []
+        self.discarded = []
+
+    def return_connection(self, connection):
+        self.returned.append(connection)
+
+    def discard_connection(self, connection):
+        self.discarded.append(connection)
+
+
+def make_stream(rows, batch_size=2):
+    pool = FakePool()
+    return pool, RowStream(pool, 'conexion', FakeCursor(rows), batch_size)
+
+
+def test_fully_read_returns_connection():
+    pool, stream = make_stream([{'id': 1}, {'id': 2}, {'id': 3}])
+    assert [row['id'] for row in stream.map(lambda row: dict(row, doble=row['id'] * 2))] == [1, 2, 3]
+    stream.close()
+    assert pool.returned == ['conexion'] and pool.discarded == []
+
+
+def test_close_without_iterating_discards_connection():
+    # Respuesta HEAD o cliente desconectado antes del primer bloque
+    pool, stream = make_stream([{'id': 1}])
+    stream.close()
+    stream.close()
+    assert pool.discarded == ['conexion'] and pool.returned == []
+
+
+def test_abandoned_iteration_discards_connection():
+    pool, stream = make_stream([{'id': i} for i in range(10)])
+    rows = iter(stream)
+    next(rows)
+    rows.close()
+    assert pool.discarded == ['conexion'] and pool.returned == []
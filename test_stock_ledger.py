@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Libro de stock en memoria (backend/stock_ledger.py) con los lotes de MySQL
+simulados: lotes fuera del lock del shard e invalidación por plato
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from stock_ledger import StockLedger
+
+
+class FakeLedger(StockLedger):
+    """Lotes tomados de un stock en memoria en lugar de `platos`"""
+
+    def __init__(self, stock, **kwargs):
+        super().__init__({}, shards=1, **kwargs)
+        self.stock = dict(stock)
+        self.during_lease = None
+
+    def _lease(self, id_plato, needed):
+        _, lock = self._shard(id_plato)
+        assert not lock.locked(), 'el lote se pidió con el lock del shard tomado'
+        if self.during_lease:
+            self.during_lease()
+        amount = min(max(self.lease_size, needed), self.stock.get(id_plato, 0))
+        self.stock[id_plato] = self.stock.get(id_plato, 0) - amount
+        return amount
+
+
+def test_reserve_leases_without_holding_the_shard_lock():
+    ledger = FakeLedger({1: 50, 2: 5}, lease_size=20)
+    assert ledger.reserve({1: 3, 2: 2})
+    assert ledger.available(1) == 17 and ledger.stock[1] == 30
+    assert ledger.available(2) == 3 and ledger.stock[2] == 0
+
+
+def test_reserve_is_all_or_nothing():
+    ledger = FakeLedger({1: 50, 2: 1}, lease_size=20)
+    assert not ledger.reserve({1: 3, 2: 2})
+    assert ledger.available(1) == 20
+    assert ledger.get_stats()['rechazos'] == 1
+
+
+def test_invalidate_many_keeps_other_dishes():
+    ledger = FakeLedger({1: 50, 2: 50}, lease_size=20)
+    assert ledger.reserve({1: 1, 2: 1})
+    ledger.invalidate_many([1])
+    assert ledger.available(1) is None
+    assert ledger.available(2) == 19
+
+
+def test_lease_from_invalidated_stock_is_discarded():
+    ledger = FakeLedger({1: 50}, lease_size=20)
+    assert ledger.reserve({1: 20})
+    # El administrador fija el stock mientras se pide el lote siguiente
+    ledger.during_lease = lambda: ledger.invalidate(1)
+    assert not ledger.reserve({1: 5})
+    assert ledger.available(1) == 0
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Asignación automática de mesas (backend/table_allocator.py): la búsqueda con
+poda debe dar el mismo óptimo (asientos vacíos, mesas) que la fuerza bruta
+"""
+import math
+import os
+import random
+import sys
+from itertools import combinations
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from table_allocator import TableAllocator
+
+
+def table(id_mesa, capacidad, x, y, zona=1):
+    return {'id': id_mesa, 'capacidad': capacidad, 'id_zona': zona, 'posicion_x': x, 'posicion_y': y}
+
+
+def adjacent(a, b, distance):
+    return a['id_zona'] == b['id_zona'] and \
+        math.hypot(a['posicion_x'] - b['posicion_x'], a['posicion_y'] - b['posicion_y']) <= distance
+
+
+def connected(tables, distance):
+    seen, pending = {tables[0]['id']}, [tables[0]]
+    while pending:
+        current = pending.pop()
+        for other in tables:
+            if other['id'] not in seen and adjacent(current, other, distance):
+                seen.add(other['id'])
+                pending.append(other)
+    return len(seen) == len(tables)
+
+
+def brute_force(free, comensales, distance, max_tables):
+    """(asientos vacíos, mesas) de la mejor opción, o None"""
+    best = None
+    for size in range(1, max_tables + 1):
+        for group in combinations(free, size):
+            capacity = sum(t['capacidad'] for t in group)
+            if capacity >= comensales and connected(list(group), distance):
+                candidate = (capacity - comensales, size)
+                best = candidate if best is None else min(best, candidate)
+    return best
+
+
+def test_single_table_best_fit():
+    tables = [table(1, 6, 0, 0), table(2, 4, 100, 0), table(3, 2, 200, 0)]
+    assert [t['id'] for t in TableAllocator().allocate(tables, tables, 3)] == [2]
+    assert [t['id'] for t in TableAllocator().allocate(tables, tables, 6)] == [1]
+
+
+def test_combines_only_adjacent_tables_of_the_same_zone():
+    tables = [table(1, 4, 0, 0), table(2, 4, 20, 0), table(3, 4, 200, 0), table(4, 4, 20, 0, zona=2)]
+    allocator = TableAllocator(adjacency_distance=30)
+    assert sorted(t['id'] for t in allocator.allocate(tables, tables, 8)) == [1, 2]
+    free = [tables[0], tables[2], tables[3]]
+    assert TableAllocator(adjacency_distance=30).allocate(tables, free, 8) is None
+
+
+def test_no_free_tables():
+    tables = [table(1, 4, 0, 0)]
+    assert TableAllocator().allocate(tables, [], 2) is None
+
+
+def test_matches_brute_force():
+    rng = random.Random(2024)
+    for _ in range(300):
+        tables = [
+            table(i, rng.choice((2, 4, 6, 8)), rng.randrange(0, 80, 10), rng.randrange(0, 40, 10),
+                  rng.choice((1, 2)))
+            for i in range(1, rng.randint(2, 10) + 1)
+        ]
+        free = [t for t in tables if rng.random() < 0.8]
+        comensales = rng.randint(1, 20)
+        max_tables = rng.choice((1, 2, 3, 3))
+        allocator = TableAllocator(adjacency_distance=30, max_tables=max_tables)
+
+        result = allocator.allocate(tables, free, comensales)
+        expected = brute_force(free, comensales, 30, max_tables)
+        if expected is None:
+            assert result is None
+            continue
+        assert result is not None
+        assert connected(result, 30)
+        assert all(t in free for t in result)
+        capacity = sum(t['capacidad'] for t in result)
+        assert (capacity - comensales, len(result)) == expected
+
+
+def test_split_guests_fills_largest_first():
+    tables = [table(1, 6, 0, 0), table(2, 4, 20, 0)]
+    assert TableAllocator.split_guests(tables, 8) == [6, 2]
+    assert TableAllocator.split_guests(tables, 10) == [6, 4]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Lectura por lotes de archivos subidos (backend/upload_reader.py)
+"""
+import io
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from upload_reader import TabularUpload, UploadError
+
+
+class FakeFile:
+    """Equivalente mínimo de werkzeug FileStorage"""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.stream = io.BytesIO(data)
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return tmp_path
+
+
+def test_oversized_upload_leaves_no_temp_file(temp_dir):
+    upload = TabularUpload(FakeFile('grande.csv', b'x' * 2048), max_bytes=1024)
+    with pytest.raises(UploadError):
+        with upload:
+            pass
+    assert list(temp_dir.iterdir()) == []
+    assert upload.path is None
+
+
+def test_temp_file_removed_on_exit(temp_dir):
+    with TabularUpload(FakeFile('a.csv', b'a,b\n1,2\n')) as upload:
+        assert os.path.exists(upload.path)
+        assert upload.sha256
+    assert list(temp_dir.iterdir()) == []
+
+
+def test_csv_batches_keep_row_positions(temp_dir):
+    data = 'nombre_plato;cantidad;id_reserva\nPizza;2;7\n;;\nSopa;1;8\nPasta;3;7\n;;\n;;\n'.encode()
+    with TabularUpload(FakeFile('p.csv', data), batch_rows=2) as upload:
+        batches = list(upload.batches(['nombre_plato', 'cantidad', 'id_reserva']))
+    # La fila vacía intermedia llega (y la validación la reporta); las del final no
+    assert [list(df.index) for df in batches] == [[0, 1], [2, 3]]
+    assert batches[0]['nombre_plato'][0] == 'Pizza'
+    assert batches[0].loc[1].isna().all()
+    assert list(batches[1]['nombre_plato']) == ['Sopa', 'Pasta']
+
+
+def test_xlsx_header_mapping_and_missing_columns(temp_dir):
+    buffer = io.BytesIO()
+    pd.DataFrame({'Nombre': ['A'], 'Stock': [3], 'Codigo': [1]}).to_excel(buffer, index=False)
+    mapping = {'stock': 'stock_disponible', 'codigo': 'id'}
+    with TabularUpload(FakeFile('p.xlsx', buffer.getvalue())) as upload:
+        assert upload.check_header(['id', 'nombre'], mapping) == ['nombre', 'stock_disponible', 'id']
+        with pytest.raises(UploadError) as error:
+            upload.check_header(['precio'], mapping)
+    assert error.value.details['columnas_faltantes'] == ['precio']
+
+
+def test_row_limit(temp_dir):
+    with TabularUpload(FakeFile('p.csv', b'a\n1\n2\n3\n'), max_rows=2) as upload:
+        with pytest.raises(UploadError):
+            list(upload.batches(['a']))